@@ -0,0 +1,178 @@
+import time
+import random
+import asyncio
+import argparse
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import av
+import cv2
+import numpy as np
+from aiortc import RTCPeerConnection, RTCRtpSender
+
+from codec_utils import CodecSettings, apply_codec_settings
+from frame_utils import FrameBuilder
+from rate_control import AdaptiveStreamTrack, RateController, set_jitter_buffer
+
+BITS: int = 16 # Drawn into each frame, 12 for the frame number and 4 of checksum
+
+
+class Link:
+    # Bottleneck between the peers: rate bytes/s, a router queue of max_delay
+    # seconds (datagrams that do not fit are lost) and random loss
+    def __init__(self, rate: float, max_delay: float, loss: float = 0.0) -> None:
+        self.rate: float = rate
+        self.max_delay: float = max_delay
+        self.loss: float = loss
+        self.free: float = 0.0 # When the link is free again
+        self.lost: int = 0
+
+    def shape(self, sender: RTCRtpSender) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        connection = sender.transport.transport._connection
+        for protocol in connection._protocols:
+            transport = protocol.transport
+            sendto = transport.sendto
+
+            def deliver(data: bytes, addr, transport=transport, sendto=sendto) -> None:
+                if not transport.is_closing():
+                    sendto(data, addr)
+
+            def shaped_sendto(data: bytes, addr=None, deliver=deliver) -> None:
+                start: float = max(loop.time(), self.free)
+                if start - loop.time() > self.max_delay or random.random() < self.loss:
+                    self.lost += 1
+                    return
+                self.free = start + len(data) / self.rate
+                loop.call_at(self.free, deliver, data, addr)
+
+            transport.sendto = shaped_sendto
+
+
+class NumberedStreamTrack(AdaptiveStreamTrack):
+    # Camera-like panning texture with the frame number drawn as a barcode
+    # in the top band, which survives scaling and lossy coding
+    def __init__(self, width: int = 640, height: int = 480) -> None:
+        super().__init__()
+        texture: np.ndarray = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        self.texture: np.ndarray = cv2.GaussianBlur(texture, (0, 0), 2)
+        self.builder: FrameBuilder = FrameBuilder()
+        self.number: int = 0
+        self.sent: Dict[int, float] = {}
+
+    async def recv(self) -> av.VideoFrame:
+        pts, time_base = await self.next_timestamp()
+        self.number = (self.number + 1) % (1 << BITS - 4)
+        image: np.ndarray = np.roll(self.texture, 3 * self.number, axis=1)
+        write_number(image, self.number)
+        frame: av.VideoFrame = self.builder.build(self.scale_image(image), pts, time_base)
+        self.sent[self.number] = time.perf_counter()
+        return frame
+
+
+def checksum(number: int) -> int:
+    return (number + (number >> 4) + (number >> 8)) & 15
+
+
+def write_number(image: np.ndarray, number: int) -> None:
+    number |= checksum(number) << BITS - 4
+    band: int = image.shape[0] // 6
+    width: int = image.shape[1] // BITS
+    for bit in range(BITS):
+        image[:band, bit * width:(bit + 1) * width] = 255 if number >> bit & 1 else 0
+
+
+def read_number(image: np.ndarray) -> Optional[int]:
+    band: int = image.shape[0] // 6
+    width: int = image.shape[1] // BITS
+    number: int = 0
+    for bit in range(BITS):
+        # Away from the block edges, where the codec blurs
+        block: np.ndarray = image[band // 4:band * 3 // 4, bit * width + width // 4:(bit + 1) * width - width // 4]
+        if block.mean() > 128:
+            number |= 1 << bit
+    # A frame decoded without its references may be garbled
+    value: int = number & (1 << BITS - 4) - 1
+    return value if number >> BITS - 4 == checksum(value) else None
+
+
+async def run(adaptive: bool, phases: List[Tuple[str, float, float, float]], max_delay: float) -> None:
+    sender_pc, receiver_pc = RTCPeerConnection(), RTCPeerConnection()
+    track: NumberedStreamTrack = NumberedStreamTrack()
+    sender: RTCRtpSender = sender_pc.addTrack(track)
+    apply_codec_settings(sender_pc, sender, CodecSettings("VP8"))
+    latencies: List[Tuple[float, float]] = []
+    sizes: List[Tuple[float, int]] = []
+
+    async def consume(remote) -> None:
+        while True:
+            frame: av.VideoFrame = await remote.recv()
+            now: float = time.perf_counter()
+            number: Optional[int] = read_number(frame.to_ndarray(format="gray"))
+            if number in track.sent:
+                latencies.append((now, now - track.sent[number]))
+                sizes.append((now, frame.width))
+
+    tasks: List[asyncio.Task] = []
+    @receiver_pc.on("track")
+    def on_track(remote) -> None:
+        if adaptive:
+            set_jitter_buffer(receiver_pc, remote)
+        tasks.append(asyncio.ensure_future(consume(remote)))
+
+    await sender_pc.setLocalDescription(await sender_pc.createOffer())
+    await receiver_pc.setRemoteDescription(sender_pc.localDescription)
+    await receiver_pc.setLocalDescription(await receiver_pc.createAnswer())
+    await sender_pc.setRemoteDescription(receiver_pc.localDescription)
+
+    link: Link = Link(phases[0][1], max_delay)
+    link.shape(sender)
+    controller: RateController = RateController(sender_pc)
+    if adaptive:
+        controller.add(sender)
+        controller.start()
+
+    print("adaptive" if adaptive else "fixed")
+    for name, rate, loss, duration in phases:
+        link.rate, link.loss = rate, loss
+        start: float = time.perf_counter()
+        await asyncio.sleep(duration)
+        end: float = time.perf_counter()
+        # The last half of the phase, once the controller has settled
+        recent: np.ndarray = np.array([latency for at, latency in latencies if start + duration / 2 <= at <= end]) * 1000
+        widths: List[int] = [width for at, width in sizes if start + duration / 2 <= at <= end]
+        if len(recent) == 0:
+            print(f"  {name:<14} no frames received")
+            continue
+        print(
+            f"  {name:<14} {len(recent) / (duration / 2):5.1f} fps, width {min(widths)}-{max(widths)}, "
+            f"latency p50 {np.percentile(recent, 50):6.0f}ms, p95 {np.percentile(recent, 95):6.0f}ms, "
+            f"max {recent.max():6.0f}ms"
+        )
+
+    controller.stop()
+    for task in tasks:
+        task.cancel()
+    track.stop()
+    await sender_pc.close()
+    await receiver_pc.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Glass-to-glass latency of a video track when the link bandwidth drops")
+    parser.add_argument("--good", type=float, default=2e6, help="Link rate before and after the drop, bits/s")
+    parser.add_argument("--bad", type=float, default=150e3, help="Link rate during the drop, bits/s")
+    parser.add_argument("--loss", type=float, default=0.02, help="Random loss during the drop")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per phase")
+    parser.add_argument("--max-delay", type=float, default=2.0, help="Router queue, seconds")
+    parser.add_argument("--mode", choices=("fixed", "adaptive", "both"), default="both")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    phases: List[Tuple[str, float, float, float]] = [
+        ("good link", args.good / 8, 0.0, args.duration),
+        ("bandwidth drop", args.bad / 8, args.loss, args.duration),
+        ("recovered", args.good / 8, 0.0, args.duration),
+    ]
+    for adaptive in ((False, True) if args.mode == "both" else (args.mode == "adaptive",)):
+        asyncio.run(run(adaptive, phases, args.max_delay))
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import argparse
+import logging
+from typing import List
+
+import numpy as np
+from aiortc import RTCPeerConnection
+
+from state_codec import StateCodec, TELEMETRY_STATE
+from batch_sender import BatchSender, LOW_WATERMARK, HIGH_WATERMARK
+from benchmark_batching import DirectSender, connect
+
+
+def throttle(pc: RTCPeerConnection, rate: float, max_delay: float) -> None:
+    # Shape every datagram of the connection to rate bytes/s behind a router
+    # queue of max_delay seconds, datagrams that do not fit are lost
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    connection = pc.sctp.transport.transport._connection
+    for protocol in connection._protocols:
+        transport = protocol.transport
+        sendto = transport.sendto
+        link: List[float] = [0.0] # When the link is free again
+
+        def deliver(data: bytes, addr, transport=transport, sendto=sendto) -> None:
+            if not transport.is_closing():
+                sendto(data, addr)
+
+        def shaped_sendto(data: bytes, addr=None, link=link, deliver=deliver) -> None:
+            start: float = max(loop.time(), link[0])
+            if start - loop.time() > max_delay:
+                return
+            link[0] = start + len(data) / rate
+            loop.call_at(link[0], deliver, data, addr)
+
+        transport.sendto = shaped_sendto
+
+
+async def run(policy: str, rate: float, link_rate: float, duration: float, watermarks: tuple) -> None:
+    sender_pc, receiver_pc, channel, remote = await connect()
+    throttle(sender_pc, link_rate, 0.1)
+    codec: StateCodec = StateCodec(TELEMETRY_STATE)
+    latencies: List[tuple] = []
+
+    @remote.on("message")
+    def on_message(message: bytes) -> None:
+        now: float = time.perf_counter()
+        for state in codec.decode_batch(message):
+            latencies.append((now, now - state["timestamp"]))
+
+    if policy == "none":
+        sender = DirectSender(channel, codec)
+    else:
+        low, high = watermarks
+        sender = BatchSender(channel, codec, "batch", 0.01, policy=policy, low_watermark=low, high_watermark=high)
+        task: asyncio.Task = asyncio.ensure_future(sender.run())
+
+    state: dict = {"pose": [0.0] * 7, "velocity": [0.0] * 6, "joints": [0.0] * 12}
+    start: float = time.perf_counter()
+    produced: int = 0
+    max_buffered: int = 0
+    while time.perf_counter() - start < duration:
+        if policy != "none":
+            await sender.writable()
+        produced += 1
+        sender.put(dict(state, timestamp=time.perf_counter()))
+        max_buffered = max(max_buffered, channel.bufferedAmount)
+        await asyncio.sleep(start + produced / rate - time.perf_counter())
+    end: float = time.perf_counter()
+    await asyncio.sleep(1.0)
+
+    if policy != "none":
+        sender.stop()
+        await task
+    await sender_pc.close()
+    await receiver_pc.close()
+
+    # Latency of the updates received during the last second of production
+    recent: np.ndarray = np.array([latency for received, latency in latencies if end - 1 <= received <= end]) * 1000
+    if len(recent) == 0:
+        recent = np.array([np.nan])
+    print(
+        f"  {policy:<8} {len(latencies)} of {produced} updates delivered, "
+        f"max bufferedAmount {max_buffered / 1024:7.1f}KB, "
+        f"last second latency p50 {np.percentile(recent, 50):7.1f}ms, p99 {np.percentile(recent, 99):7.1f}ms"
+    )
+
+
+async def benchmark(rate: float, link_rate: float, duration: float, watermarks: tuple) -> None:
+    print(
+        f"{rate:.0f} updates/s of {TELEMETRY_STATE.size} bytes over a {link_rate / 1024:.0f}KB/s link, "
+        f"watermarks {watermarks[0] / 1024:.0f}KB/{watermarks[1] / 1024:.0f}KB"
+    )
+    for policy in ("none", "drop", "coalesce", "pause"):
+        await run(policy, rate, link_rate, duration, watermarks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and latency of the congestion policies on a throttled link")
+    parser.add_argument("--rate", type=float, default=300)
+    parser.add_argument("--link-rate", type=float, default=16 * 1024, help="Bytes per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--low-watermark", type=int, default=LOW_WATERMARK)
+    parser.add_argument("--high-watermark", type=int, default=HIGH_WATERMARK)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(benchmark(args.rate, args.link_rate, args.duration, (args.low_watermark, args.high_watermark)))
@@ -0,0 +1,101 @@
+import time
+import asyncio
+import argparse
+import logging
+from typing import List
+
+import numpy as np
+from aiortc import RTCDataChannel, RTCPeerConnection
+
+from state_codec import StateCodec, TELEMETRY_STATE
+from batch_sender import BatchSender
+
+
+class DirectSender:
+    # The previous behaviour, one message per update
+    def __init__(self, data_channel: RTCDataChannel, codec: StateCodec) -> None:
+        self.data_channel: RTCDataChannel = data_channel
+        self.codec: StateCodec = codec
+        self.messages: int = 0
+
+    def put(self, state: dict) -> None:
+        self.data_channel.send(self.codec.encode(state))
+        self.messages += 1
+
+
+async def connect() -> tuple:
+    # Two peer connections in one process, no signaling server needed
+    sender_pc, receiver_pc = RTCPeerConnection(), RTCPeerConnection()
+    channel: RTCDataChannel = sender_pc.createDataChannel("datachannel")
+    received: asyncio.Future = asyncio.get_running_loop().create_future()
+    receiver_pc.on("datachannel", lambda channel: received.set_result(channel))
+
+    await sender_pc.setLocalDescription(await sender_pc.createOffer())
+    await receiver_pc.setRemoteDescription(sender_pc.localDescription)
+    await receiver_pc.setLocalDescription(await receiver_pc.createAnswer())
+    await sender_pc.setRemoteDescription(receiver_pc.localDescription)
+
+    remote: RTCDataChannel = await received
+    while channel.readyState != "open":
+        await asyncio.sleep(0.01)
+    return sender_pc, receiver_pc, channel, remote
+
+
+async def run(mode: str, rate: float, duration: float, window: float) -> None:
+    sender_pc, receiver_pc, channel, remote = await connect()
+    codec: StateCodec = StateCodec(TELEMETRY_STATE)
+    latencies: List[float] = []
+    messages: List[int] = [0]
+
+    @remote.on("message")
+    def on_message(message: bytes) -> None:
+        messages[0] += 1
+        now: float = time.perf_counter()
+        for state in codec.decode_batch(message):
+            latencies.append(now - state["timestamp"])
+
+    if mode == "direct":
+        sender = DirectSender(channel, codec)
+    else:
+        sender = BatchSender(channel, codec, mode, window)
+        task: asyncio.Task = asyncio.ensure_future(sender.run())
+
+    state: dict = {"pose": [0.0] * 7, "velocity": [0.0] * 6, "joints": [0.0] * 12}
+    start: float = time.perf_counter()
+    produced: int = 0
+    while time.perf_counter() - start < duration:
+        produced += 1
+        sender.put(dict(state, timestamp=time.perf_counter()))
+        await asyncio.sleep(start + produced / rate - time.perf_counter())
+    await asyncio.sleep(0.5) # Let the last messages arrive
+
+    if mode != "direct":
+        sender.stop()
+        await task
+    await sender_pc.close()
+    await receiver_pc.close()
+
+    latencies: np.ndarray = np.array(latencies) * 1000
+    print(
+        f"  {mode:<7} {messages[0] / duration:7.0f} messages/s, "
+        f"{len(latencies) / duration:7.0f} of {produced / duration:.0f} updates/s delivered, "
+        f"latency p50 {np.percentile(latencies, 50):6.2f}ms, p99 {np.percentile(latencies, 99):6.2f}ms"
+    )
+
+
+async def benchmark(rates: List[float], duration: float, window: float) -> None:
+    for rate in rates:
+        print(f"{rate:.0f} updates/s, {window * 1000:.0f}ms window")
+        for mode in ("direct", "batch", "latest"):
+            await run(mode, rate, duration, window)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Messages per second and latency of the data channel send modes")
+    parser.add_argument("--rates", type=float, nargs="+", default=[30, 300, 3000])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--window", type=float, default=0.03)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(benchmark(args.rates, args.duration, args.window))
@@ -0,0 +1,102 @@
+import io
+import time
+import asyncio
+import argparse
+import contextlib
+from typing import List, Tuple
+
+import av
+import cv2
+import numpy as np
+from aiortc import VideoStreamTrack
+
+import mock_jackal
+from mock_jackal import CameraStreamTrack
+
+
+class SlowVideoCapture:
+    # Stand-in for cv2.VideoCapture, read blocks like a real camera does
+    def __init__(self, camera_id: int = 0, read_time: float = 0.03) -> None:
+        self.read_time: float = read_time
+        self.frame: np.ndarray = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    def get(self, prop: int) -> float:
+        return {cv2.CAP_PROP_FRAME_WIDTH: 640, cv2.CAP_PROP_FRAME_HEIGHT: 480}.get(prop, 0)
+
+    def read(self, image: np.ndarray = None) -> Tuple[bool, np.ndarray]:
+        time.sleep(self.read_time)
+        if image is None:
+            return True, self.frame.copy()
+        np.copyto(image, self.frame)
+        return True, image
+
+    def release(self) -> None:
+        pass
+
+
+class BlockingCameraStreamTrack(VideoStreamTrack):
+    # The previous CameraStreamTrack, reading the camera on the event loop
+    def __init__(self, cap: SlowVideoCapture) -> None:
+        super().__init__()
+        self.cap: SlowVideoCapture = cap
+
+    async def recv(self) -> av.VideoFrame:
+        pts, time_base = await self.next_timestamp()
+        ret, frame = self.cap.read()
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
+        video_frame.pts, video_frame.time_base = pts, time_base
+        return video_frame
+
+
+async def measure_loop_latency(stop: asyncio.Event, interval: float = 0.005) -> List[float]:
+    # How late the event loop wakes a 5ms timer, i.e. how long it is blocked
+    lags: List[float] = []
+    while not stop.is_set():
+        start: float = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def run(track: VideoStreamTrack, duration: float) -> Tuple[List[float], int]:
+    stop: asyncio.Event = asyncio.Event()
+    probe: asyncio.Task = asyncio.ensure_future(measure_loop_latency(stop))
+    frames: int = 0
+    end: float = time.perf_counter() + duration
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.perf_counter() < end:
+            await track.recv()
+            frames += 1
+    stop.set()
+    return await probe, frames
+
+
+def report(name: str, lags: List[float], frames: int, duration: float) -> None:
+    lags: np.ndarray = np.array(lags) * 1000
+    print(
+        f"{name}: {frames / duration:.1f} fps, event loop lag "
+        f"p50 {np.percentile(lags, 50):.2f}ms, p99 {np.percentile(lags, 99):.2f}ms, max {lags.max():.2f}ms"
+    )
+
+
+async def benchmark(read_time: float, duration: float) -> None:
+    blocking: BlockingCameraStreamTrack = BlockingCameraStreamTrack(SlowVideoCapture(read_time=read_time))
+    lags, frames = await run(blocking, duration)
+    report("Read on the event loop", lags, frames, duration)
+
+    mock_jackal.cv2.VideoCapture = lambda camera_id: SlowVideoCapture(camera_id, read_time)
+    threaded: CameraStreamTrack = CameraStreamTrack()
+    lags, frames = await run(threaded, duration)
+    report("Capture thread", lags, frames, duration)
+    print(f"Capture thread read {threaded.ring.latest} frames, {threaded.dropped} dropped")
+    threaded.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Event loop latency of CameraStreamTrack with a slow camera")
+    parser.add_argument("--read-time", type=float, default=0.03, help="Seconds blocked in each camera read")
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.read_time, args.duration))
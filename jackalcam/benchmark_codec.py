@@ -0,0 +1,57 @@
+import argparse
+import fractions
+from typing import Dict, List, Tuple
+
+import av
+import cv2
+import numpy as np
+
+from codec_benchmark import CODECS, CodecBenchmark
+from codec_utils import CodecSettings, ConfiguredEncoder
+
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+
+
+class PrebuiltFrames:
+    # The frames are converted up front, only the codec is measured
+    def frame(self, frame: av.VideoFrame, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: av.VideoFrame) -> av.VideoFrame:
+        return frame
+
+
+def create_video_frames(width: int, height: int, count: int) -> List[av.VideoFrame]:
+    # Camera-like content: a smooth random texture panning a few pixels per frame
+    texture: np.ndarray = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    texture = cv2.GaussianBlur(texture, (0, 0), 3)
+    frames: List[av.VideoFrame] = []
+    for i in range(count):
+        image: np.ndarray = np.roll(texture, 4 * i, axis=1)
+        frames.append(av.VideoFrame.from_ndarray(image, format="bgr24").reformat(format="yuv420p"))
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU cost and bytes per frame of each codec at several resolutions")
+    parser.add_argument("--frames", type=int, default=90)
+    parser.add_argument("--warmup", type=int, default=0, help="First frames left out of the results")
+    parser.add_argument("--bitrate", type=int, default=None, help="Target bitrate, aiortc's default if not set")
+    parser.add_argument("--keyframe-interval", type=float, default=None)
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    args = parser.parse_args()
+
+    for name in args.resolutions:
+        width, height = RESOLUTIONS[name]
+        frames: List[av.VideoFrame] = create_video_frames(width, height, args.frames)
+        print(name)
+        for codec in CODECS:
+            settings: CodecSettings = CodecSettings(codec, keyframe_interval=args.keyframe_interval)
+            benchmark: CodecBenchmark = CodecBenchmark(codec, args.bitrate, args.warmup, lambda: ConfiguredEncoder(settings))
+            result: Dict[str, object] = benchmark.run(PrebuiltFrames(), frames, lambda decoded, frame: {})
+            print(
+                f"  {codec:<5} encode {result['encode_ms']['mean']:6.2f}ms, decode {result['decode_ms']['mean']:6.2f}ms, "
+                f"{result['bytes_per_frame'] / 1024:7.1f}KB per frame, PSNR {result['psnr']:5.2f}dB"
+            )
@@ -0,0 +1,71 @@
+import time
+import argparse
+import fractions
+import tracemalloc
+from typing import Callable, Tuple
+
+import av
+import cv2
+import numpy as np
+
+from frame_utils import FrameBuilder
+
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+
+
+def build_rgb24(image: np.ndarray, pts: int) -> av.VideoFrame:
+    # The previous path of every outgoing track
+    frame = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    frame = np.ascontiguousarray(frame)
+    video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
+    video_frame.pts, video_frame.time_base = pts, VIDEO_TIME_BASE
+    return video_frame
+
+
+def encoder_input(frame: av.VideoFrame) -> av.VideoFrame:
+    # What the VP8 encoder does before encoding, the cost belongs to the path
+    if frame.format.name != "yuv420p":
+        frame = frame.reformat(format="yuv420p")
+    return frame
+
+
+def measure(build: Callable[[np.ndarray, int], av.VideoFrame], image: np.ndarray, frames: int) -> Tuple[float, float]:
+    for i in range(10):
+        encoder_input(build(image, i))
+
+    tracemalloc.start()
+    allocated: int = 0
+    start: float = time.perf_counter()
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        encoder_input(build(image, i))
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+    elapsed: float = time.perf_counter() - start
+    tracemalloc.stop()
+    return elapsed / frames, allocated / frames
+
+
+def benchmark(frames: int) -> None:
+    for width, height in ((640, 480), (1920, 1080)):
+        image: np.ndarray = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        yuv_builder: FrameBuilder = FrameBuilder("yuv420p")
+        bgr_builder: FrameBuilder = FrameBuilder("bgr24")
+        paths = {
+            "rgb24 (previous)": build_rgb24,
+            "bgr24 wrapped": lambda image, pts: bgr_builder.build(image, pts, VIDEO_TIME_BASE),
+            "yuv420p prealloc": lambda image, pts: yuv_builder.build(image, pts, VIDEO_TIME_BASE),
+        }
+        print(f"{width}x{height}, {image.nbytes / 1e6:.2f}MB per BGR frame")
+        for name, build in paths.items():
+            per_frame, allocated = measure(build, image, frames)
+            print(f"  {name:<18} {per_frame * 1000:6.2f}ms/frame, {allocated / 1e6:6.2f}MB numpy allocations/frame")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frame construction time and allocations per outgoing frame")
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    benchmark(args.frames)
@@ -0,0 +1,95 @@
+import sys
+import time
+import asyncio
+import argparse
+from typing import Callable, List
+
+import numpy as np
+
+from pacing import Pacer
+
+
+class WallClockPacer:
+    # aiortc's next_timestamp: sleeps until start + n * period on time.time(),
+    # here on a wall clock the benchmark can make jump
+    def __init__(self, rate: float, clock: Callable[[], float]) -> None:
+        self.rate: float = rate
+        self.clock: Callable[[], float] = clock
+        self.start: float = None
+        self.index: int = 0
+
+    async def tick(self) -> float:
+        if self.start is None:
+            self.start = self.clock()
+        else:
+            self.index += 1
+            await asyncio.sleep(self.start + self.index / self.rate - self.clock())
+        return self.index / self.rate
+
+
+async def run(pacer, rate: float, duration: float, stall: float, jump: float, offset: List[float]) -> np.ndarray:
+    # Ticks for duration seconds, once a second the producer blocks the loop
+    # for stall seconds, halfway through the wall clock jumps forward by jump
+    times: List[float] = []
+    start: float = time.monotonic()
+    next_stall: float = start + 1.0
+    jumped: bool = False
+    while time.monotonic() - start < duration:
+        await pacer.tick()
+        now: float = time.monotonic()
+        times.append(now)
+        if now >= next_stall:
+            time.sleep(stall)
+            next_stall += 1.0
+        if not jumped and now - start >= duration / 2:
+            offset[0] += jump
+            jumped = True
+    return np.array(times)
+
+
+def report(name: str, times: np.ndarray, rate: float) -> int:
+    intervals: np.ndarray = np.diff(times)
+    period: float = 1.0 / rate
+    # A burst is a run of ticks released at once to catch up
+    short: np.ndarray = intervals < period / 4
+    burst, longest = 0, 0
+    for is_short in short:
+        burst = burst + 1 if is_short else 0
+        longest = max(longest, burst)
+    per_second: np.ndarray = np.histogram(times - times[0], bins=np.arange(0, times[-1] - times[0], 1.0))[0]
+    print(
+        f"  {name:<12} {len(times) / (times[-1] - times[0]):5.1f}/s, per second {per_second.min()}-{per_second.max()}, "
+        f"longest burst {longest}, max gap {intervals.max() * 1000:5.0f}ms"
+    )
+    return longest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pacing of a stream whose producer stalls and whose wall clock jumps")
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--duration", type=float, default=6)
+    parser.add_argument("--stall", type=float, default=0.2, help="Seconds the loop blocks once a second")
+    parser.add_argument("--jump", type=float, default=1.0, help="Seconds the wall clock jumps forward")
+    args = parser.parse_args()
+
+    offset: List[float] = [0.0]
+    wall_clock: Callable[[], float] = lambda: time.time() + offset[0]
+    pacers = {
+        "wall clock": WallClockPacer(args.rate, wall_clock),
+        "burst": Pacer(args.rate, skip=False),
+        "skip": Pacer(args.rate),
+    }
+    bursts = {}
+    for name, pacer in pacers.items():
+        offset[0] = 0.0
+        times: np.ndarray = asyncio.run(run(pacer, args.rate, args.duration, args.stall, args.jump, offset))
+        bursts[name] = report(name, times, args.rate)
+    stats: dict = pacers["skip"].stats
+    print(
+        f"  skip jitter: mean {stats['jitter_mean'] * 1000:.2f}ms, p95 {stats['jitter_p95'] * 1000:.2f}ms, "
+        f"max {stats['jitter_max'] * 1000:.1f}ms, {stats['skipped']} ticks skipped"
+    )
+
+    # Skipping must never release missed ticks in a burst
+    if bursts["skip"] > 1:
+        sys.exit(f"Skipping pacer burst {bursts['skip']} ticks")
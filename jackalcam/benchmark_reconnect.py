@@ -0,0 +1,168 @@
+import io
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+import logging
+from typing import List
+
+import aioice.ice
+import numpy as np
+import websockets
+from av import VideoFrame
+from aiortc import MediaStreamTrack, RTCDataChannel, RTCPeerConnection, VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from server import handler
+from signaling_utils import WebRTCClient, initiate_signaling, receive_signaling
+from settings import *
+
+
+class SourceTrack(VideoStreamTrack):
+    # Ends for good once stopped, as a released camera or a stopped worker does
+    async def recv(self) -> VideoFrame:
+        if self.readyState != "live":
+            raise MediaStreamError
+        return await super().recv()
+
+
+class BenchmarkJackal(WebRTCClient):
+    def __init__(self, signaling_ip: str, signaling_port: int, room: str) -> None:
+        super().__init__(signaling_ip, signaling_port, room=room, peer_id="jackal")
+        self.video_track: SourceTrack = SourceTrack()
+        self.opened: asyncio.Event = asyncio.Event()
+        self.lost: asyncio.Event = asyncio.Event()
+        self.lost_time: float = None
+
+    def reconnect(self) -> None:
+        if not self.lost.is_set():
+            self.lost_time = time.perf_counter()
+            self.lost.set()
+        super().reconnect()
+
+    def setup_peer_connection(self) -> None:
+        self.add_track(self.video_track)
+        data_channel: RTCDataChannel = self.pc.createDataChannel("datachannel")
+
+        @data_channel.on("open")
+        def on_open() -> None:
+            self.opened.set()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await initiate_signaling(self.pc, self.signaling)
+
+
+class BenchmarkStation(WebRTCClient):
+    def __init__(self, signaling_ip: str, signaling_port: int, room: str) -> None:
+        super().__init__(signaling_ip, signaling_port, room=room, peer_id="station")
+        self.negotiation_timeout = None
+        self.frames: int = 0
+        self.frame_received: asyncio.Event = asyncio.Event()
+
+    def setup_peer_connection(self) -> None:
+        @self.pc.on("track")
+        def on_track(track: MediaStreamTrack) -> None:
+            asyncio.ensure_future(self.__receive(track))
+
+    async def __receive(self, track: MediaStreamTrack) -> None:
+        while True:
+            try:
+                await track.recv()
+            except MediaStreamError:
+                return
+            self.frames += 1
+            self.frame_received.set()
+
+    async def wait_frames(self, count: int, timeout: float) -> int:
+        # Frames received within timeout, stops counting at count
+        start: int = self.frames
+        deadline: float = time.perf_counter() + timeout
+        while self.frames - start < count and time.perf_counter() < deadline:
+            self.frame_received.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.frame_received.wait(), deadline - time.perf_counter())
+        return self.frames - start
+
+    async def negotiate(self) -> asyncio.Task:
+        return await receive_signaling(self.pc, self.signaling)
+
+
+def kill_transport(pc: RTCPeerConnection) -> None:
+    # Silently drop every datagram of the current ICE connection, as a dead
+    # wifi link would, consent checks then fail and ICE gives up
+    for transceiver in pc.getTransceivers():
+        connection: aioice.ice.Connection = transceiver.sender.transport.transport._connection
+        for protocol in connection._protocols:
+            protocol.transport.sendto = lambda *args, **kwargs: None
+
+
+async def benchmark(port: int, runs: int, frames: int) -> None:
+    async with websockets.serve(handler, IP, port):
+        with contextlib.redirect_stdout(io.StringIO()):
+            station: BenchmarkStation = BenchmarkStation(IP, port, "reconnect")
+            jackal: BenchmarkJackal = BenchmarkJackal(IP, port, "reconnect")
+            station_task: asyncio.Task = asyncio.ensure_future(station.run())
+            await asyncio.sleep(0.1)
+            await jackal.run()
+            await station_task
+            await jackal.opened.wait()
+
+            detections: List[float] = []
+            recoveries: List[float] = []
+            resumes: List[float] = []
+            received: List[int] = []
+            for _ in range(runs):
+                jackal.opened.clear()
+                jackal.lost.clear()
+                killed: float = time.perf_counter()
+                kill_transport(jackal.pc)
+                kill_transport(station.pc)
+
+                await jackal.lost.wait()
+                # Recovered once the data channel of the rebuilt connection is open
+                await jackal.opened.wait()
+                detections.append(jackal.lost_time - killed)
+                recoveries.append(time.perf_counter() - jackal.lost_time)
+                # The video has to come back too, on the same source track
+                received.append(await station.wait_frames(frames, 3.0))
+                resumes.append(time.perf_counter() - jackal.lost_time)
+                if received[-1] < frames:
+                    break
+
+            jackal.done.set()
+            station.done.set()
+            await jackal.pc.close()
+            await station.pc.close()
+            await jackal.signaling.close()
+            await station.signaling.close()
+
+    if received[-1] < frames:
+        sys.exit(
+            f"Only {received[-1]} video frames within 3s of recovery, "
+            f"the source track is {jackal.video_track.readyState}"
+        )
+    detections, recoveries, resumes = np.array(detections), np.array(recoveries) * 1000, np.array(resumes) * 1000
+    print(f"Failure detected after {detections.mean():.2f}s on average")
+    print(
+        f"Recovered in mean {recoveries.mean():.1f}ms, "
+        f"max {recoveries.max():.1f}ms over {runs} transport kills"
+    )
+    print(f"{frames} video frames received again after mean {resumes.mean():.1f}ms, max {resumes.max():.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recovery time of WebRTCClient after a transport failure")
+    parser.add_argument("--port", type=int, default=PORT + 1)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=10, help="Video frames expected after each recovery")
+    parser.add_argument("--consent-interval", type=float, default=0.5, help="aioice defaults to 5s")
+    args = parser.parse_args()
+
+    # Detecting the failure is up to ICE consent freshness, which takes
+    # 30s with the aioice defaults, shorten it to keep the benchmark quick
+    aioice.ice.CONSENT_INTERVAL = args.consent_interval
+    aioice.ice.CONSENT_FAILURES = 3
+
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(benchmark(args.port, args.runs, args.frames))
@@ -0,0 +1,92 @@
+import time
+import queue
+import argparse
+import threading
+import tracemalloc
+import multiprocessing
+from typing import Any, List, Tuple
+
+import numpy as np
+
+from frame_ring import FrameRing
+
+SIZES: List[Tuple[int, int]] = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+
+
+def queue_consumer(frames: Any, results: Any, count: int) -> None:
+    latencies: List[float] = []
+    for _ in range(count):
+        timestamp, frame = frames.get()
+        latencies.append(time.time() - timestamp)
+    results.put(latencies)
+
+
+def ring_consumer(ring: FrameRing, results: Any, count: int) -> None:
+    out: np.ndarray = np.empty(ring.shape, dtype=ring.dtype)
+    latencies: List[float] = []
+    sequence: int = 0
+    while sequence < count:
+        sequence = ring.read_latest(out, sequence, timeout=1.0)
+        if sequence == 0:
+            break
+        latencies.append(time.time() - ring.timestamp(sequence))
+    results.put(latencies)
+
+
+def produce(transport: str, image: np.ndarray, count: int, fps: float) -> Tuple[List[float], float]:
+    threads: bool = transport.endswith("thread")
+    results: Any = queue.Queue() if threads else multiprocessing.Queue()
+    if transport.startswith("Queue"):
+        frames: Any = queue.Queue(maxsize=4) if threads else multiprocessing.Queue(maxsize=4)
+        target, args = queue_consumer, (frames, results, count)
+    else:
+        ring: FrameRing = FrameRing(image.shape)
+        target, args = ring_consumer, (ring, results, count)
+    worker = threading.Thread(target=target, args=args) if threads else multiprocessing.Process(target=target, args=args)
+    worker.start()
+    time.sleep(0.2)
+
+    tracemalloc.start()
+    allocated: int = 0
+    start: float = time.perf_counter()
+    for i in range(count):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        if transport.startswith("Queue"):
+            frame: np.ndarray = image.copy() # cv2.VideoCapture.read allocates each frame
+            frames.put((time.time(), frame))
+        else:
+            np.copyto(ring.begin_write(), image) # cap.read(slot) decodes in place
+            ring.end_write()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+        time.sleep(max(0.0, start + (i + 1) / fps - time.perf_counter()))
+    tracemalloc.stop()
+
+    latencies: List[float] = results.get()
+    worker.join()
+    if not transport.startswith("Queue"):
+        ring.close()
+    return latencies, allocated / count
+
+
+def benchmark(count: int, fps: float) -> None:
+    for width, height in SIZES:
+        image: np.ndarray = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        print(f"{width}x{height}, {image.nbytes / 1e6:.1f}MB frames at {fps:.0f} fps")
+        for transport in ("Queue thread", "FrameRing thread", "Queue process", "FrameRing process"):
+            latencies, allocated = produce(transport, image, count, fps)
+            latencies: np.ndarray = np.array(latencies) * 1000
+            print(
+                f"  {transport:<18} {len(latencies):3d} frames read, latency p50 {np.percentile(latencies, 50):6.2f}ms "
+                f"p99 {np.percentile(latencies, 99):6.2f}ms, producer allocates {allocated / 1e6:5.2f}MB/frame"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FrameRing against Queue for passing frames to a consumer")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--fps", type=float, default=30)
+    args = parser.parse_args()
+
+    benchmark(args.frames, args.fps)
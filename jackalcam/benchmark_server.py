@@ -0,0 +1,117 @@
+import io
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+from typing import List, Tuple
+
+import numpy as np
+import websockets
+
+from server import handler
+from signaling_utils import WebSocketSignaling
+from settings import *
+
+
+async def connect_pair(uri: str, room: str) -> Tuple[WebSocketSignaling, WebSocketSignaling]:
+    jackal: WebSocketSignaling = WebSocketSignaling(uri, room, f"{room}-jackal")
+    station: WebSocketSignaling = WebSocketSignaling(uri, room, f"{room}-station")
+    await station.connect()
+    await jackal.connect()
+    return jackal, station
+
+
+async def exchange(jackal: WebSocketSignaling, station: WebSocketSignaling, messages: int) -> List[float]:
+    latencies: List[float] = []
+    for i in range(messages):
+        await jackal.send({"ice": f"candidate {i}", "sent": time.perf_counter()})
+        data: dict = await station.receive()
+        latencies.append(time.perf_counter() - data["sent"])
+    return latencies
+
+
+async def benchmark(port: int, pairs: int, messages: int) -> None:
+    uri: str = f"ws://{IP}:{port}"
+    async with websockets.serve(handler, IP, port):
+        # WebSocketSignaling prints on every call, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            start: float = time.perf_counter()
+            clients = await asyncio.gather(*[connect_pair(uri, f"room-{i}") for i in range(pairs)])
+            connect_time: float = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*[exchange(j, s, messages) for j, s in clients])
+            exchange_time: float = time.perf_counter() - start
+
+            for jackal, station in clients:
+                await jackal.close()
+                await station.close()
+
+    latencies: np.ndarray = np.array([latency for result in results for latency in result]) * 1000
+    total: int = pairs * messages
+    print(f"{pairs * 2} clients connected in {connect_time:.3f}s")
+    print(f"{total} messages routed in {exchange_time:.3f}s ({total / exchange_time:.0f} msg/s)")
+    print(
+        f"Latency p50 {np.percentile(latencies, 50):.2f}ms, "
+        f"p99 {np.percentile(latencies, 99):.2f}ms, max {latencies.max():.2f}ms"
+    )
+
+
+async def stalled_benchmark(port: int, receivers: int, messages: int) -> None:
+    # One Jackal broadcasts SDP sized messages to a room where one receiver
+    # never reads its socket, the others must not see their latency grow
+    uri: str = f"ws://{IP}:{port}"
+    async with websockets.serve(handler, IP, port):
+        with contextlib.redirect_stdout(io.StringIO()):
+            stalled = await websockets.connect(uri, max_queue=1)
+            await stalled.send(json.dumps({"type": "join", "room": "stalled", "peer": "stalled"}))
+
+            stations: List[WebSocketSignaling] = [
+                WebSocketSignaling(uri, "stalled", f"station-{i}") for i in range(receivers)
+            ]
+            for station in stations:
+                await station.connect()
+            jackal: WebSocketSignaling = WebSocketSignaling(uri, "stalled", "jackal")
+            await jackal.connect()
+
+            async def receive_all(station: WebSocketSignaling) -> List[float]:
+                latencies: List[float] = []
+                for _ in range(messages):
+                    data: dict = await station.receive()
+                    latencies.append(time.perf_counter() - data["sent"])
+                return latencies
+
+            tasks = [asyncio.ensure_future(receive_all(station)) for station in stations]
+            sdp: str = "a=candidate:0 1 UDP 2122252543 192.168.0.1 50000 typ host\r\n" * 64
+            for _ in range(messages):
+                await jackal.send({"sdp": sdp, "type": "offer", "sent": time.perf_counter()})
+                await asyncio.sleep(0.001)
+            results = await asyncio.gather(*tasks)
+
+            await jackal.close()
+            for station in stations:
+                await station.close()
+            await stalled.close()
+
+    latencies: np.ndarray = np.array([latency for result in results for latency in result]) * 1000
+    print(f"{receivers} healthy receivers, 1 stalled receiver, {messages} messages of {len(sdp)} bytes")
+    print(
+        f"Healthy latency p50 {np.percentile(latencies, 50):.2f}ms, "
+        f"p99 {np.percentile(latencies, 99):.2f}ms, max {latencies.max():.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load benchmark for the signaling server")
+    parser.add_argument("--port", type=int, default=PORT + 1)
+    parser.add_argument("--pairs", type=int, default=200, help="Number of Jackal/station pairs")
+    parser.add_argument("--messages", type=int, default=20, help="Messages sent per pair")
+    parser.add_argument("--stalled", action="store_true", help="Run the stalled receiver scenario")
+    parser.add_argument("--receivers", type=int, default=10, help="Healthy receivers in the stalled scenario")
+    args = parser.parse_args()
+
+    if args.stalled:
+        asyncio.run(stalled_benchmark(args.port, args.receivers, args.messages))
+    else:
+        asyncio.run(benchmark(args.port, args.pairs, args.messages))
@@ -0,0 +1,46 @@
+import time
+import argparse
+from typing import Callable
+
+from state_codec import StateCodec, JACKAL_STATE, TARGET_STATE, TELEMETRY_STATE
+
+SAMPLES = {
+    "jackal": (JACKAL_STATE, {"timestamp": 3000, "state": [1.0, 1.0, 1.0]}),
+    "target": (TARGET_STATE, {"position": [1.0, 1.0, 1.0], "target": "Cat"}),
+    "telemetry": (TELEMETRY_STATE, {
+        "timestamp": 1718000000.123456,
+        "pose": [1.234567, -2.345678, 0.123456, 0.0, 0.0, 0.7071068, 0.7071068],
+        "velocity": [0.51234, 0.0, 0.0, 0.0, 0.0, 0.12345],
+        "joints": [0.1 * i for i in range(12)],
+    }),
+}
+
+
+def measure(function: Callable, argument, iterations: int) -> float:
+    start: float = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - start) / iterations
+
+
+def benchmark(iterations: int) -> None:
+    for name, (schema, state) in SAMPLES.items():
+        print(name)
+        for encoding in ("json", "binary"):
+            codec: StateCodec = StateCodec(schema, encoding)
+            message = codec.encode(state)
+            size: int = len(message.encode("utf-8") if isinstance(message, str) else message)
+            encode: float = measure(codec.encode, state, iterations)
+            decode: float = measure(codec.decode, message, iterations)
+            print(
+                f"  {encoding:<6} {size:4d} bytes, encode {encode * 1e6:5.2f}us, "
+                f"decode {decode * 1e6:5.2f}us"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Size and encode/decode time of state messages, JSON vs binary")
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    benchmark(args.iterations)
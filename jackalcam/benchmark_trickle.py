@@ -0,0 +1,85 @@
+import io
+import time
+import asyncio
+import argparse
+import contextlib
+from typing import List
+
+import numpy as np
+import websockets
+from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection
+
+from server import handler
+from signaling_utils import WebSocketSignaling, initiate_signaling, receive_signaling
+from settings import *
+
+
+async def wait_connected(pc: RTCPeerConnection) -> None:
+    connected: asyncio.Event = asyncio.Event()
+
+    @pc.on("connectionstatechange")
+    def on_connectionstatechange() -> None:
+        if pc.connectionState == "connected":
+            connected.set()
+
+    await connected.wait()
+
+
+async def measure(uri: str, room: str, trickle: bool, stun: str) -> float:
+    # A STUN server makes gathering slow, which is where trickle ICE helps
+    configuration: RTCConfiguration = RTCConfiguration(
+        iceServers=[RTCIceServer(stun)] if stun else []
+    )
+    offerer = RTCPeerConnection(configuration)
+    answerer = RTCPeerConnection(configuration)
+    offerer_signaling: WebSocketSignaling = WebSocketSignaling(uri, room, "jackal")
+    answerer_signaling: WebSocketSignaling = WebSocketSignaling(uri, room, "station")
+    await answerer_signaling.connect()
+    await offerer_signaling.connect()
+    offerer.createDataChannel("datachannel")
+    offerer.addTransceiver("video", direction="sendonly")
+
+    connected: asyncio.Task = asyncio.ensure_future(wait_connected(offerer))
+    answer_task: asyncio.Task = asyncio.ensure_future(
+        receive_signaling(answerer, answerer_signaling, trickle)
+    )
+    # Offer to connected, the websocket connect is not part of the measure
+    start: float = time.perf_counter()
+    loops: List[asyncio.Task] = [await initiate_signaling(offerer, offerer_signaling, trickle)]
+    loops.append(await answer_task)
+    await asyncio.wait_for(connected, 30)
+    elapsed: float = time.perf_counter() - start
+
+    await offerer.close()
+    await answerer.close()
+    await offerer_signaling.close()
+    await answerer_signaling.close()
+    for loop in loops:
+        loop.cancel()
+    return elapsed
+
+
+async def benchmark(port: int, runs: int, stun: str) -> None:
+    uri: str = f"ws://{IP}:{port}"
+    async with websockets.serve(handler, IP, port):
+        for trickle in (False, True):
+            latencies: List[float] = []
+            for i in range(runs):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    latencies.append(await measure(uri, f"run-{trickle}-{i}", trickle, stun))
+            result: np.ndarray = np.array(latencies) * 1000
+            print(
+                f"trickle={trickle}: offer to connected "
+                f"mean {result.mean():.1f}ms, p50 {np.percentile(result, 50):.1f}ms, "
+                f"max {result.max():.1f}ms over {runs} runs"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offer to connected latency with and without trickle ICE")
+    parser.add_argument("--port", type=int, default=PORT + 1)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--stun", type=str, default=None, help="e.g. stun:stun.l.google.com:19302")
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.port, args.runs, args.stun))
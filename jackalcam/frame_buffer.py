@@ -0,0 +1,34 @@
+import logging
+import threading
+
+import cv2
+
+from frame_ring import FrameRing
+
+
+class CaptureThread(threading.Thread):
+    def __init__(self, cap: cv2.VideoCapture, ring: FrameRing) -> None:
+        super().__init__(daemon=True)
+        self.cap: cv2.VideoCapture = cap
+        self.ring: FrameRing = ring
+        self.stopped: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        # Blocking reads happen here instead of on the event loop
+        height, width = self.ring.shape[:2]
+        while not self.stopped.is_set():
+            # The camera decodes straight into the next slot of the ring
+            slot = self.ring.begin_write()
+            ret, frame = self.cap.read(slot)
+            if not ret:
+                logging.error("Failed to read frame from camera")
+                self.stopped.wait(0.1)
+                continue
+            if frame is not slot:
+                # The camera's resolution differs from the ring's
+                cv2.resize(frame, (width, height), dst=slot)
+            self.ring.end_write()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
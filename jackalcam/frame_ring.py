@@ -0,0 +1,127 @@
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+# Header words before the slots: the latest sequence number, then for each
+# slot the sequence numbers written before and after its frame and the
+# capture time, so a reader can detect a frame overwritten while it copied it
+HEADER_ALIGN: int = 64
+
+
+class FrameRing:
+    """
+    Fixed-size ring of frames preallocated in multiprocessing.shared_memory.
+
+    One producer writes frames with consecutive sequence numbers, starting at
+    1, straight into the ring (see begin_write/end_write, cap.read can decode
+    into the slot). Any number of consumers, in this or other processes,
+    read the latest frame or a given one into their own buffer, no frame is
+    ever allocated. A consumer more than slots - 1 frames behind the
+    producer loses the frames in between, it never blocks the producer.
+    """
+    def __init__(self, shape: Tuple[int, ...], dtype: Any = np.uint8, slots: int = 4) -> None:
+        if slots < 2:
+            raise ValueError("A frame ring needs at least two slots!")
+
+        self.shape: Tuple[int, ...] = tuple(shape)
+        self.dtype: np.dtype = np.dtype(dtype)
+        self.slots: int = slots
+        frame_bytes: int = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.header_bytes: int = -(-(1 + 3 * slots) * 8 // HEADER_ALIGN) * HEADER_ALIGN
+        self.shm: shared_memory.SharedMemory = shared_memory.SharedMemory(
+            create=True, size=self.header_bytes + slots * frame_bytes
+        )
+        self.condition: Any = multiprocessing.Condition()
+        self.owner: bool = True
+        self.__attach()
+
+    def __attach(self) -> None:
+        self.header: np.ndarray = np.ndarray((1 + 3 * self.slots,), dtype=np.uint64, buffer=self.shm.buf)
+        self.times: np.ndarray = self.header[1 + 2 * self.slots:].view(np.float64)
+        self.frames: np.ndarray = np.ndarray(
+            (self.slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.header_bytes
+        )
+        self.writing: int = 0
+
+    def __getstate__(self) -> dict:
+        # Sent to a consumer process, which attaches to the same memory
+        return {
+            "shape": self.shape, "dtype": self.dtype, "slots": self.slots,
+            "header_bytes": self.header_bytes, "name": self.shm.name, "condition": self.condition,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.shape, self.dtype, self.slots = state["shape"], state["dtype"], state["slots"]
+        self.header_bytes, self.condition = state["header_bytes"], state["condition"]
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.owner = False
+        self.__attach()
+
+    @property
+    def latest(self) -> int:
+        # Sequence number of the newest complete frame, 0 before the first one
+        return int(self.header[0])
+
+    def begin_write(self) -> np.ndarray:
+        # The slot of the next frame, to be filled in place
+        self.writing = self.latest + 1
+        slot: int = self.writing % self.slots
+        self.header[1 + slot] = self.writing
+        return self.frames[slot]
+
+    def end_write(self, timestamp: float = None) -> int:
+        slot: int = self.writing % self.slots
+        self.times[slot] = time.time() if timestamp is None else timestamp
+        self.header[1 + self.slots + slot] = self.writing
+        with self.condition:
+            self.header[0] = self.writing
+            self.condition.notify_all()
+        return self.writing
+
+    def write(self, frame: np.ndarray, timestamp: float = None) -> int:
+        np.copyto(self.begin_write(), frame)
+        return self.end_write(timestamp)
+
+    def view(self, sequence: int) -> Optional[np.ndarray]:
+        # Zero copy, but the producer reuses the slot slots - 1 frames later,
+        # check valid(sequence) after using it
+        return self.frames[sequence % self.slots] if self.valid(sequence) else None
+
+    def valid(self, sequence: int) -> bool:
+        slot: int = sequence % self.slots
+        return sequence > 0 and self.header[1 + slot] == sequence and self.header[1 + self.slots + slot] == sequence
+
+    def timestamp(self, sequence: int) -> float:
+        return float(self.times[sequence % self.slots])
+
+    def read(self, sequence: int, out: np.ndarray) -> bool:
+        # Copies frame sequence into out, False if it is gone or being rewritten
+        if not self.valid(sequence):
+            return False
+        np.copyto(out, self.frames[sequence % self.slots])
+        return self.valid(sequence)
+
+    def wait(self, after: int = 0, timeout: float = None) -> int:
+        # Blocks until a frame newer than after exists, returns the latest
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest > after, timeout)
+        return self.latest
+
+    def read_latest(self, out: np.ndarray, after: int = 0, timeout: float = None) -> int:
+        # Waits for a frame newer than after and copies the latest into out,
+        # returns its sequence number or 0 on timeout
+        while True:
+            sequence: int = self.wait(after, timeout)
+            if sequence <= after:
+                return 0
+            if self.read(sequence, out):
+                return sequence
+
+    def close(self) -> None:
+        del self.header, self.times, self.frames # Views must go before the memory
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,121 @@
+import fractions
+from collections import OrderedDict
+from typing import Callable, Hashable, List
+
+import av
+import cv2
+import numpy as np
+
+
+class FrameBuilder:
+    """
+    Builds outgoing av.VideoFrames from BGR images without the extra copies of
+    cvtColor(BGR2RGB) + ascontiguousarray + from_ndarray. In "yuv420p" mode the
+    image is converted once into a preallocated I420 buffer that PyAV wraps
+    as is, so the encoder gets the pixel format it wants. In "bgr24" mode the
+    capture buffer itself is wrapped and the encoder does the conversion.
+    """
+    def __init__(self, format: str = "yuv420p", buffers: int = 2) -> None:
+        if format not in ("yuv420p", "bgr24"):
+            raise ValueError("Invalid frame format!")
+
+        self.format: str = format
+        # The sender encodes a frame before asking for the next one, more
+        # than one buffer only guards against a frame being held a bit longer
+        self.buffer_count: int = buffers
+        self.buffers: List[np.ndarray] = []
+        self.index: int = 0
+
+    def __next_buffer(self, height: int, width: int) -> np.ndarray:
+        shape: tuple = (height * 3 // 2, width)
+        if len(self.buffers) == 0 or self.buffers[0].shape != shape:
+            self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.buffer_count)]
+        buffer: np.ndarray = self.buffers[self.index]
+        self.index = (self.index + 1) % self.buffer_count
+        return buffer
+
+    def build(self, image: np.ndarray, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        if self.format == "bgr24":
+            frame: av.VideoFrame = wrap_ndarray(np.ascontiguousarray(image), "bgr24")
+        else:
+            height, width = image.shape[:2]
+            if height % 2 or width % 2:
+                raise ValueError("yuv420p frames need an even width and height!")
+            buffer: np.ndarray = self.__next_buffer(height, width)
+            cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420, dst=buffer)
+            frame = wrap_ndarray(buffer, "yuv420p")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+
+def wrap_ndarray(array: np.ndarray, format: str) -> av.VideoFrame:
+    # from_numpy_buffer shares the memory of the array, older PyAV copies it
+    if hasattr(av.VideoFrame, "from_numpy_buffer"):
+        return av.VideoFrame.from_numpy_buffer(array, format=format)
+    return av.VideoFrame.from_ndarray(array, format=format)
+
+
+# Enough for the 128 solid colours of ColoredStreamTrack at 1080p
+DEFAULT_CACHE_BYTES: int = 512 * 1024 * 1024
+
+
+class FrameCache:
+    """
+    LRU cache of synthetic frames kept as ready-made yuv420p buffers, so a
+    test pattern is converted once and every later frame only wraps it.
+    Entries are evicted least recently used first once max_bytes is reached.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.max_bytes: int = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Hashable, factory: Callable[[], np.ndarray]) -> np.ndarray:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        buffer: np.ndarray = cv2.cvtColor(factory(), cv2.COLOR_BGR2YUV_I420)
+        buffer.flags.writeable = False # Shared by every frame built from it
+        self.entries[key] = buffer
+        self.size += buffer.nbytes
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
+        return buffer
+
+    def frame(
+        self,
+        key: Hashable,
+        factory: Callable[[], np.ndarray],
+        pts: int,
+        time_base: fractions.Fraction
+    ) -> av.VideoFrame:
+        frame: av.VideoFrame = wrap_ndarray(self.get(key, factory), "yuv420p")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+
+# Shared by all the synthetic tracks of a process
+frame_cache: FrameCache = FrameCache()
+
+
+def make_pattern(pattern: str, width: int, height: int, value: int) -> np.ndarray:
+    # BGR test patterns for the synthetic tracks
+    if pattern == "solid":
+        return np.full((height, width, 3), value, dtype=np.uint8)
+    if pattern == "checkerboard":
+        tile: int = max(8, width // 16)
+        y, x = np.indices((height, width))
+        board: np.ndarray = (((y // tile) + (x // tile)) % 2 * value).astype(np.uint8)
+        return np.repeat(board[:, :, None], 3, axis=2)
+    if pattern == "gradient":
+        row: np.ndarray = (np.arange(width) * 255 // max(1, width - 1)).astype(np.uint8)
+        image: np.ndarray = np.empty((height, width, 3), dtype=np.uint8)
+        image[:, :, 0], image[:, :, 1], image[:, :, 2] = row, value, row[::-1]
+        return image
+    raise ValueError(f"Unknown pattern {pattern}!")
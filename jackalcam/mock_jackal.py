@@ -1,17 +1,23 @@
-import time
-import json
 import logging
 import asyncio
 import fractions
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 import av
 import cv2
 import numpy as np
-from aiortc import VideoStreamTrack, RTCDataChannel
+from aiortc import RTCDataChannel, RTCRtpSender
 from aiortc.contrib.media import MediaBlackhole
 
-from signaling_utils import WebRTCClient, initiate_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, initiate_signaling
+from codec_utils import CodecSettings
+from rate_control import AdaptiveStreamTrack, RateController
+from frame_buffer import CaptureThread
+from frame_ring import FrameRing
+from frame_utils import FrameBuilder
+from state_codec import StateCodec, JACKAL_STATE
+from batch_sender import BatchSender
+from pacing import Pacer
 from settings import *
 
 
@@ -22,52 +28,87 @@ VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
 
 
 class MockStateSender:
-    _timestamp: int
-    _start: float
-
-    def __init__(self, data_channel: RTCDataChannel) -> None:
+    def __init__(self, data_channel: RTCDataChannel, codec: StateCodec = None) -> None:
         self.data_channel: RTCDataChannel = data_channel
+        if codec is None:
+            codec = StateCodec(JACKAL_STATE, STATE_ENCODING)
+        self.codec: StateCodec = codec
+        self.sender: BatchSender = BatchSender(
+            data_channel, codec, SEND_MODE, SEND_WINDOW, policy=SEND_POLICY
+        )
+        # A slow send_state skips ticks instead of bursting to catch up
+        self.pacer: Pacer = Pacer(1 / VIDEO_PTIME)
 
-    # NOTE: This function is copied from aiortc source code
     async def next_timestamp(self) -> Tuple[int, fractions.Fraction]:
-        if hasattr(self, "_timestamp"):
-            self._timestamp += int(VIDEO_PTIME * VIDEO_CLOCK_RATE)
-            wait = self._start + (self._timestamp / VIDEO_CLOCK_RATE) - time.time()
-            await asyncio.sleep(wait)
-        else:
-            self._start = time.time()
-            self._timestamp = 0
-        return self._timestamp, VIDEO_TIME_BASE
+        return int(await self.pacer.tick() * VIDEO_CLOCK_RATE), VIDEO_TIME_BASE
 
     # NOTE: Use mock state data for the prototype
     async def send_state(self) -> None:
         pts, _ = await self.next_timestamp()
         data = {"timestamp": pts, "state": [1, 1, 1]}
-        self.data_channel.send(json.dumps(data))
+        await self.sender.writable()
+        self.sender.put(data)
 
 
-class CameraStreamTrack(VideoStreamTrack):
+class CameraStreamTrack(AdaptiveStreamTrack):
     def __init__(self, camera_id: int = 0) -> None:
         super().__init__()
         self.cap: cv2.VideoCapture = cv2.VideoCapture(camera_id)
         self.video_frame: av.VideoFrame = None
+        self.frame_builder: FrameBuilder = FrameBuilder()
+        # Capture runs in its own thread and writes into a shared-memory ring,
+        # recv only takes the latest frame, a recorder or preview may read it too
+        width: int = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or 640
+        height: int = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 480
+        self.ring: FrameRing = FrameRing((height, width, 3))
+        self.sequence: int = 0 # Of the last frame sent
+        self.sent: int = 0
+        self.torn: int = 0 # Frames overwritten while they were converted
+        self.capture_thread: CaptureThread = CaptureThread(self.cap, self.ring)
+        self.capture_thread.start()
+
+    @property
+    def dropped(self) -> int:
+        # Frames captured but never sent
+        return max(0, self.ring.latest - self.sent)
+
+    def stop(self) -> None:
+        super().stop()
+        self.capture_thread.stop()
+        self.cap.release()
+        self.ring.close()
+
+    def __convert(self, sequence: int, pts: int, time_base: fractions.Fraction) -> Optional[av.VideoFrame]:
+        # None if the slot is gone or was rewritten during the conversion
+        image: Optional[np.ndarray] = self.ring.view(sequence)
+        if image is None:
+            return None
+        video_frame: av.VideoFrame = self.frame_builder.build(self.scale_image(image), pts, time_base)
+        return video_frame if self.ring.valid(sequence) else None
 
     async def recv(self) -> av.VideoFrame:
         pts, time_base = await self.next_timestamp()
-        ret, frame = self.cap.read()
-        if not ret:
+        sequence: int = self.ring.latest
+        if sequence == 0:
+            # Only until the camera delivers its first frame
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            sequence = await loop.run_in_executor(None, self.ring.wait, 0, 1.0)
+        if sequence == 0:
             return None
         if self.video_frame is not None:
             del self.video_frame # Release previous frame
 
-        # Convert frame to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = np.ascontiguousarray(frame) # Make sure frame is contiguous in memory
-
-        # Create VideoFrame
-        self.video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        self.video_frame.pts, self.video_frame.time_base = pts, time_base
-        print("Frame sent to the work station")
+        # Convert the ring slot itself to the encoder's yuv420p in a reused buffer,
+        # the captured frame is never copied unless it has to be scaled down
+        self.video_frame: av.VideoFrame = self.__convert(sequence, pts, time_base)
+        while self.video_frame is None:
+            # The capture thread overwrote the slot, take the newest frame
+            self.torn += 1
+            sequence = self.ring.latest
+            self.video_frame = self.__convert(sequence, pts, time_base)
+        if sequence != self.sequence:
+            self.sequence, self.sent = sequence, self.sent + 1
+        print(f"Frame sent to the work station ({self.dropped} dropped)")
 
         return self.video_frame
 
@@ -77,20 +118,41 @@ class JackalClient(WebRTCClient):
         super().__init__(signaling_ip, signaling_port)
         self.data_channel: RTCDataChannel = None
         self.data_sender: MockStateSender = None
+        self.camera_track: CameraStreamTrack = None
+        self.rate_controller: RateController = None
 
     def __setup_track_callbacks(self) -> None:
-        camera_track: CameraStreamTrack = CameraStreamTrack()
-        self.pc.addTrack(camera_track)
+        # The camera is opened once, reconnects re-add the same track
+        if self.camera_track is None:
+            self.camera_track = CameraStreamTrack()
+        sender: RTCRtpSender = self.add_track(
+            self.camera_track,
+            CodecSettings(VIDEO_CODEC, max_bitrate=VIDEO_MAX_BITRATE, keyframe_interval=KEYFRAME_INTERVAL)
+        )
+        if ADAPTIVE_RATE:
+            self.__setup_rate_control([sender])
+
+    def __setup_rate_control(self, senders: List[RTCRtpSender]) -> None:
+        # One controller per peer connection, a rebuilt one gets a new one
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
+        self.rate_controller = RateController(self.pc)
+        for sender in senders:
+            self.rate_controller.add(sender)
+        self.rate_controller.start()
 
     def __setup_datachannel_callbacks(self) -> None:
-        self.data_channel = self.pc.createDataChannel("datachannel")
-        self.data_sender: MockStateSender = MockStateSender(self.data_channel)
+        data_channel: RTCDataChannel = self.pc.createDataChannel("datachannel")
+        data_sender: MockStateSender = MockStateSender(data_channel)
+        self.data_channel, self.data_sender = data_channel, data_sender
 
         @self.data_channel.on("open")
         async def on_open() -> None:
             print("Data channel opened")
-            while True:
-                await self.data_sender.send_state()
+            self.mark("datachannel_open")
+            asyncio.ensure_future(data_sender.sender.run())
+            while data_channel.readyState == "open":
+                await data_sender.send_state()
 
         @self.data_channel.on("message")
         def on_message(message: str) -> None:
@@ -99,20 +161,37 @@ class JackalClient(WebRTCClient):
         @self.data_channel.on("close")
         def on_close() -> None:
             print("Data channel closed")
+            data_sender.sender.stop()
+            stats: dict = data_sender.pacer.stats
+            if stats["ticks"] > 1:
+                print(
+                    f"{stats['ticks']} states paced at {stats['rate']:.1f}/s, {stats['skipped']} ticks skipped, "
+                    f"jitter p95 {stats['jitter_p95'] * 1000:.1f}ms"
+                )
+
+    def setup_peer_connection(self) -> None:
+        self.__setup_track_callbacks()
+        self.__setup_datachannel_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await initiate_signaling(self.pc, self.signaling, timer=self.timer)
 
     async def run(self) -> None:
         await super().run()
-        self.__setup_track_callbacks()
-        self.__setup_datachannel_callbacks()
-        await initiate_signaling(self.pc, self.signaling)
 
         await self.done.wait()
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
         await self.pc.close()
         await self.signaling.close()
+        if self.camera_track is not None:
+            self.camera_track.stop()
 
 
 async def run_initiator() -> None:
     initiator: WebRTCClient = JackalClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        initiator.set_timer(ConnectionTimer("jackal", TIMING_OUTPUT))
     await initiator.run()
 
 
@@ -2,33 +2,43 @@ import logging
 import asyncio
 
 import av
-import cv2
-import numpy as np
 from aiortc import RTCDataChannel, VideoStreamTrack
-from aiortc.contrib.media import MediaBlackhole, MediaRelay
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
 
-from signaling_utils import WebRTCClient, receive_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, receive_signaling
+from render_thread import RenderThread
+from rate_control import set_jitter_buffer
 from settings import *
 
 
 class StationClient(WebRTCClient):
     def __init__(self, signaling_server_url: str, room_id: str) -> None:
         super().__init__(signaling_server_url, room_id)
+        # Wait for the Jackal's offer however long it takes
+        self.negotiation_timeout = None
         self.data_channel_event: asyncio.Event = asyncio.Event()
         self.data_channel: RTCDataChannel = None
         self.media_relay: MediaRelay = MediaRelay()
+        # Decoding stays here, conversion and display happen in the render thread
+        self.renderer: RenderThread = RenderThread()
+        self.renderer.start()
 
     def __setup_track_callbacks(self) -> None:
         @self.pc.on("track")
         async def on_track(track: VideoStreamTrack):
             print("Track received", track.kind)
+            if ADAPTIVE_RATE:
+                # Drops what a lost packet holds up instead of building up delay
+                set_jitter_buffer(self.pc, track)
             if track.kind == "video":
                 while True:
-                    frame: av.VideoFrame = await track.recv()
-                    # Process the frame (e.g., display it using OpenCV)
-                    image: np.ndarray = frame.to_ndarray(format="bgr24")
-                    cv2.imshow("Received Video", image)
-                    cv2.waitKey(1)
+                    try:
+                        frame: av.VideoFrame = await track.recv()
+                    except MediaStreamError:
+                        return # Peer connection closed or rebuilt
+                    self.mark_once("first_frame_received")
+                    self.renderer.submit("Received Video", frame)
 
     def __setup_datachannel_callbacks(self) -> None:
         @self.pc.on("datachannel")
@@ -37,9 +47,10 @@ class StationClient(WebRTCClient):
 
             @self.data_channel.on("open")
             async def on_open() -> None:
-                while True:
+                self.mark("datachannel_open")
+                while channel.readyState == "open":
                     await asyncio.sleep(0.03)
-                    self.data_channel.send("Data channel opened by Jackal")
+                    channel.send("Data channel opened by Jackal")
 
             @self.data_channel.on("message")
             def on_message(message: str) -> None:
@@ -55,19 +66,27 @@ class StationClient(WebRTCClient):
             if self.data_channel.readyState == "open":
                 await on_open()
 
-    async def run(self) -> None:
-        await super().run()
+    def setup_peer_connection(self) -> None:
         self.__setup_track_callbacks()
         self.__setup_datachannel_callbacks()
-        await receive_signaling(self.pc, self.signaling)
+
+    async def negotiate(self) -> asyncio.Task:
+        return await receive_signaling(self.pc, self.signaling, timer=self.timer)
+
+    async def run(self) -> None:
+        await super().run()
 
         await self.done.wait()
         await self.pc.close()
         await self.signaling.close()
+        self.renderer.stop()
+        print(f"Station frames: {self.renderer.counters}")
 
 
 async def run_receiver() -> None:
     receiver: WebRTCClient = StationClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        receiver.set_timer(ConnectionTimer("station", TIMING_OUTPUT))
     await receiver.run()
 
 
@@ -0,0 +1,69 @@
+import threading
+from typing import Callable, Dict
+
+import av
+import cv2
+import numpy as np
+
+
+class RenderThread(threading.Thread):
+    """
+    Shows received frames in OpenCV windows off the event loop. submit() only
+    replaces the frame pending for its window, so frames arriving while the
+    thread is busy rendering are skipped instead of queued, and only the
+    frames actually shown are converted to BGR. All windows are drawn from
+    this one thread, as HighGUI expects.
+    """
+    def __init__(self, on_display: Callable[[str, np.ndarray], None] = None) -> None:
+        super().__init__(daemon=True)
+        self.on_display: Callable[[str, np.ndarray], None] = on_display
+        self.__condition: threading.Condition = threading.Condition()
+        self.__pending: Dict[str, av.VideoFrame] = {}
+        self.__stopped: bool = False
+        self.received: int = 0
+        self.skipped: int = 0
+        self.converted: int = 0
+        self.displayed: int = 0
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return {
+            "received": self.received,
+            "skipped": self.skipped,
+            "converted": self.converted,
+            "displayed": self.displayed,
+        }
+
+    def submit(self, window_name: str, frame: av.VideoFrame) -> None:
+        # Called on the event loop, never blocks on rendering
+        with self.__condition:
+            if window_name in self.__pending:
+                self.skipped += 1
+            self.__pending[window_name] = frame
+            self.received += 1
+            self.__condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending or self.__stopped)
+                if self.__stopped:
+                    break
+                frames, self.__pending = self.__pending, {}
+
+            for window_name, frame in frames.items():
+                image: np.ndarray = frame.to_ndarray(format="bgr24")
+                self.converted += 1
+                if self.on_display is not None:
+                    self.on_display(window_name, image)
+                cv2.imshow(window_name, image)
+                self.displayed += 1
+            cv2.waitKey(1)
+        cv2.destroyAllWindows()
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+        if self.is_alive():
+            self.join()
@@ -1,31 +1,145 @@
 import json
 import asyncio
 import logging
-from typing import Set
+from typing import Dict, List, Tuple
 
 import websockets
 from websockets import WebSocketServerProtocol
 
 from settings import *
 
-clients: Set[WebSocketServerProtocol] = set()
+DEFAULT_ROOM: str = "default"
+SEND_QUEUE_SIZE: int = 64
+SEND_TIMEOUT: float = 5.0
+# What to do when the send queue of a slow peer is full: "drop" the oldest
+# pending message or "disconnect" the peer
+SLOW_PEER_POLICY: str = "disconnect"
 
 
-async def handler(websocket: WebSocketServerProtocol, path):
-    # Register client
-    clients.add(websocket)
-    logging.info(f"New client {id(websocket)} connected")
+class Peer:
+    def __init__(
+        self,
+        websocket: WebSocketServerProtocol,
+        peer_id: str,
+        queue_size: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_PEER_POLICY
+    ) -> None:
+        if policy not in ("drop", "disconnect"):
+            raise ValueError("Invalid slow peer policy!")
+
+        self.websocket: WebSocketServerProtocol = websocket
+        self.peer_id: str = peer_id
+        self.policy: str = policy
+        self.dropped: int = 0
+        self.closed: bool = False
+        # Each peer has its own bounded queue and writer task, so a slow or
+        # half-dead socket never stalls delivery to the others
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = asyncio.ensure_future(self.__write())
+
+    def enqueue(self, message: str) -> None:
+        if self.closed:
+            return
+        if self.queue.full():
+            if self.policy == "disconnect":
+                logging.error(f"Send queue of peer {self.peer_id} is full, disconnecting")
+                self.close()
+                return
+            self.queue.get_nowait()
+            self.dropped += 1
+            logging.warning(f"Send queue of peer {self.peer_id} is full, dropped oldest message")
+        self.queue.put_nowait(message)
+
+    async def __write(self) -> None:
+        try:
+            while True:
+                message: str = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send(message), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error(f"Peer {self.peer_id} did not accept a message in {SEND_TIMEOUT}s, disconnecting")
+            self.close()
+        except websockets.exceptions.ConnectionClosed as e:
+            logging.error(f"Failed to deliver message to peer {self.peer_id}: {e}")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        asyncio.ensure_future(self.websocket.close())
+
+
+# room id -> peer id -> peer, so a message is routed with a dict lookup
+# instead of being broadcast to every connected client
+rooms: Dict[str, Dict[str, Peer]] = {}
+
+
+async def register(websocket: WebSocketServerProtocol) -> Tuple[str, Peer]:
+    # The first message of a client must be a join request:
+    # {"type": "join", "room": <room id>, "peer": <peer id>}
+    data: dict = json.loads(await websocket.recv())
+    if data.get("type") != "join":
+        raise ValueError("First message must be a join request!")
+
+    room_id: str = data.get("room") or DEFAULT_ROOM
+    peer_id: str = data.get("peer") or str(id(websocket))
+    room: Dict[str, Peer] = rooms.setdefault(room_id, {})
+    if peer_id in room:
+        # A peer reconnecting with the same id replaces its stale socket
+        logging.info(f"Peer {peer_id} rejoined room {room_id}")
+        room[peer_id].close()
+    peer: Peer = Peer(websocket, peer_id)
+    room[peer_id] = peer
+
+    peer.enqueue(json.dumps({
+        "type": "joined",
+        "room": room_id,
+        "peer": peer_id,
+        "peers": [other for other in room if other != peer_id]
+    }))
+    logging.info(f"Peer {peer_id} joined room {room_id}")
+    return room_id, peer
+
+
+def unregister(room_id: str, peer: Peer) -> None:
+    room: Dict[str, Peer] = rooms.get(room_id, {})
+    if room.get(peer.peer_id) is peer:
+        del room[peer.peer_id]
+    if not room:
+        rooms.pop(room_id, None)
+    peer.close()
+
+
+def route(room_id: str, peer_id: str, data: dict) -> List[Peer]:
+    room: Dict[str, Peer] = rooms.get(room_id, {})
+    target: str = data.get("to")
+    if target is not None:
+        # Addressed message, O(1) lookup of the counterpart
+        peer: Peer = room.get(target)
+        return [] if peer is None else [peer]
+    # Unaddressed message goes to the other peers of the same room only
+    return [peer for other, peer in room.items() if other != peer_id]
+
+
+async def handler(websocket: WebSocketServerProtocol, path=None):
+    room_id, peer = None, None
 
     try:
+        # Register client
+        room_id, peer = await register(websocket)
         async for message in websocket:
             data = json.loads(message)
-            # Broadcast the message to all connected clients except the sender
-            for client in clients:
-                if client != websocket:
-                    logging.info("Starting signaling exchange...")
-                    await client.send(json.dumps(data))
-                    logging.info("Signaling exchange complete")
-            logging.info(f"Peers have established a connection, unregistering...")
+            data["from"] = peer.peer_id
+            targets: List[Peer] = route(room_id, peer.peer_id, data)
+            if len(targets) == 0:
+                logging.warning(f"No peer to receive message from {peer.peer_id} in room {room_id}")
+                continue
+
+            # Serialize once and hand the message to the writer task of each
+            # target, the receive loop of the sender never waits for a send
+            message = json.dumps(data)
+            for target in targets:
+                target.enqueue(message)
     except websockets.exceptions.ConnectionClosedError as e:
         logging.error(f"Connection closed with error: {e}")
     except websockets.exceptions.ConnectionClosedOK:
@@ -34,7 +148,9 @@ async def handler(websocket: WebSocketServerProtocol, path):
         logging.error(f"Unexpected error: {e}")
     finally:
         # Unregister client
-        clients.remove(websocket)
+        if peer is not None:
+            unregister(room_id, peer)
+            logging.info(f"Peer {peer.peer_id} left room {room_id}")
         await websocket.close()
 
 
@@ -0,0 +1,159 @@
+import json
+import struct
+from typing import Dict, List, Tuple, Union
+
+# Every binary message starts with b"ST", the protocol version and the schema
+# id, so the station can tell it from JSON text and pick the right layout
+MAGIC: bytes = b"ST"
+VERSION: int = 1
+HEADER: struct.Struct = struct.Struct("<2sBB")
+
+
+class StateSchema:
+    """
+    Fixed little-endian layout of a state message. Each field is a name, a
+    struct type code and a count: the length of the array, or the maximum
+    length in bytes of an "s" (utf-8 string) field.
+    """
+    def __init__(self, schema_id: int, fields: List[Tuple[str, str, int]]) -> None:
+        self.schema_id: int = schema_id
+        self.fields: List[Tuple[str, str, int]] = fields
+        self.body: struct.Struct = struct.Struct(
+            "<" + "".join(f"{count}{code}" for _, code, count in fields)
+        )
+        self.size: int = HEADER.size + self.body.size
+
+    def pack(self, state: dict) -> bytes:
+        values: list = []
+        for name, code, count in self.fields:
+            value = state[name]
+            if code == "s":
+                value = value.encode("utf-8")
+                if len(value) > count:
+                    raise ValueError(f"Field {name} is longer than {count} bytes")
+                values.append(value)
+            elif count == 1:
+                values.append(value)
+            else:
+                if len(value) != count:
+                    raise ValueError(f"Field {name} needs {count} values, got {len(value)}")
+                values.extend(value)
+        return HEADER.pack(MAGIC, VERSION, self.schema_id) + self.body.pack(*values)
+
+    def unpack(self, data: bytes) -> dict:
+        values: tuple = self.body.unpack_from(data, HEADER.size)
+        state: dict = {}
+        index: int = 0
+        for name, code, count in self.fields:
+            if code == "s":
+                state[name] = values[index].rstrip(b"\0").decode("utf-8")
+                index += 1
+            elif count == 1:
+                state[name] = values[index]
+                index += 1
+            else:
+                state[name] = list(values[index:index + count])
+                index += count
+        return state
+
+
+# State of the jackalcam MockStateSender
+JACKAL_STATE: StateSchema = StateSchema(1, [
+    ("timestamp", "q", 1),
+    ("state", "d", 3),
+])
+# State of the multi_threading mock_state_manager
+TARGET_STATE: StateSchema = StateSchema(2, [
+    ("position", "d", 3),
+    ("target", "s", 16),
+])
+# Full robot telemetry, pose is x, y, z + quaternion, velocity is linear + angular
+TELEMETRY_STATE: StateSchema = StateSchema(3, [
+    ("timestamp", "d", 1),
+    ("pose", "d", 7),
+    ("velocity", "d", 6),
+    ("joints", "f", 12),
+])
+
+SCHEMAS: Dict[int, StateSchema] = {
+    schema.schema_id: schema for schema in (JACKAL_STATE, TARGET_STATE, TELEMETRY_STATE)
+}
+
+
+class StateCodec:
+    """
+    Encodes state messages for the data channel, "binary" with a schema or
+    "json" text as before. Decoding accepts both, a binary message carries
+    its own schema id so one codec decodes every registered schema.
+    """
+    def __init__(self, schema: StateSchema, encoding: str = "binary") -> None:
+        if encoding not in ("binary", "json"):
+            raise ValueError("Invalid state encoding!")
+
+        self.schema: StateSchema = schema
+        self.encoding: str = encoding
+
+    def encode(self, state: dict) -> Union[bytes, str]:
+        if self.encoding == "json":
+            return json.dumps(state)
+        return self.schema.pack(state)
+
+    def decode(self, message: Union[bytes, str]) -> dict:
+        if isinstance(message, str) or not message.startswith(MAGIC):
+            return json.loads(message)
+
+        _, version, schema_id = HEADER.unpack_from(message)
+        if version != VERSION:
+            raise ValueError(f"Unsupported state protocol version {version}")
+        if schema_id not in SCHEMAS:
+            raise ValueError(f"Unknown state schema {schema_id}")
+        return SCHEMAS[schema_id].unpack(message)
+
+    def encode_batch(self, states: List[dict]) -> Union[bytes, str]:
+        # Binary messages have a fixed size, a batch is just their concatenation
+        if self.encoding == "json":
+            return json.dumps(states)
+        return b"".join(self.schema.pack(state) for state in states)
+
+    def decode_batch(self, message: Union[bytes, str]) -> List[dict]:
+        # Also takes single messages, so receivers need not know the sender's mode
+        if isinstance(message, str) or not message.startswith(MAGIC):
+            states = json.loads(message)
+            return states if isinstance(states, list) else [states]
+
+        states: List[dict] = []
+        offset: int = 0
+        while offset < len(message):
+            _, _, schema_id = HEADER.unpack_from(message, offset)
+            if schema_id not in SCHEMAS:
+                raise ValueError(f"Unknown state schema {schema_id}")
+            size: int = SCHEMAS[schema_id].size
+            states.append(self.decode(message[offset:offset + size]))
+            offset += size
+        return states
+
+    def decode_many(self, messages: List[Union[bytes, str]]) -> List[dict]:
+        # Runs of JSON text messages are parsed as one array by a single json.loads
+        states: List[dict] = []
+        texts: List[str] = []
+        for message in messages:
+            if isinstance(message, str):
+                texts.append(message)
+                continue
+            states.extend(decode_texts(texts))
+            texts = []
+            states.extend(self.decode_batch(message))
+        states.extend(decode_texts(texts))
+        return states
+
+
+def decode_texts(texts: List[str]) -> List[dict]:
+    if len(texts) == 0:
+        return []
+    states: List[dict] = []
+    for decoded in json.loads("[" + ",".join(texts) + "]"):
+        if isinstance(decoded, list):
+            states.extend(decoded) # A batch of a "batch" mode sender
+        else:
+            states.append(decoded)
+    return states
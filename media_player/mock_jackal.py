@@ -3,36 +3,38 @@ import json
 import logging
 import asyncio
 import fractions
-from typing import Tuple
+from typing import List, Tuple
 
 import av
-import cv2
-import numpy as np
-from aiortc import VideoStreamTrack, RTCDataChannel
+from aiortc import RTCDataChannel, RTCRtpSender
 from aiortc.contrib.media import MediaBlackhole
 
-from signaling_utils import WebRTCClient, initiate_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, initiate_signaling
+from codec_utils import CodecSettings
+from rate_control import AdaptiveStreamTrack, RateController
+from frame_utils import frame_cache, make_pattern
 from settings import *
 
 
-class ColoredStreamTrack(VideoStreamTrack):
-    def __init__(self) -> None:
+class ColoredStreamTrack(AdaptiveStreamTrack):
+    def __init__(self, width: int = 640, height: int = 480, pattern: str = "solid") -> None:
         super().__init__()
         self.channel_num: int = 0
+        self.width, self.height, self.pattern = width, height, pattern
 
     async def recv(self) -> av.VideoFrame:
         pts, time_base = await self.next_timestamp()
-        frame = np.ones((480, 640, 3), dtype=np.uint8) * self.channel_num // 2
-        print(f"Colored frame {self.channel_num // 2} sent to the work station")
+        value: int = self.channel_num // 2
+        print(f"Colored frame {value} sent to the work station")
         self.channel_num = (self.channel_num + 1) % 256
 
-        # Convert frame to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = np.ascontiguousarray(frame) # Make sure frame is contiguous in memory
-
-        # Create VideoFrame
-        video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts, video_frame.time_base = pts, time_base
+        # Each of the 128 colours is synthesized and converted only once per size
+        width, height = self.scaled_size(self.width, self.height)
+        video_frame: av.VideoFrame = frame_cache.frame(
+            (self.pattern, width, height, value),
+            lambda: make_pattern(self.pattern, width, height, value),
+            pts, time_base
+        )
         print("Colored frame sent to the work station")
 
         return video_frame
@@ -42,23 +44,46 @@ class JackalClient(WebRTCClient):
     def __init__(self, signaling_ip: str, signaling_port: int) -> None:
         super().__init__(signaling_ip, signaling_port)
         self.data_channel: RTCDataChannel = None
+        self.colored_track: ColoredStreamTrack = ColoredStreamTrack()
+        self.rate_controller: RateController = None
 
     def __setup_track_callbacks(self) -> None:
-        colored_track: ColoredStreamTrack = ColoredStreamTrack()
-        self.pc.addTrack(colored_track)
+        sender: RTCRtpSender = self.add_track(
+            self.colored_track,
+            CodecSettings(VIDEO_CODEC, max_bitrate=VIDEO_MAX_BITRATE, keyframe_interval=KEYFRAME_INTERVAL)
+        )
+        if ADAPTIVE_RATE:
+            self.__setup_rate_control([sender])
+
+    def __setup_rate_control(self, senders: List[RTCRtpSender]) -> None:
+        # One controller per peer connection, a rebuilt one gets a new one
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
+        self.rate_controller = RateController(self.pc)
+        for sender in senders:
+            self.rate_controller.add(sender)
+        self.rate_controller.start()
+
+    def setup_peer_connection(self) -> None:
+        self.__setup_track_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await initiate_signaling(self.pc, self.signaling, timer=self.timer)
 
     async def run(self) -> None:
         await super().run()
-        self.__setup_track_callbacks()
-        await initiate_signaling(self.pc, self.signaling)
 
         await self.done.wait()
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
         await self.pc.close()
         await self.signaling.close()
 
 
 async def run_initiator() -> None:
     initiator: WebRTCClient = JackalClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        initiator.set_timer(ConnectionTimer("jackal", TIMING_OUTPUT))
     await initiator.run()
 
 
@@ -1,30 +1,36 @@
 import logging
 import asyncio
+from typing import Callable
 
 import av
-import cv2
-import numpy as np
 from aiortc import RTCDataChannel, VideoStreamTrack
 from aiortc.mediastreams import MediaStreamError
-from signaling_utils import WebRTCClient, receive_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, receive_signaling
+from render_thread import RenderThread
+from rate_control import set_jitter_buffer
 from settings import *
 
 
-async def consume(track: VideoStreamTrack):
+def print_pixel(window_name: str, image) -> None:
+    print(image[0][0])
+
+
+async def consume(track: VideoStreamTrack, renderer: RenderThread, mark: Callable[[str], None] = None):
     while True:
         try:
             frame: av.VideoFrame = await track.recv()
-            image: np.ndarray = frame.to_ndarray(format="bgr24")
-            print(image[0][0])
-            cv2.imshow("Video", image)
-            cv2.waitKey(1)
+            if mark is not None:
+                mark("first_frame_received")
+            renderer.submit("Video", frame)
         except MediaStreamError:
             return
 
 
 class Consumer:
-    def __init__(self) -> None:
+    def __init__(self, renderer: RenderThread, mark: Callable[[str], None] = None) -> None:
         self.__tracks = {}
+        self.__renderer: RenderThread = renderer
+        self.__mark: Callable[[str], None] = mark
 
     def addTrack(self, track) -> None:
         if track not in self.__tracks:
@@ -33,7 +39,7 @@ class Consumer:
     async def start(self) -> None:
         for track, task in self.__tracks.items():
             if task is None:
-                self.__tracks[track] = asyncio.ensure_future(consume(track))
+                self.__tracks[track] = asyncio.ensure_future(consume(track, self.__renderer, self.__mark))
 
     async def stop(self) -> None:
         for task in self.__tracks.values():
@@ -45,32 +51,48 @@ class Consumer:
 class StationClient(WebRTCClient):
     def __init__(self, signaling_server_url: str, room_id: str) -> None:
         super().__init__(signaling_server_url, room_id)
+        # Wait for the Jackal's offer however long it takes
+        self.negotiation_timeout = None
         self.data_channel_event: asyncio.Event = asyncio.Event()
         self.data_channel: RTCDataChannel = None
         self.consumer: Consumer = None
+        # Decoding stays here, conversion and display happen in the render thread
+        self.renderer: RenderThread = RenderThread(print_pixel)
+        self.renderer.start()
 
     def __setup_track_callbacks(self) -> None:
-        self.consumer = Consumer()
+        self.consumer = Consumer(self.renderer, self.mark_once)
 
         @self.pc.on("track")
         async def on_track(track: VideoStreamTrack):
             print("Track received", track.kind)
+            if ADAPTIVE_RATE:
+                # Drops what a lost packet holds up instead of building up delay
+                set_jitter_buffer(self.pc, track)
             if track.kind == "video":
                 self.consumer.addTrack(track)
                 await self.consumer.start()
 
+    def setup_peer_connection(self) -> None:
+        self.__setup_track_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await receive_signaling(self.pc, self.signaling, timer=self.timer)
+
     async def run(self) -> None:
         await super().run()
-        self.__setup_track_callbacks()
-        await receive_signaling(self.pc, self.signaling)
 
         await self.done.wait()
         await self.pc.close()
         await self.signaling.close()
+        self.renderer.stop()
+        print(f"Station frames: {self.renderer.counters}")
 
 
 async def run_receiver() -> None:
     receiver: WebRTCClient = StationClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        receiver.set_timer(ConnectionTimer("station", TIMING_OUTPUT))
     await receiver.run()
 
 
@@ -1,2 +1,14 @@
 IP: str = "localhost"
-PORT: int = 1234
\ No newline at end of file
+PORT: int = 1234
+
+# Set to a file path (e.g. "timing.jsonl") to record connection setup timings
+TIMING_OUTPUT: str = None
+
+# Codec of the outgoing video ("VP8" or "H264"), its bitrate cap in bits per
+# second and the seconds between forced keyframes (None keeps aiortc's)
+VIDEO_CODEC: str = "H264"
+VIDEO_MAX_BITRATE: int = None
+KEYFRAME_INTERVAL: float = None
+
+# Adapt the bitrate, resolution and frame rate of the video to the link
+ADAPTIVE_RATE: bool = True
@@ -0,0 +1,76 @@
+import os
+import itertools
+import argparse
+import fractions
+from typing import Callable, Dict, List, Tuple
+
+import av
+import numpy as np
+
+from codec_benchmark import CODECS, CodecBenchmark
+from depth_utils import DepthPacker, synthetic_depth
+from recording import Recording, open_recording
+from settings import *
+
+
+class GrayDepth:
+    # The greyscale approach of transmit_depth/test_encode.py: depth scaled
+    # to uint8 and sent as a grey image
+    def __init__(self, near: float, far: float) -> None:
+        self.near, self.far = near, far
+
+    def frame(self, depth: np.ndarray, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        scaled: np.ndarray = np.rint(np.clip((depth - self.near) / (self.far - self.near), 0, 1) * 255)
+        frame: av.VideoFrame = av.VideoFrame.from_ndarray(scaled.astype(np.uint8), format="gray").reformat(format="yuv420p")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: av.VideoFrame) -> np.ndarray:
+        gray: np.ndarray = frame.to_ndarray(format="gray").astype(np.float32)
+        return gray / 255 * (self.far - self.near) + self.near
+
+
+def load_depth(path: str, count: int) -> Tuple[List[np.ndarray], str]:
+    if os.path.exists(path):
+        recording: Recording = open_recording(path)
+        shape: tuple = recording["depth"].shape[1:3]
+        depths: List[np.ndarray] = [
+            np.asarray(frame["depth"], dtype=np.float32).reshape(shape)
+            for frame in itertools.islice(recording.frames(["depth"], loop=True), count)
+        ]
+        return depths, path
+    depth_frame: Callable[[int], np.ndarray] = synthetic_depth()
+    return [depth_frame(i) for i in range(count)], f"synthetic scene ({path} not found)"
+
+
+def depth_error(decoded: np.ndarray, depth: np.ndarray) -> Dict[str, float]:
+    error: np.ndarray = np.abs(decoded - depth)
+    return {"mse": float(np.mean(error ** 2)), "p99": float(np.percentile(error, 99)), "max": float(error.max())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bandwidth, time and error of depth sent as 8-bit grey vs packed 13-bit")
+    parser.add_argument("--data", default=os.path.join("..", "transmit_depth", "test_data.npz"))
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--warmup", type=int, default=30, help="First frames left out of the results")
+    parser.add_argument("--near", type=float, default=0.0)
+    parser.add_argument("--far", type=float, default=None, help="The largest depth in the data if not set")
+    parser.add_argument(
+        "--bitrate", type=int, nargs="+", default=[0, DEPTH_MIN_BITRATE],
+        help="Target bitrates, 0 for aiortc's default, DEPTH_MIN_BITRATE is what the depth track gets at least"
+    )
+    args = parser.parse_args()
+
+    depths, source = load_depth(args.data, args.frames)
+    far: float = args.far if args.far is not None else float(max(depth.max() for depth in depths))
+    print(f"{len(depths)} frames of {depths[0].shape[1]}x{depths[0].shape[0]} from {source}, range {args.near}-{far:.2f}")
+    methods = {"gray 8-bit": GrayDepth(args.near, far), "packed 13-bit": DepthPacker(args.near, far)}
+    for codec, bitrate in itertools.product(CODECS, args.bitrate):
+        print(f"{codec} at {bitrate / 1000:.0f}kbps" if bitrate else f"{codec} at aiortc's default bitrate")
+        for name, method in methods.items():
+            result: Dict[str, object] = CodecBenchmark(codec, bitrate or None, args.warmup).run(method, depths, depth_error)
+            print(
+                f"  {name:<14} {result['kbps']:6.0f}kbps, encode {result['encode_ms']['mean']:5.1f}ms, "
+                f"decode {result['decode_ms']['mean']:5.1f}ms, RMSE {np.sqrt(result['error']['mse']) * 1000:6.1f}mm, "
+                f"p99 {result['error']['p99'] * 1000:6.1f}mm, max {result['error_max']['max'] * 1000:6.0f}mm"
+            )
@@ -0,0 +1,77 @@
+import time
+import asyncio
+import argparse
+import logging
+from typing import Callable, List
+
+import av
+from aiortc.codecs.vpx import Vp8Encoder
+
+from media_process import ProcessStreamTrack, create_source
+
+
+async def send_in_process(width: int, height: int, end: float) -> int:
+    # What RTCRtpSender does with a VideoStreamTrack: build the frame on the
+    # loop, then encode it in the default executor
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    next_frame: Callable[[int, int], av.VideoFrame] = create_source("noise", width, height)
+    encoder: Vp8Encoder = Vp8Encoder()
+    frames: int = 0
+    while time.perf_counter() < end:
+        frame: av.VideoFrame = next_frame(frames, frames * 3000)
+        await loop.run_in_executor(None, encoder.encode, frame, False)
+        frames += 1
+    return frames
+
+
+async def send_from_process(track: ProcessStreamTrack, end: float) -> int:
+    # What RTCRtpSender does with a ProcessStreamTrack: only packetize
+    encoder: Vp8Encoder = Vp8Encoder()
+    frames: int = 0
+    while time.perf_counter() < end:
+        encoder.pack(await track.recv())
+        frames += 1
+    return frames
+
+
+async def run(mode: str, tracks: int, width: int, height: int, duration: float) -> None:
+    workers: List[ProcessStreamTrack] = []
+    if mode == "processes":
+        # Unpaced workers, the ring's backpressure limits them to what is sent
+        workers = [ProcessStreamTrack("noise", width, height, fps=1000) for _ in range(tracks)]
+        await asyncio.gather(*[worker.recv() for worker in workers]) # Workers started
+
+    start_cpu, start = time.process_time(), time.perf_counter()
+    end: float = start + duration
+    if mode == "processes":
+        counts: List[int] = await asyncio.gather(*[send_from_process(worker, end) for worker in workers])
+    else:
+        counts = await asyncio.gather(*[send_in_process(width, height, end) for _ in range(tracks)])
+    elapsed: float = time.perf_counter() - start
+    cpu: float = (time.process_time() - start_cpu) / elapsed
+
+    for worker in workers:
+        worker.stop()
+    print(
+        f"  {mode:<10} {sum(counts) / elapsed:6.1f} frames/s in total, "
+        f"{min(counts) / elapsed:5.1f} for the slowest track, main process CPU {cpu * 100:5.1f}%"
+    )
+
+
+async def benchmark(track_counts: List[int], width: int, height: int, duration: float) -> None:
+    for tracks in track_counts:
+        print(f"{tracks} tracks at {width}x{height}, VP8")
+        for mode in ("in-process", "processes"):
+            await run(mode, tracks, width, height, duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encoded frames per second with and without the worker processes")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1, 3, 6])
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(benchmark(args.tracks, args.width, args.height, args.duration))
@@ -0,0 +1,63 @@
+import time
+import argparse
+import fractions
+from typing import Callable
+
+import av
+import numpy as np
+
+from frame_utils import FrameBuilder, FrameCache, make_pattern
+
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+
+
+def encoder_input(frame: av.VideoFrame) -> av.VideoFrame:
+    # What the encoder does before encoding, the cost belongs to the path
+    if frame.format.name != "yuv420p":
+        frame = frame.reformat(format="yuv420p")
+    return frame
+
+
+def measure(build: Callable[[int, int], av.VideoFrame], tracks: int, frames: int) -> float:
+    start: float = time.perf_counter()
+    for i in range(frames):
+        for track in range(tracks):
+            encoder_input(build(i, track))
+    return (time.perf_counter() - start) / (frames * tracks)
+
+
+def benchmark(tracks: int, frames: int, pattern: str) -> None:
+    # The previous path only knew solid colours, the pattern applies to the cache
+    for width, height in ((640, 480), (1920, 1080)):
+        builders = [FrameBuilder() for _ in range(tracks)]
+        cache: FrameCache = FrameCache()
+
+        def build_previous(i: int, track: int) -> av.VideoFrame:
+            # The previous path, synthesized and converted for every frame
+            image: np.ndarray = np.ones((height, width, 3), dtype=np.uint8) * (i % 128)
+            return builders[track].build(image, i, VIDEO_TIME_BASE)
+
+        def build_cached(i: int, track: int) -> av.VideoFrame:
+            value: int = i % 128
+            return cache.frame(
+                (pattern, width, height, value),
+                lambda: make_pattern(pattern, width, height, value),
+                i, VIDEO_TIME_BASE
+            )
+
+        print(f"{width}x{height}, {tracks} tracks")
+        measure(build_cached, 1, 128) # The first pass through the colours fills the cache
+        for name, build in (("synthesized", build_previous), ("cached", build_cached)):
+            per_frame: float = measure(build, tracks, frames)
+            print(f"  {name:<12} {per_frame * 1000:6.3f}ms/frame, {1 / per_frame:8.0f} frames/s on one core")
+        print(f"  cache {cache.hits} hits, {cache.misses} misses, {cache.size / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost per frame of the synthetic tracks with and without the frame cache")
+    parser.add_argument("--tracks", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=256)
+    parser.add_argument("--pattern", default="solid", choices=["solid", "checkerboard", "gradient"])
+    args = parser.parse_args()
+
+    benchmark(args.tracks, args.frames, args.pattern)
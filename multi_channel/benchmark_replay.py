@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from codec_utils import CODECS, CodecSettings, ConfiguredEncoder
+from depth_utils import synthetic_depth
+from semantic_utils import synthetic_semantic
+from frame_utils import make_pattern
+from recording import RecordingWriter
+from replay_track import MODALITIES, ReplayStreamTrack, start_replay
+
+
+def write_recording(path: str, count: int, width: int, height: int, fps: float) -> None:
+    # A synthetic session of every modality, with a little jitter on the
+    # timestamps as a real recorder would have
+    depth_frame = synthetic_depth(width, height)
+    semantic_frame = synthetic_semantic(np.arange(20), width, height)
+    random: np.random.RandomState = np.random.RandomState(0)
+    with RecordingWriter(path, fps) as writer:
+        for i in range(count):
+            rgb: np.ndarray = np.ascontiguousarray(np.roll(make_pattern("gradient", width, height, 2 * i % 256), 4 * i, axis=1)[:, :, ::-1])
+            writer.write({
+                "rgb": rgb,
+                "depth": depth_frame(i),
+                "semantic": semantic_frame(i),
+                "timestamps": i / fps + random.uniform(0, 0.3 / fps),
+            })
+
+
+async def consume(track: ReplayStreamTrack, frames: int, codec: str, sent: Dict[int, float]) -> None:
+    # Takes frames the way an RTCRtpSender does, encoding each before the next
+    encoder: ConfiguredEncoder = ConfiguredEncoder(CodecSettings(codec)) if codec is not None else None
+    loop = asyncio.get_running_loop()
+    for _ in range(frames):
+        frame = await track.recv()
+        sent[frame.pts] = time.monotonic()
+        if encoder is not None:
+            await loop.run_in_executor(None, encoder.encode, frame)
+
+
+async def run(path: str, frames: int, speed: float, codec: str, batch: int, read_ahead: int) -> Dict[str, object]:
+    tracks: List[ReplayStreamTrack] = start_replay(path, MODALITIES, loop=True, speed=speed, batch=batch, read_ahead=read_ahead)
+    sent: List[Dict[int, float]] = [{} for _ in tracks]
+    # The readers get their first batch ready while the connection would be
+    # negotiated, before any frame is asked for
+    while any(track.reader.ready.empty() for track in tracks):
+        await asyncio.sleep(0.01)
+    start: float = time.monotonic()
+    await asyncio.gather(*[consume(track, frames, codec, times) for track, times in zip(tracks, sent)])
+    elapsed: float = time.monotonic() - start
+    for track in tracks:
+        track.stop()
+
+    # Skew: how far apart the tracks sent the frame of the same timestamp
+    common: set = set.intersection(*[set(times) for times in sent])
+    skews: np.ndarray = np.array([max(times[pts] for times in sent) - min(times[pts] for times in sent) for pts in common])
+    return {
+        "fps": frames / elapsed,
+        "skew_p50": float(np.percentile(skews, 50)),
+        "skew_max": float(skews.max()),
+        "late": sum(track.late for track in tracks),
+        "max_lateness": max(track.max_lateness for track in tracks),
+        "underruns": sum(track.underruns for track in tracks),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay of rgb, depth and semantic tracks from one recording")
+    parser.add_argument("--recording", default=None, help="Recording to replay, a synthetic one if not set")
+    parser.add_argument("--count", type=int, default=90, help="Frames of the synthetic recording")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--frames", type=int, default=150, help="Frames taken from each track, looping")
+    parser.add_argument("--codec", choices=list(CODECS), default=None, help="Encode every frame as the sender would")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--read-ahead", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = args.recording
+        if path is None:
+            path = os.path.join(directory, "session")
+            write_recording(path, args.count, args.width, args.height, 30.0)
+        for name, speed in (("real time", 1.0), ("unpaced", 0.0)):
+            result: Dict[str, object] = asyncio.run(run(path, args.frames, speed, args.codec, args.batch, args.read_ahead))
+            # Unpaced tracks run free, their skew means nothing
+            skew: str = f"start skew p50 {result['skew_p50'] * 1000:.2f}ms max {result['skew_max'] * 1000:.2f}ms, " if speed > 0 else ""
+            print(
+                f"  {name:<10} {result['fps']:6.1f} frames/s per track, {skew}"
+                f"{result['late']} late (max {result['max_lateness'] * 1000:.1f}ms), {result['underruns']} reader underruns"
+            )
+            # Late frames mean the machine could not keep up, not that the clock failed
+            if speed > 0 and result["late"] == 0 and result["skew_max"] > 0.1:
+                sys.exit("Replay tracks drifted apart")
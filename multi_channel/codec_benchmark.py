@@ -0,0 +1,147 @@
+import sys
+import json
+import time
+import platform
+import fractions
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import av
+import aiortc
+import numpy as np
+from aiortc.jitterbuffer import JitterFrame
+from aiortc.codecs.base import Decoder, Encoder
+from aiortc.codecs.vpx import Vp8Decoder, Vp8Encoder, vp8_depayload
+from aiortc.codecs.h264 import H264Decoder, H264Encoder, h264_depayload
+
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+FRAME_RATE: int = 30
+MAX_PSNR: float = 100.0 # For frames that come back identical
+CODECS: Dict[str, Tuple[Callable[[], Encoder], Callable[[], Decoder], Callable[[bytes], bytes]]] = {
+    "VP8": (Vp8Encoder, Vp8Decoder, vp8_depayload),
+    "H264": (H264Encoder, H264Decoder, h264_depayload),
+}
+
+
+class CodecBenchmark:
+    """
+    Runs inputs through a software encoder, depacketizer and decoder the way
+    aiortc's sender and receiver would, headless. A method turns an input
+    into an av.VideoFrame (frame) and a decoded frame back into a result
+    (decode), error compares a result to its input. Per frame it measures
+    encode and decode time, payload bytes, the PSNR of the decoded yuv420p
+    planes and the task error, the first warmup frames are left out while
+    the encoder's rate control settles. create_encoder replaces aiortc's
+    encoder for the codec, e.g. with a configured one.
+    """
+    def __init__(self, codec: str, bitrate: int = None, warmup: int = 10, create_encoder: Callable[[], Encoder] = None) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}!")
+
+        self.codec: str = codec
+        self.bitrate: int = bitrate
+        self.warmup: int = warmup
+        self.create_encoder: Callable[[], Encoder] = create_encoder
+
+    def run(self, method, inputs: Iterable[np.ndarray], error: Callable[[np.ndarray, np.ndarray], Dict[str, float]]) -> Dict[str, object]:
+        create_encoder, create_decoder, depayload = CODECS[self.codec]
+        encoder: Encoder = (self.create_encoder or create_encoder)()
+        if self.bitrate is not None:
+            encoder.target_bitrate = self.bitrate
+        decoder: Decoder = create_decoder()
+
+        encode_times: List[float] = []
+        decode_times: List[float] = []
+        sizes: List[int] = []
+        psnrs: List[float] = []
+        errors: Dict[str, List[float]] = {}
+        for i, value in enumerate(inputs):
+            start: float = time.perf_counter()
+            frame: av.VideoFrame = method.frame(value, int(i / VIDEO_TIME_BASE / FRAME_RATE), VIDEO_TIME_BASE)
+            payloads, timestamp = encoder.encode(frame)
+            # One join, not a concatenation per packet
+            data: bytes = b"".join([depayload(payload) for payload in payloads])
+            encoded: float = time.perf_counter()
+            decoded: av.VideoFrame = decoder.decode(JitterFrame(data=data, timestamp=timestamp))[0]
+            result: np.ndarray = method.decode(decoded)
+            decode_time: float = time.perf_counter() - encoded
+            if i < self.warmup:
+                continue
+
+            encode_times.append(encoded - start)
+            decode_times.append(decode_time)
+            sizes.append(len(data))
+            psnrs.append(psnr(frame, decoded))
+            for name, amount in error(result, value).items():
+                errors.setdefault(name, []).append(amount)
+
+        if len(sizes) == 0:
+            raise ValueError("No frames left after the warmup!")
+        return {
+            "codec": self.codec,
+            "method": type(method).__name__,
+            "frames": len(sizes),
+            "fps": len(sizes) / (sum(encode_times) + sum(decode_times)),
+            "encode_ms": percentiles(encode_times),
+            "decode_ms": percentiles(decode_times),
+            "bytes_per_frame": float(np.mean(sizes)),
+            "kbps": float(np.mean(sizes)) * FRAME_RATE * 8 / 1000,
+            "psnr": float(np.mean(psnrs)),
+            "error": {name: float(np.mean(amounts)) for name, amounts in errors.items()},
+            "error_max": {name: float(np.max(amounts)) for name, amounts in errors.items()}, # Of the worst frame
+        }
+
+
+def percentiles(times: List[float]) -> Dict[str, float]:
+    milliseconds: np.ndarray = np.array(times) * 1000
+    return {
+        "mean": float(milliseconds.mean()),
+        "p50": float(np.percentile(milliseconds, 50)),
+        "p95": float(np.percentile(milliseconds, 95)),
+        "p99": float(np.percentile(milliseconds, 99)),
+        "max": float(milliseconds.max()),
+    }
+
+
+def yuv_planes(frame: av.VideoFrame) -> np.ndarray:
+    if frame.format.name != "yuv420p":
+        frame = frame.reformat(format="yuv420p")
+    return frame.to_ndarray()
+
+
+def psnr(original: av.VideoFrame, decoded: av.VideoFrame) -> float:
+    # Over all three planes of the yuv420p frames the codec actually saw
+    difference: np.ndarray = yuv_planes(original).astype(np.float32) - yuv_planes(decoded)
+    mse: float = float(np.mean(difference ** 2))
+    return MAX_PSNR if mse == 0 else min(MAX_PSNR, 10 * np.log10(255 ** 2 / mse))
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "av": av.__version__,
+        "aiortc": aiortc.__version__,
+    }
+
+
+def print_result(result: Dict[str, object]) -> None:
+    errors: str = ", ".join(f"{name} {amount:.4g}" for name, amount in result["error"].items())
+    print(
+        f"  {result['codec']:<4} {result['method']:<16} {result['fps']:6.1f}fps, "
+        f"encode p50 {result['encode_ms']['p50']:5.1f}ms p95 {result['encode_ms']['p95']:5.1f}ms, "
+        f"decode p50 {result['decode_ms']['p50']:5.1f}ms p95 {result['decode_ms']['p95']:5.1f}ms, "
+        f"{result['bytes_per_frame']:7.0f}B/frame, PSNR {result['psnr']:5.2f}dB, {errors}"
+    )
+
+
+def write_results(path: str, task: str, settings: Dict[str, object], results: List[Dict[str, object]]) -> None:
+    # To stdout without a path
+    report: Dict[str, object] = {"task": task, "settings": settings, "environment": environment(), "results": results}
+    if path is None:
+        print(json.dumps(report, indent=2))
+        return
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {path}")
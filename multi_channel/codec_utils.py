@@ -0,0 +1,115 @@
+from typing import List, Optional, Tuple
+
+import av
+from aiortc import RTCPeerConnection, RTCRtpCodecCapability, RTCRtpSender
+from aiortc.codecs import get_encoder
+from aiortc.codecs.base import Encoder
+from aiortc.rtcrtpparameters import RTCRtpCodecParameters
+
+CODECS: Tuple[str, ...] = ("VP8", "H264")
+
+
+class CodecSettings:
+    """
+    Per-track video codec choice. Bitrate limits narrow the range the sender's
+    bandwidth estimate may set (aiortc's own range is 250kbps-1.5Mbps for VP8
+    and 500kbps-3Mbps for H264), keyframe_interval forces a keyframe every
+    that many seconds on top of the ones the receiver asks for.
+    """
+    def __init__(
+        self,
+        codec: str = "VP8",
+        min_bitrate: int = None,
+        max_bitrate: int = None,
+        keyframe_interval: float = None
+    ) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec {codec}!")
+        if min_bitrate is not None and max_bitrate is not None and min_bitrate > max_bitrate:
+            raise ValueError("The minimum bitrate must not exceed the maximum bitrate!")
+
+        self.codec: str = codec
+        self.min_bitrate: int = min_bitrate
+        self.max_bitrate: int = max_bitrate
+        self.keyframe_interval: float = keyframe_interval
+
+
+class ConfiguredEncoder(Encoder):
+    # Wraps aiortc's encoder for the codec to apply the CodecSettings
+    def __init__(self, settings: CodecSettings) -> None:
+        self.settings: CodecSettings = settings
+        self.encoder: Encoder = get_encoder(RTCRtpCodecParameters(
+            mimeType=f"video/{settings.codec}", clockRate=90000
+        ))
+        self.last_keyframe: float = None
+        self.keyframes: int = 0
+        self.start_bitrate: int = self.encoder.target_bitrate
+        self.estimate: int = None # Latest receiver estimate (REMB)
+        self.limit: int = None # Set by a RateController
+        self.__update()
+
+    @property
+    def target_bitrate(self) -> int:
+        return self.encoder.target_bitrate
+
+    @target_bitrate.setter
+    def target_bitrate(self, bitrate: int) -> None:
+        # Called by the sender with the receiver's estimate (REMB)
+        self.estimate = bitrate
+        self.__update()
+
+    def set_limit(self, bitrate: Optional[int]) -> None:
+        self.limit = bitrate
+        self.__update()
+
+    def __update(self) -> None:
+        bitrate: int = self.start_bitrate if self.estimate is None else self.estimate
+        if self.limit is not None:
+            bitrate = min(bitrate, self.limit)
+        if self.settings.max_bitrate is not None:
+            bitrate = min(bitrate, self.settings.max_bitrate)
+        if self.settings.min_bitrate is not None:
+            bitrate = max(bitrate, self.settings.min_bitrate)
+        self.encoder.target_bitrate = bitrate
+        if self.limit is not None and bitrate < self.encoder.target_bitrate:
+            # aiortc's encoders clamp to their codec's minimum, but on a slower
+            # link a RateController has to go under it
+            setattr(self.encoder, f"_{type(self.encoder).__name__}__target_bitrate", bitrate)
+
+    def encode(self, frame: av.VideoFrame, force_keyframe: bool = False) -> Tuple[List[bytes], int]:
+        interval: float = self.settings.keyframe_interval
+        if interval is not None and frame.time is not None:
+            if self.last_keyframe is None or frame.time - self.last_keyframe >= interval:
+                force_keyframe = True
+        if force_keyframe:
+            self.last_keyframe = frame.time
+            self.keyframes += 1
+        return self.encoder.encode(frame, force_keyframe)
+
+    def pack(self, packet: av.Packet) -> Tuple[List[bytes], int]:
+        # Already encoded elsewhere, the settings do not apply
+        return self.encoder.pack(packet)
+
+
+def codec_capabilities(codec: str) -> List[RTCRtpCodecCapability]:
+    # Every profile of the codec, plus retransmission
+    return [
+        capability for capability in RTCRtpSender.getCapabilities("video").codecs
+        if capability.mimeType in (f"video/{codec}", "video/rtx")
+    ]
+
+
+def configured_encoder(sender: RTCRtpSender) -> Optional[ConfiguredEncoder]:
+    # The encoder put in by apply_codec_settings, None for any other sender
+    encoder: Encoder = getattr(sender, "_RTCRtpSender__encoder", None)
+    return encoder if isinstance(encoder, ConfiguredEncoder) else None
+
+
+def apply_codec_settings(pc: RTCPeerConnection, sender: RTCRtpSender, settings: CodecSettings) -> None:
+    for transceiver in pc.getTransceivers():
+        if transceiver.sender is sender:
+            # Only this codec is offered, so the answer cannot pick another one
+            transceiver.setCodecPreferences(codec_capabilities(settings.codec))
+    # The sender creates its encoder lazily for the negotiated codec, which
+    # is now known, put ours in first
+    sender._RTCRtpSender__encoder = ConfiguredEncoder(settings)
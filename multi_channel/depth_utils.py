@@ -0,0 +1,182 @@
+import fractions
+from typing import Callable, List, Tuple
+
+import av
+import cv2
+import numpy as np
+
+from frame_utils import wrap_ndarray
+
+DEPTH_LEVELS: int = 8192 # 13 bits, what two 8-bit waves resolve exactly
+PERIOD: int = 512 # Of the fine waves in depth levels, one wave level per depth level
+MAX_WAVE_ERROR: float = 0.1
+OUTLIER_WINDOW: int = 5 # Of the median and the edge sides in the wrap repair
+
+
+class DepthPacker:
+    """
+    Carries depth maps over an 8-bit video codec. Depth in [near, far] is
+    quantized to 13 bits and sent as three luma tiles stacked vertically,
+    after Pece et al., "Adapting Standard Video Codecs for Depth Streaming":
+    the depth scaled to 8 bits as coarse depth and two triangle waves of the
+    full value, a quarter period apart, as fine depth. Unlike a low byte, a
+    triangle wave has no 255 to 0 jump for the codec to smear, and one of the
+    two is always away from its peaks. Each wave rises one level per depth
+    level, so without codec loss unpack gives back every level exactly. The
+    waves give the depth within a period, the coarse depth only has to pick
+    the period, so a coarse error up to half a period (8 luma steps) is
+    corrected. Where a depth edge blurs the coarse tile further, unpack
+    repairs the wrapped periods from the neighbourhood. Chroma is left flat,
+    the tiles keep the full resolution subsampled chroma would halve.
+    """
+    def __init__(self, near: float = 0.0, far: float = 10.0, buffers: int = 2) -> None:
+        if far <= near:
+            raise ValueError("The far end of the depth range must be beyond the near end!")
+
+        self.near: float = near
+        self.far: float = far
+        self.buffer_count: int = buffers
+        self.buffers: List[np.ndarray] = []
+        self.index: int = 0
+
+    @property
+    def step(self) -> float:
+        # Depth of one level
+        return (self.far - self.near) / (DEPTH_LEVELS - 1)
+
+    def quantize(self, depth: np.ndarray) -> np.ndarray:
+        # Invalid (NaN) depth becomes 0
+        scaled: np.ndarray = (np.nan_to_num(depth, nan=self.near) - self.near) / self.step
+        return np.clip(np.rint(scaled), 0, DEPTH_LEVELS - 1).astype(np.uint16)
+
+    def dequantize(self, value: np.ndarray) -> np.ndarray:
+        return (value * self.step + self.near).astype(np.float32)
+
+    def pack(self, depth: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        # (H, W) depth to the (3H, W) luma tiles
+        depth = depth.reshape(depth.shape[:2])
+        height, width = depth.shape
+        if out is None:
+            out = np.empty((3 * height, width), dtype=np.uint8)
+        value: np.ndarray = self.quantize(depth).astype(np.float32)
+        out[:height] = np.rint(value * (255 / (DEPTH_LEVELS - 1)))
+        # Level r of a period is wave level r on the way up and 511 - r on
+        # the way down, the half level offsets make that exact
+        phase: np.ndarray = (value + 0.5) / PERIOD
+        out[height:2 * height] = np.rint(PERIOD / 2 * triangle(phase) - 0.5)
+        out[2 * height:] = np.rint(PERIOD / 2 * triangle(phase - 0.25) - 0.5)
+        return out
+
+    def unpack(self, luma: np.ndarray) -> np.ndarray:
+        height: int = luma.shape[0] // 3
+        coarse_step: float = (DEPTH_LEVELS - 1) / 255
+        coarse: np.ndarray = luma[:height].astype(np.float32) * coarse_step
+        # The fine depth level within a period and whether the waves are
+        # intact, looked up for each pair of wave values
+        waves: np.ndarray = luma[height:2 * height].astype(np.uint16) << 8 | luma[2 * height:3 * height]
+        fine: np.ndarray = FINE_LEVELS[waves]
+        broken: np.ndarray = BROKEN_WAVES[waves]
+
+        # The period is the one that puts it nearest the coarse depth
+        value: np.ndarray = nearest_period(coarse, fine)
+
+        # Across a depth edge the codec blurs the waves into anything, keep
+        # the coarse depth there
+        value = np.where(broken, coarse, value)
+
+        # At a depth edge the codec blurs the coarse tile by more than half a
+        # period, the period picked from it is off by one or more. Suspect
+        # are pixels on a coarse edge or apart from the median around them,
+        # but only if they are also a coarse step off the coarse depth,
+        # which never happens without codec loss. They take the side of the
+        # edge their coarse depth is nearer to, the lowest or highest median
+        # around them, and the period that puts them nearest that side.
+        median: np.ndarray = cv2.medianBlur(np.rint(value).astype(np.uint16), OUTLIER_WINDOW).astype(np.float32)
+        kernel: np.ndarray = np.ones((OUTLIER_WINDOW, OUTLIER_WINDOW), dtype=np.uint8)
+        low, high = cv2.erode(median, kernel), cv2.dilate(median, kernel)
+        side: np.ndarray = np.where(np.abs(coarse - low) < np.abs(coarse - high), low, high)
+        edge: np.ndarray = cv2.dilate(coarse, kernel[:3, :3]) - cv2.erode(coarse, kernel[:3, :3]) > PERIOD
+        wrapped: np.ndarray = (np.abs(value - coarse) > coarse_step) & (edge | (np.abs(value - median) > PERIOD / 4))
+        value = np.where(wrapped, np.where(broken, side, nearest_period(side, fine)), value)
+        value = np.where(broken & edge, side, value)
+        return self.dequantize(np.rint(value))
+
+    def __next_buffer(self, height: int, width: int) -> np.ndarray:
+        shape: tuple = (3 * height * 3 // 2, width)
+        if len(self.buffers) == 0 or self.buffers[0].shape != shape:
+            self.buffers = [np.full(shape, 128, dtype=np.uint8) for _ in range(self.buffer_count)]
+        buffer: np.ndarray = self.buffers[self.index]
+        self.index = (self.index + 1) % self.buffer_count
+        return buffer
+
+    def frame(self, depth: np.ndarray, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        # Packed into the luma of a reused yuv420p buffer, the chroma stays 128
+        height, width = depth.shape[:2]
+        if height % 2 or width % 2:
+            raise ValueError("Depth maps need an even width and height!")
+        buffer: np.ndarray = self.__next_buffer(height, width)
+        self.pack(depth, buffer[:3 * height])
+        frame: av.VideoFrame = wrap_ndarray(buffer, "yuv420p")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: av.VideoFrame) -> np.ndarray:
+        # Straight from the luma plane, a conversion to gray could rescale it
+        plane = frame.planes[0]
+        luma: np.ndarray = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)
+        return self.unpack(luma[:, :plane.width])
+
+
+def triangle(phase: np.ndarray) -> np.ndarray:
+    # 0 at whole phases, 1 half way between
+    return 2 * np.abs(phase - np.floor(phase + 0.5))
+
+
+def wave_tables() -> Tuple[np.ndarray, np.ndarray]:
+    # For each pair of wave values, indexed by a << 8 | b, the fine depth
+    # level and whether they are too far apart to come from one depth
+    wave_a, wave_b = (np.mgrid[0:256, 0:256].reshape(2, -1).astype(np.float32) + 0.5) / (PERIOD / 2)
+
+    # Together the two waves give the phase within a period: the one in
+    # its linear part gives two candidates, the other one, near a peak,
+    # tells them apart
+    use_a: np.ndarray = np.abs(wave_a - 0.5) < np.abs(wave_b - 0.5)
+    phase: np.ndarray = np.where(
+        use_a,
+        np.where(wave_b < 0.5, wave_a / 2, 1 - wave_a / 2),
+        np.where(wave_a > 0.5, 0.25 + wave_b / 2, 0.25 - wave_b / 2)
+    ) % 1.0
+
+    # Intact waves always have |a - 0.5| + |b - 0.5| = 0.5
+    broken: np.ndarray = np.abs(np.abs(wave_a - 0.5) + np.abs(wave_b - 0.5) - 0.5) > MAX_WAVE_ERROR
+    return phase * PERIOD - 0.5, broken
+
+
+def nearest_period(reference: np.ndarray, fine: np.ndarray) -> np.ndarray:
+    # The depth level with the fine phase nearest the reference
+    return np.clip(np.rint((reference - fine) / PERIOD) * PERIOD + fine, 0, DEPTH_LEVELS - 1)
+
+
+def synthetic_depth(width: int = 640, height: int = 480, far: float = 10.0) -> Callable[[int], np.ndarray]:
+    # Stand-in for a depth camera: a floor and a back wall, with a sphere
+    # moving across the room, returns the depth map of a given frame
+    rows, columns = np.mgrid[0:height, 0:width].astype(np.float32)
+    room: np.ndarray = np.minimum(0.8 * far, 0.3 * far * height / np.maximum(rows - height * 0.4, 1))
+    room += 0.05 * np.sin(columns / 17) # Some texture
+    radius: float = height / 5
+
+    def depth_frame(index: int) -> np.ndarray:
+        x: float = width / 2 + width / 3 * np.sin(index / 30)
+        distance: np.ndarray = ((columns - x) ** 2 + (rows - height / 2) ** 2) / radius ** 2
+        sphere: np.ndarray = 0.3 * far - 0.1 * far * np.sqrt(np.clip(1 - distance, 0, 1))
+        return np.where(distance < 1, sphere, room).astype(np.float32)
+    return depth_frame
+
+
+FINE_LEVELS, BROKEN_WAVES = wave_tables()
+
+
+def colorize(depth: np.ndarray, near: float, far: float) -> np.ndarray:
+    # For display only
+    scaled: np.ndarray = np.clip((depth - near) / (far - near) * 255, 0, 255).astype(np.uint8)
+    return cv2.applyColorMap(scaled, cv2.COLORMAP_JET)
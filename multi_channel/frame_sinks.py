@@ -0,0 +1,145 @@
+import threading
+from typing import Callable, Dict
+
+import av
+import cv2
+import numpy as np
+
+from render_thread import RenderThread
+from depth_utils import DepthPacker
+
+
+class ReceivedFrame:
+    """
+    Decoded frame handed to the sinks of a track. A pixel format is converted
+    the first time a sink asks for it and the result is shared by every
+    other sink wanting the same format, a frame nobody asks for is never
+    converted at all.
+    """
+    conversions: int = 0 # Over all frames, for the statistics
+
+    def __init__(self, frame: av.VideoFrame) -> None:
+        self.frame: av.VideoFrame = frame
+        self.__images: Dict[str, np.ndarray] = {}
+
+    def to_ndarray(self, format: str = "bgr24") -> np.ndarray:
+        image: np.ndarray = self.__images.get(format)
+        if image is None:
+            image = self.frame.to_ndarray(format=format)
+            self.__images[format] = image
+            ReceivedFrame.conversions += 1
+        return image
+
+
+class FrameSink:
+    def __init__(self) -> None:
+        self.frames: int = 0
+
+    def consume(self, frame: ReceivedFrame) -> None:
+        self.frames += 1
+
+    def close(self) -> None:
+        pass
+
+
+class NullSink(FrameSink):
+    # Keeps the track drained so its jitter buffer does not fill up
+    pass
+
+
+class DisplaySink(FrameSink):
+    def __init__(self, renderer: RenderThread, window_name: str) -> None:
+        super().__init__()
+        self.renderer: RenderThread = renderer
+        self.window_name: str = window_name
+
+    def consume(self, frame: ReceivedFrame) -> None:
+        super().consume(frame)
+        # The render thread converts it, only if it gets to show it
+        self.renderer.submit(self.window_name, frame)
+
+
+class RecordSink(FrameSink):
+    def __init__(self, path: str, fps: float = 30, fourcc: str = "mp4v") -> None:
+        super().__init__()
+        self.path: str = path
+        self.fps: float = fps
+        self.fourcc: str = fourcc
+        self.writer: cv2.VideoWriter = None
+
+    def consume(self, frame: ReceivedFrame) -> None:
+        super().consume(frame)
+        image: np.ndarray = frame.to_ndarray("bgr24")
+        if self.writer is None:
+            height, width = image.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        self.writer.write(image)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.release()
+
+
+class AnalyzeSink(FrameSink):
+    def __init__(self, analyze: Callable[[np.ndarray], None], format: str = "gray", every: int = 1) -> None:
+        super().__init__()
+        self.analyze: Callable[[np.ndarray], None] = analyze
+        self.format: str = format
+        self.every: int = every
+
+    def consume(self, frame: ReceivedFrame) -> None:
+        super().consume(frame)
+        if self.frames % self.every == 0:
+            self.analyze(frame.to_ndarray(self.format))
+
+
+class DepthSink(FrameSink):
+    """
+    Unpacks the frames of a DepthStreamTrack in its own thread, the latest
+    depth map in metres is kept for whoever needs it. As with RenderThread,
+    a frame arriving while the previous one is still being unpacked replaces
+    the one waiting, so the event loop never waits for an unpack.
+    """
+    def __init__(self, packer: DepthPacker, analyze: Callable[[np.ndarray], None] = None) -> None:
+        super().__init__()
+        self.packer: DepthPacker = packer
+        self.analyze: Callable[[np.ndarray], None] = analyze
+        self.depth: np.ndarray = None
+        self.unpacked: int = 0
+        self.skipped: int = 0
+        self.__condition: threading.Condition = threading.Condition()
+        self.__pending: av.VideoFrame = None
+        self.__stopped: bool = False
+        self.__thread: threading.Thread = None
+
+    def consume(self, frame: ReceivedFrame) -> None:
+        super().consume(frame)
+        with self.__condition:
+            if self.__thread is None:
+                # Only once a depth track is actually received
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            if self.__pending is not None:
+                self.skipped += 1
+            self.__pending = frame.frame
+            self.__condition.notify()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending is not None or self.__stopped)
+                if self.__stopped:
+                    return
+                frame, self.__pending = self.__pending, None
+
+            self.depth = self.packer.decode(frame)
+            self.unpacked += 1
+            if self.analyze is not None:
+                self.analyze(self.depth)
+
+    def close(self) -> None:
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
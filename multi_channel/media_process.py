@@ -0,0 +1,257 @@
+import struct
+import asyncio
+import fractions
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional, Tuple
+
+import av
+import cv2
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from frame_utils import FrameBuilder, frame_cache, make_pattern
+from pacing import Pacer
+
+# Copied from aiortc source code
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+DEFAULT_BITRATE = 500000 # Same start value as aiortc's encoders
+
+
+class PacketRing:
+    """
+    Bounded single-producer single-consumer ring of encoded packets over
+    multiprocessing.shared_memory. Each slot holds a size, pts and the packet
+    bytes, two semaphores count the free and filled slots, so a full ring
+    makes the writer wait instead of overwriting packets the decoder needs.
+    """
+    HEADER: struct.Struct = struct.Struct("<Iq")
+
+    def __init__(self, slots: int = 8, slot_size: int = 1024 * 1024) -> None:
+        self.slots: int = slots
+        self.slot_size: int = slot_size
+        self.shm: shared_memory.SharedMemory = shared_memory.SharedMemory(
+            create=True, size=slots * (self.HEADER.size + slot_size)
+        )
+        self.free: Any = multiprocessing.Semaphore(slots)
+        self.filled: Any = multiprocessing.Semaphore(0)
+        self.index: int = 0 # Local to each side, there is one of each
+
+    def __getstate__(self) -> dict:
+        # Sent to the worker process, which attaches to the same memory
+        state: dict = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+
+    def __slot(self) -> int:
+        offset: int = self.index * (self.HEADER.size + self.slot_size)
+        self.index = (self.index + 1) % self.slots
+        return offset
+
+    def write(self, data: bytes, pts: int, timeout: float = None) -> bool:
+        if len(data) > self.slot_size:
+            raise ValueError(f"Packet of {len(data)} bytes does not fit a {self.slot_size} bytes slot")
+        if not self.free.acquire(timeout=timeout):
+            return False
+        offset: int = self.__slot()
+        self.HEADER.pack_into(self.shm.buf, offset, len(data), pts)
+        start: int = offset + self.HEADER.size
+        self.shm.buf[start:start + len(data)] = data
+        self.filled.release()
+        return True
+
+    def read(self, timeout: float = None) -> Optional[Tuple[bytes, int]]:
+        if not self.filled.acquire(timeout=timeout):
+            return None
+        offset: int = self.__slot()
+        size, pts = self.HEADER.unpack_from(self.shm.buf, offset)
+        start: int = offset + self.HEADER.size
+        data: bytes = bytes(self.shm.buf[start:start + size])
+        self.free.release()
+        return data, pts
+
+    def close(self) -> None:
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+def create_encoder(codec: str, width: int, height: int, bitrate: int, fps: int) -> av.CodecContext:
+    # Same settings as aiortc's Vp8Encoder and H264Encoder, plus a keyframe
+    # every two seconds since the worker cannot see the receiver's PLI
+    if codec == "VP8":
+        encoder: av.CodecContext = av.CodecContext.create("libvpx", "w")
+        encoder.qmin, encoder.qmax = 2, 56
+        encoder.options = {
+            "bufsize": str(bitrate),
+            "cpu-used": "-6",
+            "deadline": "realtime",
+            "lag-in-frames": "0",
+            "minrate": str(bitrate),
+            "maxrate": str(bitrate),
+            "noise-sensitivity": "4",
+            "overshoot-pct": "15",
+            "partitions": "0",
+            "static-thresh": "1",
+            "undershoot-pct": "100",
+        }
+    elif codec == "H264":
+        encoder = av.CodecContext.create("libx264", "w")
+        encoder.options = {"level": "31", "tune": "zerolatency"}
+        encoder.profile = "Baseline"
+    else:
+        raise ValueError(f"Unsupported codec {codec}!")
+
+    encoder.width, encoder.height = width, height
+    encoder.bit_rate = bitrate
+    encoder.pix_fmt = "yuv420p"
+    encoder.time_base = VIDEO_TIME_BASE
+    encoder.framerate = fractions.Fraction(fps, 1)
+    encoder.gop_size = 2 * fps
+    return encoder
+
+
+def create_source(source: str, width: int, height: int) -> Callable[[int, int], av.VideoFrame]:
+    # Returns a function building the yuv420p frame with the given index and pts
+    builder: FrameBuilder = FrameBuilder()
+    if source == "camera":
+        cap: cv2.VideoCapture = cv2.VideoCapture(0)
+
+        def camera_frame(index: int, pts: int) -> av.VideoFrame:
+            ret, image = cap.read() # Blocks this worker only
+            if not ret:
+                raise RuntimeError("Failed to read frame from camera")
+            if image.shape[:2] != (height, width):
+                image = cv2.resize(image, (width, height))
+            return builder.build(image, pts, VIDEO_TIME_BASE)
+        return camera_frame
+
+    if source in ("colored", "mosaic"):
+        def pattern_frame(index: int, pts: int) -> av.VideoFrame:
+            value: int = index % 256 // 2 if source == "colored" else 5
+            return frame_cache.frame(
+                ("solid", width, height, value),
+                lambda: make_pattern("solid", width, height, value),
+                pts, VIDEO_TIME_BASE
+            )
+        return pattern_frame
+
+    if source == "noise":
+        # Camera-like load for the encoder, a few random images in turn
+        images = [np.random.randint(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+
+        def noise_frame(index: int, pts: int) -> av.VideoFrame:
+            return builder.build(images[index % len(images)], pts, VIDEO_TIME_BASE)
+        return noise_frame
+
+    raise ValueError(f"Unknown source {source}!")
+
+
+def media_worker(
+    ring: PacketRing,
+    stopped: Any,
+    started: Any,
+    source: str,
+    width: int,
+    height: int,
+    fps: int,
+    codec: str,
+    bitrate: int
+) -> None:
+    # Capture, conversion and encoding of one track, in its own process
+    next_frame: Callable[[int, int], av.VideoFrame] = create_source(source, width, height)
+    encoder: av.CodecContext = create_encoder(codec, width, height, bitrate, fps)
+    index: int = 0
+    keyframe: bool = False
+    try:
+        # Nothing is encoded before the sender asks for the first packet, or
+        # the ring would be full of stale packets once the connection is up
+        while not started.wait(0.5):
+            if stopped.is_set():
+                return
+        pacer: Pacer = Pacer(fps)
+        while not stopped.is_set():
+            # A slow capture or encode skips frames instead of bursting
+            pts: int = int(pacer.tick_sync(stopped.wait) * VIDEO_CLOCK_RATE)
+            frame: av.VideoFrame = next_frame(index, pts)
+            # After a drop the next packets cannot be decoded without the
+            # dropped one, start over from a keyframe
+            frame.pict_type = av.video.frame.PictureType.I if keyframe else av.video.frame.PictureType.NONE
+            keyframe = False
+            for packet in encoder.encode(frame):
+                # A consumer a second behind has stopped reading, drop the packet
+                if not ring.write(bytes(packet), packet.pts, timeout=1.0):
+                    logging.warning(f"Dropped {source} packet, the ring is full")
+                    keyframe = True
+            index += 1
+    finally:
+        ring.close()
+
+
+class ProcessStreamTrack(MediaStreamTrack):
+    """
+    Video track whose frames are captured, converted and encoded by a worker
+    process. recv returns the encoded av.Packet, which RTCRtpSender only
+    packetizes, so the event loop is left with ICE, DTLS, SRTP and SCTP.
+    The worker starts encoding on the first recv, and after it had to drop a
+    packet for a full ring it goes on with a keyframe.
+    The codec must match the negotiated one and the encoder bitrate is fixed,
+    the sender's bandwidth estimate does not reach the worker.
+    """
+    kind = "video"
+
+    def __init__(
+        self,
+        source: str,
+        width: int = 640,
+        height: int = 480,
+        fps: int = 30,
+        codec: str = "VP8",
+        bitrate: int = DEFAULT_BITRATE
+    ) -> None:
+        super().__init__()
+        self.source: str = source
+        self.ring: PacketRing = PacketRing()
+        self.stopped: Any = multiprocessing.Event()
+        self.started: Any = multiprocessing.Event()
+        self.process: multiprocessing.Process = multiprocessing.Process(
+            target=media_worker,
+            args=(self.ring, self.stopped, self.started, source, width, height, fps, codec, bitrate),
+            daemon=True
+        )
+        self.process.start()
+        self.packets: int = 0
+
+    async def recv(self) -> av.Packet:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.started.set()
+        data: Optional[Tuple[bytes, int]] = None
+        while data is None:
+            if self.readyState != "live":
+                raise MediaStreamError
+            data = await loop.run_in_executor(None, self.ring.read, 0.5)
+
+        payload, pts = data
+        packet: av.Packet = av.Packet(payload)
+        packet.pts, packet.time_base = pts, VIDEO_TIME_BASE
+        self.packets += 1
+        return packet
+
+    def stop(self) -> None:
+        if self.readyState == "ended":
+            return
+        super().stop()
+        self.stopped.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+        self.ring.unlink()
@@ -3,105 +3,267 @@ import json
 import logging
 import asyncio
 import fractions
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 import av
 import cv2
 import numpy as np
-from aiortc import VideoStreamTrack, RTCDataChannel
+from aiortc import MediaStreamTrack, RTCDataChannel, RTCRtpSender
 from aiortc.contrib.media import MediaBlackhole
 
-from signaling_utils import WebRTCClient, initiate_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, initiate_signaling
+from codec_utils import CodecSettings
+from rate_control import AdaptiveStreamTrack, RateController
+from frame_buffer import CaptureThread
+from frame_ring import FrameRing
+from frame_utils import FrameBuilder, frame_cache, make_pattern
+from depth_utils import DepthPacker, synthetic_depth
+from recording import RELEASE_FRAMES, Recording, open_recording
+from replay_track import start_replay
+from media_process import ProcessStreamTrack
 from settings import *
 
 
-class CameraStreamTrack(VideoStreamTrack):
+class CameraStreamTrack(AdaptiveStreamTrack):
     def __init__(self, camera_id: int = 0) -> None:
         super().__init__()
         self.cap: cv2.VideoCapture = cv2.VideoCapture(camera_id)
+        self.frame_builder: FrameBuilder = FrameBuilder()
+        # Capture runs in its own thread and writes into a shared-memory ring,
+        # recv only takes the latest frame, a recorder or preview may read it too
+        width: int = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or 640
+        height: int = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 480
+        self.ring: FrameRing = FrameRing((height, width, 3))
+        self.sequence: int = 0 # Of the last frame sent
+        self.sent: int = 0
+        self.torn: int = 0 # Frames overwritten while they were converted
+        self.capture_thread: CaptureThread = CaptureThread(self.cap, self.ring)
+        self.capture_thread.start()
+
+    @property
+    def dropped(self) -> int:
+        # Frames captured but never sent
+        return max(0, self.ring.latest - self.sent)
+
+    def stop(self) -> None:
+        super().stop()
+        self.capture_thread.stop()
+        self.cap.release()
+        self.ring.close()
+
+    def __convert(self, sequence: int, pts: int, time_base: fractions.Fraction) -> Optional[av.VideoFrame]:
+        # None if the slot is gone or was rewritten during the conversion
+        image: Optional[np.ndarray] = self.ring.view(sequence)
+        if image is None:
+            return None
+        video_frame: av.VideoFrame = self.frame_builder.build(self.scale_image(image), pts, time_base)
+        return video_frame if self.ring.valid(sequence) else None
 
     async def recv(self) -> av.VideoFrame:
         pts, time_base = await self.next_timestamp()
-        ret, frame = self.cap.read()
-        if not ret:
+        sequence: int = self.ring.latest
+        if sequence == 0:
+            # Only until the camera delivers its first frame
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            sequence = await loop.run_in_executor(None, self.ring.wait, 0, 1.0)
+        if sequence == 0:
             return None
 
-        # Convert frame to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = np.ascontiguousarray(frame) # Make sure frame is contiguous in memory
-
-        # Create VideoFrame
-        video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts, video_frame.time_base = pts, time_base
-        print("Video frame sent to the work station")
+        # Convert the ring slot itself to the encoder's yuv420p in a reused buffer,
+        # the captured frame is never copied unless it has to be scaled down
+        video_frame: av.VideoFrame = self.__convert(sequence, pts, time_base)
+        while video_frame is None:
+            # The capture thread overwrote the slot, take the newest frame
+            self.torn += 1
+            sequence = self.ring.latest
+            video_frame = self.__convert(sequence, pts, time_base)
+        if sequence != self.sequence:
+            self.sequence, self.sent = sequence, self.sent + 1
+        print(f"Video frame sent to the work station ({self.dropped} dropped)")
 
         return video_frame
 
 
-class ColoredStreamTrack(VideoStreamTrack):
-    def __init__(self) -> None:
+class ColoredStreamTrack(AdaptiveStreamTrack):
+    def __init__(self, width: int = 640, height: int = 480, pattern: str = "solid") -> None:
         super().__init__()
         self.channel_num: int = 0
+        self.width, self.height, self.pattern = width, height, pattern
 
     async def recv(self) -> av.VideoFrame:
         pts, time_base = await self.next_timestamp()
-        frame = np.ones((480, 640, 3), dtype=np.uint8) * self.channel_num // 2
-        print(f"Colored frame {self.channel_num // 2} sent to the work station")
+        value: int = self.channel_num // 2
+        print(f"Colored frame {value} sent to the work station")
         self.channel_num = (self.channel_num + 1) % 256
 
-        # Convert frame to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = np.ascontiguousarray(frame) # Make sure frame is contiguous in memory
-
-        # Create VideoFrame
-        video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts, video_frame.time_base = pts, time_base
+        # Each of the 128 colours is synthesized and converted only once per size
+        width, height = self.scaled_size(self.width, self.height)
+        video_frame: av.VideoFrame = frame_cache.frame(
+            (self.pattern, width, height, value),
+            lambda: make_pattern(self.pattern, width, height, value),
+            pts, time_base
+        )
 
         return video_frame
 
 
-class MosaicStreamTrack(VideoStreamTrack):
+class MosaicStreamTrack(AdaptiveStreamTrack):
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        pattern: str = "solid",
+        value: int = 5
+    ) -> None:
+        super().__init__()
+        self.width, self.height, self.pattern, self.value = width, height, pattern, value
+
     async def recv(self) -> av.VideoFrame:
         pts, time_base = await self.next_timestamp()
-        frame = np.ones((480, 640, 3), dtype=np.uint8) * 5
-
-        # Convert frame to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = np.ascontiguousarray(frame) # Make sure frame is contiguous in memory
 
-        # Create VideoFrame
-        video_frame: av.VideoFrame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts, video_frame.time_base = pts, time_base
+        # The constant image is synthesized and converted only once per size
+        width, height = self.scaled_size(self.width, self.height)
+        video_frame: av.VideoFrame = frame_cache.frame(
+            (self.pattern, width, height, self.value),
+            lambda: make_pattern(self.pattern, width, height, self.value),
+            pts, time_base
+        )
         print("Mosaic frame sent to the work station")
 
         return video_frame
 
 
+class DepthStreamTrack(AdaptiveStreamTrack):
+    def __init__(
+        self,
+        near: float = 0.0,
+        far: float = 10.0,
+        source: str = None,
+        width: int = 640,
+        height: int = 480
+    ) -> None:
+        super().__init__()
+        self.packer: DepthPacker = DepthPacker(near, far)
+        self.frame_index: int = 0
+        self.recording: Recording = None
+        if source is not None:
+            # Memory-mapped, a frame is read from disk only when it is sent
+            self.recording = open_recording(source)
+            depths: np.ndarray = self.recording["depth"]
+            self.next_depth = lambda index: depths[index % len(depths)].reshape(depths.shape[1:3])
+        else:
+            self.next_depth = synthetic_depth(width, height, far)
+
+    async def recv(self) -> av.VideoFrame:
+        pts, time_base = await self.next_timestamp()
+        if self.recording is not None:
+            # The recorded frame of this moment, at whatever rate the track runs
+            self.frame_index = int(pts * time_base * self.recording.fps)
+            if self.frame_index % RELEASE_FRAMES == 0:
+                self.recording.release(self.frame_index % len(self.recording))
+
+        # Reading or synthesizing and packing a depth map takes a few tens of
+        # milliseconds, off the event loop. The sender encodes each frame
+        # before asking for the next, so one packing runs at a time.
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        video_frame: av.VideoFrame = await loop.run_in_executor(None, self.__pack, self.frame_index, pts, time_base)
+        self.frame_index += 1
+        print("Depth frame sent to the work station")
+
+        return video_frame
+
+    def __pack(self, index: int, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        # Quantized to 13 bits and packed into the luma of the frame
+        depth: np.ndarray = np.asarray(self.next_depth(index), dtype=np.float32)
+        return self.packer.frame(self.scale_image(depth), pts, time_base)
+
+    @property
+    def pixels(self) -> int:
+        # The packed frame stacks three tiles of the depth map
+        return 3 * self.width * self.height
+
+
 class JackalClient(WebRTCClient):
     def __init__(self, signaling_ip: str, signaling_port: int) -> None:
         super().__init__(signaling_ip, signaling_port)
         self.data_channel: RTCDataChannel = None
+        self.tracks: List[MediaStreamTrack] = []
+        self.rate_controller: RateController = None
+
+    def __create_tracks(self) -> List[MediaStreamTrack]:
+        if REPLAY_DATA is not None:
+            # Recorded frames at their recorded times, the same on every run
+            return start_replay(REPLAY_DATA, REPLAY_MODALITIES, loop=REPLAY_LOOP, depth_range=DEPTH_RANGE)
+        if MEDIA_PROCESSES:
+            # Capture, conversion and encoding run in one worker process per track
+            tracks: List[MediaStreamTrack] = [
+                ProcessStreamTrack(source, codec=MEDIA_CODEC) for source in ("camera", "colored", "mosaic")
+            ]
+        else:
+            tracks = [CameraStreamTrack(), ColoredStreamTrack(), MosaicStreamTrack()]
+        if DEPTH_TRACK:
+            tracks.append(DepthStreamTrack(*DEPTH_RANGE, source=DEPTH_DATA))
+        return tracks
 
     def __setup_track_callbacks(self) -> None:
-        camera_track: CameraStreamTrack = CameraStreamTrack()
-        self.pc.addTrack(camera_track)
-        colored_track: ColoredStreamTrack = ColoredStreamTrack()
-        self.pc.addTrack(colored_track)
-        mosaic_track: MosaicStreamTrack = MosaicStreamTrack()
-        self.pc.addTrack(mosaic_track)
+        # The camera is opened once, reconnects re-add the same tracks
+        if len(self.tracks) == 0:
+            self.tracks = self.__create_tracks()
+        elif REPLAY_DATA is not None:
+            # Only the proxies ended with the old connection, the replay tracks
+            # stood still since. Their shared clock is rebased on the first
+            # recv, so they go on from where they were instead of sending the
+            # frames of the gap in a burst.
+            self.tracks[0].clock.reset()
+        senders: List[RTCRtpSender] = [self.add_track(track, self.__codec_settings(track)) for track in self.tracks]
+        # The worker processes encode at a fixed bitrate, nothing to adapt
+        if ADAPTIVE_RATE and not MEDIA_PROCESSES:
+            self.__setup_rate_control(senders)
+
+    def __setup_rate_control(self, senders: List[RTCRtpSender]) -> None:
+        # One controller per peer connection, a rebuilt one gets a new one
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
+        self.rate_controller = RateController(self.pc)
+        for sender in senders:
+            self.rate_controller.add(sender)
+        self.rate_controller.start()
+
+    def __codec_settings(self, track: MediaStreamTrack) -> CodecSettings:
+        if MEDIA_PROCESSES:
+            # The workers send ready-made packets, only their codec may be negotiated
+            return CodecSettings(MEDIA_CODEC)
+        # Packed depth frames are three times the size of the depth map
+        depth: bool = isinstance(track, DepthStreamTrack) or getattr(track, "modality", None) == "depth"
+        return CodecSettings(
+            VIDEO_CODEC,
+            min_bitrate=DEPTH_MIN_BITRATE if depth else None,
+            max_bitrate=VIDEO_MAX_BITRATE,
+            keyframe_interval=KEYFRAME_INTERVAL
+        )
+
+    def setup_peer_connection(self) -> None:
+        self.__setup_track_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await initiate_signaling(self.pc, self.signaling, timer=self.timer)
 
     async def run(self) -> None:
         await super().run()
-        self.__setup_track_callbacks()
-        await initiate_signaling(self.pc, self.signaling)
 
         await self.done.wait()
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
         await self.pc.close()
         await self.signaling.close()
+        for track in self.tracks:
+            track.stop()
 
 
 async def run_initiator() -> None:
     initiator: WebRTCClient = JackalClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        initiator.set_timer(ConnectionTimer("jackal", TIMING_OUTPUT))
     await initiator.run()
 
 
@@ -1,59 +1,99 @@
 import logging
 import asyncio
+from typing import Dict, List
 
 import av
-import cv2
-import numpy as np
 from aiortc import RTCDataChannel, VideoStreamTrack
-from aiortc.contrib.media import MediaBlackhole, MediaRelay
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
 
-from signaling_utils import WebRTCClient, receive_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, receive_signaling
+from render_thread import RenderThread
+from rate_control import set_jitter_buffer
+from frame_sinks import FrameSink, ReceivedFrame, NullSink, DisplaySink, DepthSink
+from depth_utils import DepthPacker
 from settings import *
 
+TRACK_NAMES: List[str] = ["Camera", "Colored", "Mosaic", "Depth"]
+
 
 class StationClient(WebRTCClient):
     def __init__(self, signaling_server_url: str, room_id: str) -> None:
         super().__init__(signaling_server_url, room_id)
+        # Wait for the Jackal's offer however long it takes
+        self.negotiation_timeout = None
         self.data_channel_event: asyncio.Event = asyncio.Event()
         self.data_channel: RTCDataChannel = None
         self.media_relay: MediaRelay = MediaRelay()
         self.track_counter: int = 0
+        # Decoding stays here, conversion and display happen in the render thread
+        self.renderer: RenderThread = RenderThread()
+        self.renderer.start()
+        # What happens to the frames of each track, only the camera is shown
+        self.track_names: List[str] = TRACK_NAMES
+        self.sinks: Dict[int, List[FrameSink]] = {
+            0: [DisplaySink(self.renderer, "Camera")],
+            1: [NullSink()],
+            2: [NullSink()],
+            3: [DepthSink(DepthPacker(*DEPTH_RANGE))],
+        }
+        if REPLAY_DATA is not None:
+            # The Jackal replays one track per modality instead
+            self.track_names = [modality.capitalize() for modality in REPLAY_MODALITIES]
+            replay_sinks: Dict[str, FrameSink] = {
+                "rgb": DisplaySink(self.renderer, "RGB"),
+                "depth": DepthSink(DepthPacker(*DEPTH_RANGE)),
+            }
+            self.sinks = {i: [replay_sinks.get(modality, NullSink())] for i, modality in enumerate(REPLAY_MODALITIES)}
 
     def __setup_track_callbacks(self) -> None:
+        self.track_counter = 0
+
         @self.pc.on("track")
         async def on_track(track: VideoStreamTrack):
             print("Track received", track.kind)
+            if ADAPTIVE_RATE:
+                # Drops what a lost packet holds up instead of building up delay
+                set_jitter_buffer(self.pc, track)
             if track.kind == "video":
                 current: int = self.track_counter
                 self.track_counter += 1
+                sinks: List[FrameSink] = self.sinks.get(current, [NullSink()])
+                print(f"Demonstrating {self.track_names[current % len(self.track_names)].lower()}")
                 while not self.done.is_set():
-                    frame: av.VideoFrame = await track.recv()
-                    # Process the frame (e.g., display it using OpenCV)
-                    image: np.ndarray = frame.to_ndarray(format="bgr24")
-                    if current == 0:
-                        window_name: str = "Camera"
-                        print("Demonstrating camera")
-                        cv2.imshow(window_name, image)
-                        cv2.waitKey(1)
-                    elif current == 1:
-                        window_name: str = "Colored"
-                        print("Demonstrating colored")
-                    else:
-                        window_name: str = "Mosaic"
-                        print("Demonstrating mosaic")
+                    try:
+                        frame: av.VideoFrame = await track.recv()
+                    except MediaStreamError:
+                        return # Peer connection closed or rebuilt
+                    self.mark_once(f"first_frame_received_{current}")
+                    # Converted only for the sinks asking for a pixel format
+                    received: ReceivedFrame = ReceivedFrame(frame)
+                    for sink in sinks:
+                        sink.consume(received)
+
+    def setup_peer_connection(self) -> None:
+        self.__setup_track_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await receive_signaling(self.pc, self.signaling, timer=self.timer)
 
     async def run(self) -> None:
         await super().run()
-        self.__setup_track_callbacks()
-        await receive_signaling(self.pc, self.signaling)
 
         await self.done.wait()
         await self.pc.close()
         await self.signaling.close()
+        self.renderer.stop()
+        for sinks in self.sinks.values():
+            for sink in sinks:
+                sink.close()
+        print(f"Station frames: {self.renderer.counters}, {ReceivedFrame.conversions} conversions")
 
 
 async def run_receiver() -> None:
     receiver: WebRTCClient = StationClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        receiver.set_timer(ConnectionTimer("station", TIMING_OUTPUT))
     await receiver.run()
 
 
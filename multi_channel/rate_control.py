@@ -0,0 +1,208 @@
+import time
+import asyncio
+import fractions
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender, VideoStreamTrack
+from aiortc.jitterbuffer import JitterBuffer, JitterFrame
+from aiortc.mediastreams import MediaStreamError
+from aiortc.rtp import RtpPacket
+from aiortc.utils import uint16_add
+
+from codec_utils import ConfiguredEncoder, configured_encoder
+from pacing import Pacer
+
+# Copied from aiortc source code
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+# (scale, fps) from the best to the cheapest, a track takes the first one
+# its bitrate gives MIN_BITS_PER_PIXEL at
+QUALITY_LEVELS: Tuple[Tuple[float, int], ...] = (
+    (1.0, 30), (0.75, 30), (0.5, 30), (0.5, 15), (0.25, 15), (0.25, 10)
+)
+MIN_BITS_PER_PIXEL: float = 0.04
+UPGRADE_MARGIN: float = 1.25 # Against switching back and forth
+LOSS_HIGH: float = 0.1
+LOSS_LOW: float = 0.02
+RTT_HIGH: float = 0.3 # Seconds, the queue on the path is filling up
+INCREASE: float = 1.08
+MIN_TARGET: int = 30000
+MAX_GAP_WAIT: float = 0.3 # Seconds a receiver waits for a lost packet
+
+
+class AdaptiveStreamTrack(VideoStreamTrack):
+    """
+    Video track whose resolution and frame rate a RateController may lower.
+    Subclasses build full-size images and pass them through scale_image,
+    next_timestamp paces the frames at the current fps, skipping the frames
+    a stalled loop missed.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.scale: float = 1.0
+        self.fps: int = 30
+        self.width: int = None # Full size of the last image
+        self.height: int = None
+        self.pacer: Pacer = Pacer(self.fps)
+        self.__scaled: np.ndarray = None
+
+    def set_quality(self, scale: float, fps: int) -> None:
+        if (scale, fps) != (self.scale, self.fps):
+            print(f"Track {self.id[:8]} now at {scale:.0%} resolution, {fps} fps")
+        self.scale, self.fps = scale, fps
+        self.pacer.set_rate(fps)
+
+    @property
+    def pixels(self) -> int:
+        # Of a full-size frame as the encoder gets it
+        return self.width * self.height
+
+    def scaled_size(self, width: int, height: int) -> Tuple[int, int]:
+        # Even, as yuv420p needs
+        return max(2, int(width * self.scale) // 2 * 2), max(2, int(height * self.scale) // 2 * 2)
+
+    def scale_image(self, image: np.ndarray) -> np.ndarray:
+        self.height, self.width = image.shape[:2]
+        if self.scale == 1.0:
+            return image
+        width, height = self.scaled_size(self.width, self.height)
+        if self.__scaled is None or self.__scaled.shape[:2] != (height, width):
+            self.__scaled = np.empty((height, width) + image.shape[2:], dtype=image.dtype)
+        cv2.resize(image, (width, height), dst=self.__scaled, interpolation=cv2.INTER_AREA)
+        return self.__scaled
+
+    async def next_timestamp(self) -> Tuple[int, fractions.Fraction]:
+        if self.readyState != "live":
+            raise MediaStreamError
+        return int(await self.pacer.tick() * VIDEO_CLOCK_RATE), VIDEO_TIME_BASE
+
+
+class TrackRate:
+    def __init__(self, sender: RTCRtpSender) -> None:
+        self.sender: RTCRtpSender = sender
+        self.bitrate: int = None # Current target
+        self.loss: float = 0.0
+        self.rtt: float = None
+        self.level: int = 0
+        self.report_time: float = None # Of the last receiver report used
+
+
+class RateController:
+    """
+    Adapts each video track to the link every interval seconds, from the
+    stats of its sender: the loss and RTT of the receiver reports and the
+    receiver's bandwidth estimate (REMB). As in GCC's loss-based control, the
+    target bitrate drops with more than 10% loss or a growing queue and
+    slowly rises under 2%, never above the estimate. The encoder is capped at
+    the target and an AdaptiveStreamTrack lowers its resolution, then its
+    frame rate, to keep enough bits per pixel. That is also the only way
+    under the codec's minimum bitrate, which aiortc's encoders never go below.
+    """
+    def __init__(self, pc: RTCPeerConnection, interval: float = 1.0) -> None:
+        self.pc: RTCPeerConnection = pc
+        self.interval: float = interval
+        self.rates: Dict[RTCRtpSender, TrackRate] = {}
+        self.__task: Optional[asyncio.Task] = None
+
+    def add(self, sender: RTCRtpSender) -> None:
+        # The sender must have been set up with a CodecSettings
+        self.rates[sender] = TrackRate(sender)
+
+    def start(self) -> None:
+        self.__task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def run(self) -> None:
+        while self.pc.connectionState not in ("closed", "failed"):
+            await asyncio.sleep(self.interval)
+            for rate in list(self.rates.values()):
+                await self.update(rate)
+
+    async def update(self, rate: TrackRate) -> None:
+        encoder: ConfiguredEncoder = configured_encoder(rate.sender)
+        if encoder is None:
+            return
+
+        # pc.getStats() only merges these, but cannot tell which receiver
+        # report belongs to which sender
+        for stats in (await rate.sender.getStats()).values():
+            if stats.type == "remote-inbound-rtp" and stats.timestamp != rate.report_time:
+                rate.report_time = stats.timestamp
+                rate.loss = stats.fractionLost / 256
+                rate.rtt = stats.roundTripTime
+
+        bitrate: float = rate.bitrate or encoder.target_bitrate
+        if rate.loss > LOSS_HIGH:
+            bitrate *= 1 - 0.5 * rate.loss
+        elif rate.rtt is not None and rate.rtt > RTT_HIGH:
+            bitrate *= 0.85
+        elif rate.loss < LOSS_LOW:
+            bitrate *= INCREASE
+        ceiling: int = encoder.settings.max_bitrate or 3 * encoder.start_bitrate
+        if encoder.estimate is not None:
+            ceiling = min(ceiling, encoder.estimate)
+        rate.bitrate = int(max(MIN_TARGET, min(bitrate, ceiling)))
+        encoder.set_limit(rate.bitrate)
+
+        # The source behind the TrackProxy of add_track
+        track = getattr(rate.sender.track, "source", rate.sender.track)
+        if isinstance(track, AdaptiveStreamTrack) and track.width is not None:
+            rate.level = self.__select_level(rate, track.pixels)
+            track.set_quality(*QUALITY_LEVELS[rate.level])
+
+    def __select_level(self, rate: TrackRate, pixels: int) -> int:
+        for level, (scale, fps) in enumerate(QUALITY_LEVELS):
+            margin: float = UPGRADE_MARGIN if level < rate.level else 1.0
+            if rate.bitrate / (pixels * scale * scale * fps) >= MIN_BITS_PER_PIXEL * margin:
+                return level
+        return len(QUALITY_LEVELS) - 1
+
+
+class LowLatencyJitterBuffer(JitterBuffer):
+    """
+    Receiver half of the adaptation. aiortc's video jitter buffer waits for a
+    lost packet until 128 newer ones have arrived, seconds at a low bitrate,
+    then releases the frames behind it one per arriving packet, so after a
+    lost retransmission the delay never shrinks again. This one gives up on a
+    packet after max_wait seconds and drops the frames queued behind it, they
+    cannot be decoded before the keyframe its PLI asks for anyway.
+    """
+    def __init__(self, capacity: int = 128, max_wait: float = MAX_GAP_WAIT) -> None:
+        super().__init__(capacity, is_video=True)
+        self.max_wait: float = max_wait
+        self.gap_since: float = None
+        self.skipped: int = 0
+
+    def add(self, packet: RtpPacket) -> Tuple[bool, Optional[JitterFrame]]:
+        pli_flag, frame = super().add(packet)
+        waiting: int = uint16_add(packet.sequence_number, -self._origin)
+        if frame is not None or not self.__has_gap(waiting):
+            self.gap_since = None
+            return pli_flag, frame
+
+        now: float = time.monotonic()
+        if self.gap_since is None:
+            self.gap_since = now
+        elif now - self.gap_since > self.max_wait:
+            self.remove(waiting + 1)
+            self.gap_since = None
+            self.skipped += 1
+            pli_flag = True
+        return pli_flag, None
+
+    def __has_gap(self, waiting: int) -> bool:
+        return any(self._packets[uint16_add(self._origin, i) % self._capacity] is None for i in range(waiting))
+
+
+def set_jitter_buffer(pc: RTCPeerConnection, track: MediaStreamTrack, max_wait: float = MAX_GAP_WAIT) -> None:
+    # Call from the "track" handler, before the first packet arrives
+    for receiver in pc.getReceivers():
+        if receiver.track is track and track.kind == "video":
+            receiver._RTCRtpReceiver__jitter_buffer = LowLatencyJitterBuffer(max_wait=max_wait)
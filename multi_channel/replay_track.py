@@ -0,0 +1,268 @@
+import time
+import queue
+import asyncio
+import threading
+from typing import Callable, List, Sequence, Tuple
+
+import av
+import cv2
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from recording import Recording, open_recording
+from depth_utils import DepthPacker
+from semantic_utils import SemanticCodec
+from frame_utils import wrap_ndarray
+from rate_control import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+
+MODALITIES: Tuple[str, ...] = ("rgb", "depth", "semantic")
+START_DELAY: float = 0.1 # Lead before the first frame, so tracks of a clock start together
+
+
+class ReplayClock:
+    """
+    The time origin shared by replay tracks that start together. The first
+    track to ask fixes it for the current session, after that every track
+    sends its frame recorded at t at origin + t. A reset (e.g. on reconnect)
+    rebases it on the timestamp the tracks have reached, instead of making up
+    the gap in a burst.
+    """
+    def __init__(self, delay: float = START_DELAY) -> None:
+        self.delay: float = delay
+        self.origin: float = None
+
+    def due(self, timestamp: float) -> float:
+        if self.origin is None:
+            self.origin = time.monotonic() + self.delay - timestamp
+        return self.origin + timestamp
+
+    def reset(self) -> None:
+        self.origin = None
+
+
+class ReplayBatch:
+    def __init__(self, size: int, shape: tuple, fill: int) -> None:
+        self.frames: np.ndarray = np.full((size,) + shape, fill, dtype=np.uint8)
+        self.timestamps: np.ndarray = np.zeros(size, dtype=np.float64)
+        self.count: int = 0
+
+
+class ReplayReader(threading.Thread):
+    """
+    Reads one modality of a recording ahead of its track, converting batches
+    of frames into yuv420p buffers. The batch buffers are allocated once and
+    cycle between the free and ready queues.
+    """
+    def __init__(
+        self,
+        recording: Recording,
+        modality: str,
+        convert: Callable[[np.ndarray, np.ndarray], None],
+        shape: tuple,
+        fill: int,
+        loop: bool,
+        batch: int,
+        read_ahead: int
+    ) -> None:
+        super().__init__(daemon=True)
+        self.recording: Recording = recording
+        self.modality: str = modality
+        self.convert: Callable[[np.ndarray, np.ndarray], None] = convert
+        self.loop: bool = loop
+        self.timestamps: np.ndarray = recorded_timestamps(recording)
+        self.stopped: threading.Event = threading.Event()
+        # read_ahead batches ready, one being read, one being filled
+        self.free: queue.Queue = queue.Queue()
+        self.ready: queue.Queue = queue.Queue(maxsize=read_ahead)
+        for _ in range(read_ahead + 2):
+            self.free.put(ReplayBatch(batch, shape, fill))
+
+    def __next_free(self) -> ReplayBatch:
+        while not self.stopped.is_set():
+            try:
+                return self.free.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return None
+
+    def __put(self, batch: ReplayBatch) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.ready.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def run(self) -> None:
+        count: int = len(self.timestamps)
+        # A loop lasts from the first frame to one period past the last
+        duration: float = self.timestamps[-1] + 1.0 / self.recording.fps if count > 0 else 0.0
+        batch: ReplayBatch = self.__next_free()
+        for number, frame in enumerate(self.recording.frames([self.modality], loop=self.loop)):
+            if batch is None:
+                return
+            self.convert(frame[self.modality], batch.frames[batch.count])
+            batch.timestamps[batch.count] = self.timestamps[number % count] + number // count * duration
+            batch.count += 1
+            if batch.count == len(batch.frames):
+                self.__put(batch)
+                batch = self.__next_free()
+                if batch is not None:
+                    batch.count = 0
+        if batch is not None and batch.count > 0:
+            self.__put(batch)
+        self.__put(None) # The end of the recording
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+class ReplayStreamTrack(MediaStreamTrack):
+    """
+    Plays back one modality of a recording (see recording.py) at its
+    recorded timestamps, for load tests that need the same input on every
+    run: "rgb" frames as they are, "depth" packed by DepthPacker, "semantic"
+    by SemanticCodec. Tracks sharing a ReplayClock start together and stay
+    in step. A ReplayReader thread reads and converts batches ahead, so recv
+    only waits for the due time of the frame. Frames are never skipped, a
+    late one goes out at once. A speed of 0 sends them as fast as the sender
+    takes them, for throughput runs.
+    """
+    kind = "video"
+
+    def __init__(
+        self,
+        source: str,
+        modality: str = "rgb",
+        clock: ReplayClock = None,
+        loop: bool = False,
+        speed: float = 1.0,
+        batch: int = 8,
+        read_ahead: int = 4,
+        depth_range: tuple = (0.0, 10.0),
+        labels: Sequence[int] = None
+    ) -> None:
+        super().__init__()
+        self.recording: Recording = open_recording(source)
+        if modality not in self.recording.modalities:
+            raise ValueError(f"The recording at {source} has no {modality}!")
+
+        self.modality: str = modality
+        self.clock: ReplayClock = clock if clock is not None else ReplayClock()
+        self.speed: float = speed
+        self.batch: ReplayBatch = None
+        self.position: int = 0
+        self.sent: int = 0
+        self.late: int = 0
+        self.max_lateness: float = 0.0
+        self.underruns: int = 0 # Batches recv had to wait for
+        self.__waiting: asyncio.Future = None # A read the last recv left behind
+        convert, shape, fill = frame_converter(self.recording, modality, depth_range, labels)
+        self.reader: ReplayReader = ReplayReader(self.recording, modality, convert, shape, fill, loop, batch, read_ahead)
+        self.reader.start()
+
+    async def __next_batch(self) -> ReplayBatch:
+        # The sender encodes a frame before asking for the next one, so the
+        # previous batch is done with once its last frame was returned
+        if self.batch is not None:
+            self.reader.free.put(self.batch)
+            self.batch = None
+        if self.__waiting is None:
+            try:
+                return self.reader.ready.get_nowait()
+            except queue.Empty:
+                self.underruns += 1
+        loop = asyncio.get_running_loop()
+        while self.readyState == "live":
+            if self.__waiting is None:
+                self.__waiting = loop.run_in_executor(None, self.reader.ready.get, True, 0.5)
+            # A closing peer connection cancels recv, the batch being read
+            # then goes to the next recv instead of being lost
+            try:
+                batch: ReplayBatch = await asyncio.shield(self.__waiting)
+            except queue.Empty:
+                self.__waiting = None
+                continue
+            self.__waiting = None
+            return batch
+        raise MediaStreamError
+
+    async def recv(self) -> av.VideoFrame:
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self.batch is None or self.position == self.batch.count:
+            self.batch, self.position = await self.__next_batch(), 0
+            if self.batch is None:
+                self.stop() # Played to the end
+                raise MediaStreamError
+
+        timestamp: float = self.batch.timestamps[self.position]
+        if self.speed > 0:
+            delay: float = self.clock.due(timestamp / self.speed) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < 0:
+                self.late += 1
+                self.max_lateness = max(self.max_lateness, -delay)
+
+        frame: av.VideoFrame = wrap_ndarray(self.batch.frames[self.position], "yuv420p")
+        frame.pts, frame.time_base = int(timestamp * VIDEO_CLOCK_RATE), VIDEO_TIME_BASE
+        self.position += 1
+        self.sent += 1
+        return frame
+
+    def stop(self) -> None:
+        super().stop()
+        self.reader.stop()
+
+
+def recorded_timestamps(recording: Recording) -> np.ndarray:
+    # Seconds from the first frame, from a "timestamps" modality if the
+    # recording has one, else at its frame rate
+    if "timestamps" in recording.modalities:
+        timestamps: np.ndarray = np.array(recording["timestamps"][:len(recording)], dtype=np.float64).ravel()
+        return timestamps - timestamps[0] if len(timestamps) > 0 else timestamps
+    return np.arange(len(recording), dtype=np.float64) / recording.fps
+
+
+def recorded_labels(recording: Recording, modality: str) -> np.ndarray:
+    # The label IDs the writer stored, else one pass over the recording
+    if modality in recording.labels:
+        return recording.labels[modality]
+    return np.unique(np.concatenate([np.unique(frame[modality]) for frame in recording.frames([modality])]))
+
+
+def frame_converter(
+    recording: Recording,
+    modality: str,
+    depth_range: tuple,
+    labels: Sequence[int]
+) -> Tuple[Callable[[np.ndarray, np.ndarray], None], tuple, int]:
+    # How a recorded frame is written into a yuv420p buffer, the buffer shape
+    # and the value the buffers start with
+    height, width = recording[modality].shape[1:3]
+    if modality == "rgb":
+        return (lambda rgb, out: cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV_I420, dst=out)), (height * 3 // 2, width), 0
+    if modality == "depth":
+        # The chroma of the packed depth stays 128
+        packer: DepthPacker = DepthPacker(*depth_range)
+        return (lambda depth, out: packer.pack(depth, out[:3 * height])), (3 * height * 3 // 2, width), 128
+    if modality == "semantic":
+        codec: SemanticCodec = None
+
+        def convert_semantic(semantic: np.ndarray, out: np.ndarray) -> None:
+            # The codec, and the labels if it needs them, are made on the
+            # first frame in the reader thread, not on the event loop
+            nonlocal codec
+            if codec is None:
+                codec = SemanticCodec(labels if labels is not None else recorded_labels(recording, modality))
+            codec.pack(semantic, out)
+        return convert_semantic, (height * 3 // 2, width), 0
+    raise ValueError(f"Cannot replay {modality}, only {', '.join(MODALITIES)}!")
+
+
+def start_replay(source: str, modalities: Sequence[str] = MODALITIES, **kwargs) -> List[ReplayStreamTrack]:
+    # One track per modality, all on one clock
+    clock: ReplayClock = ReplayClock()
+    return [ReplayStreamTrack(source, modality, clock, **kwargs) for modality in modalities]
@@ -1,2 +1,36 @@
 IP: str = "localhost"
-PORT: int = 1234
\ No newline at end of file
+PORT: int = 1234
+
+# Set to a file path (e.g. "timing.jsonl") to record connection setup timings
+TIMING_OUTPUT: str = None
+
+# Codec of the outgoing video ("VP8" or "H264"), its bitrate cap in bits per
+# second and the seconds between forced keyframes (None keeps aiortc's)
+VIDEO_CODEC: str = "H264"
+VIDEO_MAX_BITRATE: int = None
+KEYFRAME_INTERVAL: float = None
+
+# Adapt the bitrate, resolution and frame rate of the video to the link
+ADAPTIVE_RATE: bool = True
+
+# Send a fourth track of depth maps in metres, packed to survive the video
+# codec, replayed from DEPTH_DATA (a recording with a "depth" modality, or an
+# .npz with a "depth" array, converted to one on first use) or synthesized
+DEPTH_TRACK: bool = False
+DEPTH_RANGE: tuple = (0.0, 10.0)
+DEPTH_DATA: str = None
+# The packed depth only beats 8-bit grey with about 1 Mbps (see
+# benchmark_depth.py), its bitrate is kept above this
+DEPTH_MIN_BITRATE: int = 1000000
+
+# Replay a recording (see recording.py) instead of the camera and synthetic
+# tracks, one track per modality in REPLAY_MODALITIES ("rgb", "depth",
+# "semantic"), in that order, all started together
+REPLAY_DATA: str = None
+REPLAY_MODALITIES: tuple = ("rgb", "depth", "semantic")
+REPLAY_LOOP: bool = True
+
+# Capture, convert and encode each outgoing track in its own worker process,
+# the packets are sent as MEDIA_CODEC ("VP8" or "H264")
+MEDIA_PROCESSES: bool = False
+MEDIA_CODEC: str = "VP8"
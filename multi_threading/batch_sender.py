@@ -0,0 +1,156 @@
+import asyncio
+from typing import List
+
+from aiortc import RTCDataChannel
+
+from state_codec import StateCodec
+
+# bufferedAmount watermarks in bytes, a full SCTP window is about 128KB
+LOW_WATERMARK: int = 16 * 1024
+HIGH_WATERMARK: int = 64 * 1024
+
+
+class BatchSender:
+    """
+    Sends state updates on a data channel in as few messages as possible.
+
+    "batch" coalesces the updates arriving within window seconds of the first
+    pending one, or max_batch of them, into one message. "latest" keeps only
+    the newest update and sends at most one message per window, for state
+    whose old values are obsolete anyway. A window of 0 sends whatever piled
+    up while the event loop was busy.
+
+    Once the channel's bufferedAmount reaches high_watermark the link is
+    congested until it falls back to low_watermark, and the policy decides
+    what happens to the updates meanwhile: "drop" discards them, "coalesce"
+    keeps only the newest, "pause" keeps them all and producers should await
+    writable() so they stop producing.
+    """
+    def __init__(
+        self,
+        data_channel: RTCDataChannel,
+        codec: StateCodec,
+        mode: str = "latest",
+        window: float = 0.03,
+        max_batch: int = 32,
+        policy: str = "coalesce",
+        low_watermark: int = LOW_WATERMARK,
+        high_watermark: int = HIGH_WATERMARK
+    ) -> None:
+        if mode not in ("batch", "latest"):
+            raise ValueError("Invalid send mode!")
+        if policy not in ("drop", "coalesce", "pause"):
+            raise ValueError("Invalid congestion policy!")
+        if low_watermark >= high_watermark:
+            raise ValueError("The low watermark must be below the high watermark!")
+
+        self.data_channel: RTCDataChannel = data_channel
+        self.codec: StateCodec = codec
+        self.mode: str = mode
+        self.window: float = window
+        self.max_batch: int = max_batch
+        self.policy: str = policy
+        self.low_watermark: int = low_watermark
+        self.high_watermark: int = high_watermark
+        self.pending: List[dict] = []
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.drained: asyncio.Event = asyncio.Event()
+        self.drained.set()
+        self.congested: bool = False
+        self.stopped: bool = False
+        self.last_sent: float = None
+        self.messages: int = 0 # Messages on the wire
+        self.updates: int = 0 # State updates in them
+        self.coalesced: int = 0 # Updates replaced before being sent
+        self.dropped: int = 0 # Updates discarded while congested
+
+        data_channel.bufferedAmountLowThreshold = low_watermark
+        data_channel.on("bufferedamountlow", self.__on_buffered_amount_low)
+
+    def __on_buffered_amount_low(self) -> None:
+        self.congested = False
+        self.drained.set()
+
+    def __check_congestion(self) -> bool:
+        if not self.congested and self.data_channel.bufferedAmount >= self.high_watermark:
+            self.congested = True
+            self.drained.clear()
+        return self.congested
+
+    def put(self, state: dict) -> None:
+        if self.mode == "latest" and len(self.pending) > 0:
+            self.coalesced += 1
+            self.pending.clear()
+        self.pending.append(state)
+        self.wakeup.set()
+
+    async def writable(self) -> None:
+        # Only blocks with the "pause" policy, the others shed load themselves
+        if self.policy == "pause":
+            await self.drained.wait()
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.wakeup.set()
+        self.drained.set()
+
+    async def __wait_window(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.mode == "latest":
+            # Rate limit, an update after a quiet period goes out at once
+            if self.last_sent is not None:
+                await asyncio.sleep(self.last_sent + self.window - loop.time())
+            return
+
+        deadline: float = loop.time() + self.window
+        while len(self.pending) < self.max_batch and not self.stopped:
+            remaining: float = deadline - loop.time()
+            if remaining <= 0:
+                return
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def __coalesce(self) -> None:
+        self.coalesced += max(0, len(self.pending) - 1)
+        self.pending = self.pending[-1:]
+
+    async def __wait_drained(self) -> None:
+        if self.policy == "drop":
+            self.dropped += len(self.pending)
+            self.pending.clear()
+            return
+        if self.policy == "coalesce":
+            self.__coalesce()
+        await self.drained.wait()
+        if self.policy == "coalesce":
+            self.__coalesce() # Updates that arrived while waiting
+
+    def __flush(self) -> None:
+        states, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        if len(states) == 1:
+            message = self.codec.encode(states[0])
+        else:
+            message = self.codec.encode_batch(states)
+        self.data_channel.send(message)
+        self.last_sent = asyncio.get_running_loop().time()
+        self.messages += 1
+        self.updates += len(states)
+
+    async def run(self) -> None:
+        while not self.stopped and self.data_channel.readyState == "open":
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if len(self.pending) == 0:
+                continue
+            await self.__wait_window()
+            if self.__check_congestion():
+                await self.__wait_drained()
+            if self.stopped or self.data_channel.readyState != "open":
+                return
+            if len(self.pending) > 0:
+                self.__flush()
+            if len(self.pending) > 0:
+                self.wakeup.set()
@@ -0,0 +1,107 @@
+import time
+import asyncio
+import argparse
+import threading
+from copy import deepcopy
+from queue import Queue, Empty
+from typing import List
+
+import numpy as np
+
+from state_bridge import StateBridge
+
+
+def spinning_producer(producer_queue: Queue, stop: threading.Event) -> None:
+    # The previous mock_state_manager, stamped to measure latency. Its get()
+    # on a full queue could block forever when the consumer emptied it first
+    mock_state: dict = {"position": [1, 1, 1], "target": "Cat"}
+    while not stop.is_set():
+        if producer_queue.full():
+            try:
+                producer_queue.get_nowait()
+            except Empty:
+                pass
+        producer_queue.put(dict(deepcopy(mock_state), timestamp=time.perf_counter()))
+
+
+def bridge_producer(bridge: StateBridge, stop: threading.Event, rate: float) -> None:
+    # A sensor read at rate Hz, every reading is a change here
+    tick: int = 0
+    while not stop.is_set():
+        time.sleep(1 / rate)
+        tick += 1
+        bridge.publish({"position": [1 + tick * 0.01, 1, 1], "target": "Cat", "timestamp": time.perf_counter()})
+
+
+async def consume_queue(producer_queue: Queue, duration: float) -> List[float]:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    end: float = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        item: dict = await loop.run_in_executor(None, producer_queue.get)
+        latencies.append(time.perf_counter() - item["timestamp"])
+    return latencies
+
+
+async def consume_bridge(bridge: StateBridge, duration: float) -> List[float]:
+    latencies: List[float] = []
+    end: float = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        item: dict = await bridge.get()
+        latencies.append(time.perf_counter() - item["timestamp"])
+    return latencies
+
+
+async def measure_loop_latency(stop: asyncio.Event, interval: float = 0.005) -> List[float]:
+    # How late the event loop wakes a 5ms timer
+    lags: List[float] = []
+    while not stop.is_set():
+        start: float = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def run(name: str, duration: float, rate: float) -> None:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    stop: threading.Event = threading.Event()
+    probe_stop: asyncio.Event = asyncio.Event()
+    probe: asyncio.Task = asyncio.ensure_future(measure_loop_latency(probe_stop))
+
+    start_cpu, start = time.process_time(), time.perf_counter()
+    if name == "queue":
+        producer_queue: Queue = Queue(maxsize=10)
+        thread = threading.Thread(target=spinning_producer, args=(producer_queue, stop))
+        thread.start()
+        latencies: List[float] = await consume_queue(producer_queue, duration)
+    else:
+        bridge: StateBridge = StateBridge(loop)
+        thread = threading.Thread(target=bridge_producer, args=(bridge, stop, rate))
+        thread.start()
+        latencies = await consume_bridge(bridge, duration)
+    cpu: float = (time.process_time() - start_cpu) / (time.perf_counter() - start)
+    stop.set()
+    probe_stop.set()
+    lags: np.ndarray = np.array(await probe) * 1000
+    thread.join()
+
+    latencies: np.ndarray = np.array(latencies) * 1000
+    print(
+        f"{name:<7} CPU {cpu * 100:5.1f}% of a core, {len(latencies) / duration:8.0f} states/s taken, "
+        f"latency p50 {np.percentile(latencies, 50):6.3f}ms p99 {np.percentile(latencies, 99):6.3f}ms, "
+        f"loop lag p99 {np.percentile(lags, 99):5.2f}ms"
+    )
+
+
+async def benchmark(duration: float, rate: float) -> None:
+    await run("queue", duration, rate)
+    await run("bridge", duration, rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU and latency of the state hand-off from the producer thread")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=100, help="Sensor rate of the bridge producer")
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.duration, args.rate))
@@ -0,0 +1,87 @@
+import time
+import json
+import asyncio
+import argparse
+import threading
+from queue import Queue
+from typing import List
+
+import numpy as np
+
+from mock_station import offer, take_batch
+from state_codec import StateCodec, TARGET_STATE
+
+
+def polling_consumer(consumer_queue: Queue, stop: threading.Event, latencies: List[float]) -> None:
+    # The previous mock_syncronize_manager
+    while not stop.is_set():
+        if consumer_queue.qsize() == 0:
+            time.sleep(0.001)
+            continue
+
+        data: str = consumer_queue.get()
+        item_from_peer: dict = json.loads(data)
+        latencies.append(time.perf_counter() - item_from_peer["timestamp"])
+
+
+def batch_consumer(consumer_queue: Queue, stop: threading.Event, latencies: List[float]) -> None:
+    codec: StateCodec = StateCodec(TARGET_STATE)
+    while not stop.is_set():
+        batch: List[str] = take_batch(consumer_queue, 64, 0.1)
+        now: float = time.perf_counter()
+        for item_from_peer in codec.decode_many(batch):
+            latencies.append(now - item_from_peer["timestamp"])
+
+
+async def run(name: str, rate: float, duration: float) -> None:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    consumer_queue: Queue = Queue(maxsize=10 if name == "polling" else 256)
+    stop: threading.Event = threading.Event()
+    latencies: List[float] = []
+    consumer = polling_consumer if name == "polling" else batch_consumer
+    thread: threading.Thread = threading.Thread(target=consumer, args=(consumer_queue, stop, latencies))
+    thread.start()
+
+    # The previous on_message, one executor hop per message
+    async def on_message_executor(message: str) -> None:
+        await loop.run_in_executor(None, consumer_queue.put, message)
+        consumer_queue.task_done()
+
+    state: dict = {"position": [1, 1, 1], "target": "Cat"}
+    start_cpu, start = time.process_time(), time.perf_counter()
+    sent: int = 0
+    while time.perf_counter() - start < duration:
+        message: str = json.dumps(dict(state, timestamp=time.perf_counter()))
+        if name == "polling":
+            asyncio.ensure_future(on_message_executor(message)) # As the data channel emits it
+        else:
+            offer(consumer_queue, message)
+        sent += 1
+        await asyncio.sleep(start + sent / rate - time.perf_counter())
+    cpu: float = (time.process_time() - start_cpu) / (time.perf_counter() - start)
+    await asyncio.sleep(0.2)
+    stop.set()
+    thread.join()
+
+    latencies: np.ndarray = np.array(latencies) * 1000
+    print(
+        f"  {name:<8} CPU {cpu * 100:5.1f}% of a core, {len(latencies)} of {sent} consumed, "
+        f"latency p50 {np.percentile(latencies, 50):6.3f}ms p90 {np.percentile(latencies, 90):6.3f}ms "
+        f"p99 {np.percentile(latencies, 99):6.3f}ms"
+    )
+
+
+async def benchmark(rates: List[float], duration: float) -> None:
+    for rate in rates:
+        print(f"{rate:.0f} messages/s")
+        for name in ("polling", "batch"):
+            await run(name, rate, duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and CPU of the station's message consumer")
+    parser.add_argument("--rates", type=float, nargs="+", default=[30, 100, 1000])
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.rates, args.duration))
@@ -1,18 +1,21 @@
-import time
-import json
 import logging
 import asyncio
 import fractions
 from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 from queue import Queue
+from copy import deepcopy
 
 import av
 import cv2
 import numpy as np
 from aiortc import VideoStreamTrack, RTCDataChannel
 
-from signaling_utils import WebRTCClient, initiate_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, initiate_signaling
+from state_codec import StateCodec, TARGET_STATE
+from batch_sender import BatchSender
+from state_bridge import StateBridge
+from pacing import Pacer
 from settings import *
 
 
@@ -20,17 +23,26 @@ class JackalClient(WebRTCClient):
     def __init__(self, signaling_ip: str, signaling_port: int) -> None:
         super().__init__(signaling_ip, signaling_port)
         self.data_channel: RTCDataChannel = None
-        self.producer_queue: Queue = None
+        self.state_bridge: StateBridge = None
         self.consumer_queue: Queue = None
         self.loop: asyncio.AbstractEventLoop = None
+        self.codec: StateCodec = StateCodec(TARGET_STATE, STATE_ENCODING)
+        self.sender: BatchSender = None
 
     def __setup_datachannel_callbacks(self) -> None:
-        self.data_channel = self.pc.createDataChannel("datachannel")
+        data_channel: RTCDataChannel = self.pc.createDataChannel("datachannel")
+        self.data_channel = data_channel
+        sender: BatchSender = BatchSender(
+            data_channel, self.codec, SEND_MODE, SEND_WINDOW, policy=SEND_POLICY
+        )
+        self.sender = sender
 
         @self.data_channel.on("open")
         async def on_open() -> None:
             print("Data channel opened")
-            await self.__send_message()
+            self.mark("datachannel_open")
+            asyncio.ensure_future(sender.run())
+            await self.__send_message(data_channel, sender)
 
         @self.data_channel.on("message")
         def on_message(message: str) -> None:
@@ -39,30 +51,33 @@ class JackalClient(WebRTCClient):
         @self.data_channel.on("close")
         def on_close() -> None:
             print("Data channel closed")
+            sender.stop()
 
-    async def __send_message(self) -> None:
-        while True:
-            item_from_producer: dict = await self.loop.run_in_executor(
-                None, self.producer_queue.get
-            )
+    async def __send_message(self, data_channel: RTCDataChannel, sender: BatchSender) -> None:
+        while data_channel.readyState == "open":
+            # While the link is congested the bridge keeps only the latest state
+            await sender.writable()
+            item_from_producer: dict = await self.state_bridge.get()
 
-            data: bytes = json.dumps(item_from_producer)
-            self.data_channel.send(data)
-            self.producer_queue.task_done()
-            await asyncio.sleep(0.03) # about 25-30Hz
+            # The sender sets the rate, SEND_MODE decides what happens to the surplus
+            sender.put(item_from_producer)
     
+    def setup_peer_connection(self) -> None:
+        self.__setup_datachannel_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await initiate_signaling(self.pc, self.signaling, timer=self.timer)
+
     async def run(self) -> None:
         await super().run()
-        self.__setup_datachannel_callbacks()
-        await initiate_signaling(self.pc, self.signaling)
 
         await self.done.wait()
         await self.pc.close()
         await self.signaling.close()
         print("Jackal client stopped")
 
-    def set_producer_queue(self, queue: Queue) -> None:
-        self.producer_queue = queue
+    def set_state_bridge(self, bridge: StateBridge) -> None:
+        self.state_bridge = bridge
 
     def set_consumer_queue(self, queue: Queue) -> None:
         self.consumer_queue = queue
@@ -71,14 +86,20 @@ class JackalClient(WebRTCClient):
         self.loop = loop
 
 
-def mock_state_manager(producer_queue: Queue, event: asyncio.Event) -> None:
-    from copy import deepcopy
-
+def mock_state_manager(bridge: StateBridge, event: asyncio.Event, rate: float = 100) -> None:
     mock_state: dict = {"position": [1, 1, 1], "target": "Cat"}
+    last_state: dict = None
+    tick: int = 0
+    pacer: Pacer = Pacer(rate)
     while not event.is_set():
-        if producer_queue.full():
-            producer_queue.get()
-        producer_queue.put(deepcopy(mock_state))
+        pacer.tick_sync() # Stand-in for waiting on the robot's sensors
+        tick += 1
+        mock_state["position"][0] = 1 + tick // 10 * 0.01 # Moves every 10th reading
+
+        # Only changes are published, the bridge wakes the event loop for them
+        if mock_state != last_state:
+            last_state = deepcopy(mock_state)
+            bridge.publish(last_state)
 
 
 def empty_queue(queue: Queue) -> None:
@@ -92,16 +113,19 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
     initiator: JackalClient = JackalClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        initiator.set_timer(ConnectionTimer("jackal", TIMING_OUTPUT))
     executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
     loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-    producer_queue, consumer_queue = Queue(maxsize=10), Queue(maxsize=10)    
+    state_bridge: StateBridge = StateBridge(loop)
+    consumer_queue: Queue = Queue(maxsize=10)
 
     try:
         initiator.set_loop(loop)
-        initiator.set_producer_queue(producer_queue)
+        initiator.set_state_bridge(state_bridge)
         initiator.set_consumer_queue(consumer_queue)
 
-        loop.run_in_executor(executor, mock_state_manager, producer_queue, initiator.done)
+        loop.run_in_executor(executor, mock_state_manager, state_bridge, initiator.done)
         loop.run_until_complete(initiator.run())
     except KeyboardInterrupt:
         print("User interrupted the program")
@@ -110,7 +134,7 @@ if __name__ == "__main__":
     finally:
         print("Closing the program...")
         initiator.done.set()
-        empty_queue(producer_queue)
+        print(f"{state_bridge.published} states published, {state_bridge.dropped} superseded")
         empty_queue(consumer_queue)
         
         loop.close()   
@@ -1,19 +1,21 @@
-import time
-import json
 import logging
 import asyncio
-from queue import Queue
+from queue import Queue, Empty, Full
+from typing import Any, List
 from concurrent.futures import ThreadPoolExecutor
 
-from aiortc import RTCDataChannel, VideoStreamTrack
+from aiortc import RTCDataChannel
 
-from signaling_utils import WebRTCClient, receive_signaling
+from signaling_utils import WebRTCClient, ConnectionTimer, receive_signaling
+from state_codec import StateCodec, TARGET_STATE
 from settings import *
 
 
 class StationClient(WebRTCClient):
     def __init__(self, signaling_server_url: str, room_id: str) -> None:
         super().__init__(signaling_server_url, room_id)
+        # Wait for the Jackal's offer however long it takes
+        self.negotiation_timeout = None
         self.data_channel: RTCDataChannel = None
         self.producer_queue: Queue = None
         self.consumer_queue: Queue = None
@@ -27,20 +29,25 @@ class StationClient(WebRTCClient):
             @self.data_channel.on("open")
             def on_open() -> None:
                 print("Data channel opened by Jackal")
+                self.mark("datachannel_open")
 
             @self.data_channel.on("message")
-            async def on_message(message: str) -> None:
-                await self.loop.run_in_executor(None, self.consumer_queue.put, message) 
-                self.consumer_queue.task_done()   
+            def on_message(message: str) -> None:
+                # Never blocks the loop, the consumer thread takes messages in batches
+                offer(self.consumer_queue, message)
 
             @self.data_channel.on("close")
             def on_close() -> None:
                 print("Data channel closed by Jackal")
 
+    def setup_peer_connection(self) -> None:
+        self.__setup_datachannel_callbacks()
+
+    async def negotiate(self) -> asyncio.Task:
+        return await receive_signaling(self.pc, self.signaling, timer=self.timer)
+
     async def run(self) -> None:
         await super().run()
-        self.__setup_datachannel_callbacks()
-        await receive_signaling(self.pc, self.signaling)
 
         await self.done.wait()
         await self.pc.close()
@@ -57,15 +64,41 @@ class StationClient(WebRTCClient):
         self.loop = loop
 
 
+def offer(queue: Queue, item: Any) -> None:
+    # Non-blocking put, a full queue drops its oldest item
+    while True:
+        try:
+            queue.put_nowait(item)
+            return
+        except Full:
+            try:
+                queue.get_nowait()
+            except Empty:
+                pass
+
+
+def take_batch(queue: Queue, max_items: int, timeout: float) -> List[Any]:
+    # Blocks until the first item arrives or timeout, then takes what is queued
+    try:
+        batch: List[Any] = [queue.get(timeout=timeout)]
+    except Empty:
+        return []
+    while len(batch) < max_items:
+        try:
+            batch.append(queue.get_nowait())
+        except Empty:
+            break
+    return batch
+
+
 def mock_syncronize_manager(consumer_queue: Queue, event: asyncio.Event) -> None:
+    # Decodes both binary and JSON messages, whatever the Jackal sends
+    codec: StateCodec = StateCodec(TARGET_STATE)
     while not event.is_set():
-        if consumer_queue.qsize() == 0:
-            time.sleep(0.001)
-            continue
-
-        data: bytes = consumer_queue.get()
-        item_from_peer: dict = json.loads(data)
-        print(f"Received Jackal's message: {item_from_peer}")
+        # The timeout only bounds how long a stop request waits
+        batch: List[bytes] = take_batch(consumer_queue, 64, 0.1)
+        for item_from_peer in codec.decode_many(batch):
+            print(f"Received Jackal's message: {item_from_peer}")
 
 
 def empty_queue(queue: Queue) -> None:
@@ -79,9 +112,11 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
     receiver: StationClient = StationClient(IP, PORT)
+    if TIMING_OUTPUT is not None:
+        receiver.set_timer(ConnectionTimer("station", TIMING_OUTPUT))
     executor = ThreadPoolExecutor(max_workers=1)
     loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-    producer_queue, consumer_queue = Queue(maxsize=10), Queue(maxsize=10)    
+    producer_queue, consumer_queue = Queue(maxsize=10), Queue(maxsize=256)
 
     try:
         receiver.set_loop(loop)
@@ -1,2 +1,17 @@
 IP: str = "localhost"
-PORT: int = 1234
\ No newline at end of file
+PORT: int = 1234
+
+# Set to a file path (e.g. "timing.jsonl") to record connection setup timings
+TIMING_OUTPUT: str = None
+
+# "binary" packs state messages with a fixed schema, "json" sends them as text
+STATE_ENCODING: str = "binary"
+
+# "latest" sends only the newest state at most once per SEND_WINDOW seconds,
+# "batch" packs the updates of each SEND_WINDOW into one message
+SEND_MODE: str = "latest"
+SEND_WINDOW: float = 0.03
+
+# What to do with state updates while the data channel is congested:
+# "drop" them, "coalesce" them into the newest or "pause" the producer
+SEND_POLICY: str = "coalesce"
@@ -1,17 +1,26 @@
 import json
+import time
+import uuid
 import logging
 import asyncio
-from typing import Any
-from abc import ABC
+from typing import Any, Dict, List, Tuple
+from abc import ABC, abstractmethod
 
 import websockets
 from aiortc import (
+    RTCIceCandidate,
     RTCPeerConnection,
     RTCSessionDescription
 )
+from aiortc.sdp import candidate_from_sdp, candidate_to_sdp
 from aiortc.contrib.signaling import TcpSocketSignaling
 
 
+NEGOTIATION_TIMEOUT: float = 15.0
+RECONNECT_BASE_DELAY: float = 0.5
+RECONNECT_MAX_DELAY: float = 30.0
+
+
 class InvalidAnswerException(Exception):
     def __init__(self, message) -> None:
         super().__init__(message)
@@ -22,23 +31,96 @@ class InvalidOfferException(Exception):
         super().__init__(message)
 
 
+class ConnectionTimer:
+    """
+    Opt-in record of the connection setup of one client. Each mark is the time
+    elapsed since the timer was created (or reset for a new attempt), appended
+    as a JSON line to the output file when one is given.
+    """
+    def __init__(self, name: str, output: str = None) -> None:
+        self.name: str = name
+        self.output: str = output
+        self.attempt: int = 0
+        self.start: float = time.monotonic()
+        self.marks: List[Tuple[str, float]] = []
+
+    def reset(self) -> None:
+        self.attempt += 1
+        self.start = time.monotonic()
+        self.marks = []
+
+    def mark(self, event: str) -> None:
+        elapsed: float = time.monotonic() - self.start
+        self.marks.append((event, elapsed))
+        logging.info(f"{self.name} {event} after {elapsed * 1000:.1f}ms")
+        if self.output is not None:
+            with open(self.output, "a") as file:
+                file.write(json.dumps({
+                    "client": self.name,
+                    "attempt": self.attempt,
+                    "event": event,
+                    "elapsed": elapsed,
+                    "time": time.time()
+                }) + "\n")
+
+    def to_dict(self) -> Dict[str, float]:
+        # Later marks of a repeated event (e.g. an ICE state) win
+        return dict(self.marks)
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = [
+            "# HELP webrtc_setup_seconds Seconds from client start to a connection setup event",
+            "# TYPE webrtc_setup_seconds gauge"
+        ]
+        for event, elapsed in self.to_dict().items():
+            lines.append(
+                f'webrtc_setup_seconds{{client="{self.name}",attempt="{self.attempt}",event="{event}"}} {elapsed:.6f}'
+            )
+        return "\n".join(lines) + "\n"
+
+
 class WebSocketSignaling:
-    def __init__(self, uri: str) -> None:
+    def __init__(self, uri: str, room: str = "default", peer_id: str = None) -> None:
         self.uri: int = uri
+        self.room: str = room
+        self.peer_id: str = peer_id if peer_id is not None else uuid.uuid4().hex
+        # Counterpart peer, learned from the first message it sends us
+        self.remote_peer_id: str = None
+        self.websocket = None
+        # Messages put back for the next receive, see signaling_loop
+        self.pending: List[dict] = []
 
     async def connect(self) -> None:
         print("Connecting to websocket server...")
         self.websocket = await websockets.connect(self.uri)
-        print("Connected to websocket server")
+        await self.websocket.send(json.dumps({
+            "type": "join", "room": self.room, "peer": self.peer_id
+        }))
+        joined: dict = json.loads(await self.websocket.recv())
+        if joined.get("type") != "joined":
+            raise ValueError("Signaling server did not accept the join request!")
+        print(f"Connected to websocket server, joined room {self.room}")
 
     async def send(self, message: Any) -> None:
         print("Waiting for message sending to websocket server...")
+        if self.remote_peer_id is not None:
+            message = {**message, "to": self.remote_peer_id}
         await self.websocket.send(json.dumps(message))
         print("Message sent to websocket server")
 
+    def is_connected(self) -> bool:
+        return self.websocket is not None and self.websocket.close_code is None
+
+    def requeue(self, message: dict) -> None:
+        self.pending.append(message)
+
     async def receive(self) -> dict:
+        if len(self.pending) > 0:
+            return self.pending.pop(0)
         print("Waiting for message receiving from websocket server...")
         data: dict = json.loads(await self.websocket.recv())
+        if self.remote_peer_id is None:
+            self.remote_peer_id = data.get("from")
         print("Message received from websocket server")
         return data
 
@@ -48,10 +130,17 @@ class WebSocketSignaling:
 
 
 class WebRTCClient(ABC):
-    def __init__(self, signaling_ip: str, signaling_port: int, type: str = "websocket") -> None:
+    def __init__(
+        self,
+        signaling_ip: str,
+        signaling_port: int,
+        type: str = "websocket",
+        room: str = "default",
+        peer_id: str = None
+    ) -> None:
         if type == "websocket":
             self.signaling: WebSocketSignaling = WebSocketSignaling(
-                f"ws://{signaling_ip}:{signaling_port}"
+                f"ws://{signaling_ip}:{signaling_port}", room, peer_id
             )
         elif type == "tcp":
             self.signaling = TcpSocketSignaling(signaling_ip, signaling_port)
@@ -61,71 +150,312 @@ class WebRTCClient(ABC):
         self.pc = RTCPeerConnection()
         self.ice_connection_state: str = "new"
         self.done: asyncio.Event = asyncio.Event()
+        self.timer: ConnectionTimer = None
+        self.__marked: set = set()
+        # Answerers wait for the offer as long as it takes, see StationClient
+        self.negotiation_timeout: float = NEGOTIATION_TIMEOUT
+        self.signaling_task: asyncio.Task = None
+        self.reconnect_task: asyncio.Task = None
+        self.connected: asyncio.Event = asyncio.Event()
 
-    async def __setup(self) -> None:
-        await self.signaling.connect()
+    def set_timer(self, timer: ConnectionTimer) -> None:
+        self.timer = timer
 
-        @self.pc.on("icecandidate")
-        async def on_icecandidate(candidate) -> None:
-            await self.signaling.send({"ice": candidate})
+    def mark(self, event: str) -> None:
+        if self.timer is not None:
+            self.timer.mark(event)
 
-        @self.pc.on("iceconnectionstatechange")
+    def mark_once(self, event: str) -> None:
+        # For events on hot paths such as the first received frame
+        if event not in self.__marked:
+            self.__marked.add(event)
+            self.mark(event)
+
+    def setup_peer_connection(self) -> None:
+        """
+        Add the tracks, data channels and callbacks to self.pc, called again
+        for every peer connection rebuilt by the reconnect supervisor.
+        """
+
+    @abstractmethod
+    async def negotiate(self) -> asyncio.Task:
+        """
+        Exchange the descriptions of self.pc, returns the signaling loop task.
+        """
+
+    def __is_transport_lost(self, pc: RTCPeerConnection) -> bool:
+        # aiortc closes the whole peer connection once ICE consent expires, a
+        # close we did not ask for (see reconnect and run) is a failure too
+        return pc.iceConnectionState == "failed" or pc.connectionState in ("failed", "closed")
+
+    def __setup_peer_connection(self) -> None:
+        pc: RTCPeerConnection = self.pc
+        self.ice_connection_state = "new"
+        self.connected.clear()
+
+        @pc.on("icecandidate")
+        async def on_icecandidate(candidate: RTCIceCandidate) -> None:
+            await self.signaling.send(candidate_to_message(candidate))
+
+        @pc.on("iceconnectionstatechange")
         async def on_iceconnectionstatechange() -> None:
+            if pc is not self.pc:
+                return # Replaced by the reconnect supervisor
             print("ICE connection state is %s -> %s" % (
-                self.ice_connection_state, self.pc.iceConnectionState
+                self.ice_connection_state, pc.iceConnectionState
             ))
-            self.ice_connection_state = self.pc.iceConnectionState
-            if self.pc.iceConnectionState == "failed":
-                await self.pc.close()
-                await self.signaling.close()
+            self.ice_connection_state = pc.iceConnectionState
+            self.mark(f"ice_{pc.iceConnectionState}")
+            if self.__is_transport_lost(pc):
+                self.reconnect()
+
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange() -> None:
+            if pc is not self.pc:
+                return
+            # aiortc reports "connected" once the DTLS handshakes are done
+            if pc.connectionState == "connected":
+                self.mark("dtls_connected")
+                self.connected.set()
+            elif self.__is_transport_lost(pc):
+                self.reconnect()
+
+        self.setup_peer_connection()
+
+    async def __setup(self) -> None:
+        await self.signaling.connect()
+        self.mark("websocket_connected")
+        self.__setup_peer_connection()
+
+    async def __negotiate(self) -> None:
+        self.signaling_task = await asyncio.wait_for(self.negotiate(), self.negotiation_timeout)
+        self.signaling_task.add_done_callback(self.__on_signaling_done)
+
+    def __on_signaling_done(self, task: asyncio.Task) -> None:
+        # The signaling loop returns True when the remote peer sent a new offer
+        if not task.cancelled() and task.exception() is None and task.result():
+            self.reconnect()
+
+    def reconnect(self) -> None:
+        if self.done.is_set() or (self.reconnect_task is not None and not self.reconnect_task.done()):
+            return
+        self.reconnect_task = asyncio.ensure_future(self.__reconnect())
+
+    async def __restart_ice(self) -> bool:
+        # aiortc does not implement RTCPeerConnection.restartIce yet, until it
+        # does a failed transport always falls back to a new peer connection
+        if not hasattr(self.pc, "restartIce"):
+            return False
+        self.pc.restartIce()
+        self.signaling_task.cancel()
+        await self.__negotiate()
+        await asyncio.wait_for(self.connected.wait(), NEGOTIATION_TIMEOUT)
+        return True
+
+    async def __rebuild(self) -> None:
+        if self.signaling_task is not None:
+            self.signaling_task.cancel()
+        if self.timer is not None:
+            self.timer.reset()
+
+        # Callbacks of the old peer connection ignore it once it is replaced,
+        # setup_peer_connection adds the data channels to the new one.
+        pc: RTCPeerConnection = self.pc
+        self.pc = RTCPeerConnection()
+        await pc.close()
+        self.__setup_peer_connection()
+        if not self.signaling.is_connected():
+            await self.signaling.connect()
+            self.mark("websocket_connected")
+        await self.__negotiate()
+        await asyncio.wait_for(self.connected.wait(), NEGOTIATION_TIMEOUT)
+
+    async def __reconnect(self) -> None:
+        try:
+            if await self.__restart_ice():
+                return
+        except Exception as e:
+            logging.error(f"ICE restart failed: {e}")
+
+        attempt: int = 0
+        while not self.done.is_set():
+            try:
+                logging.info(f"Rebuilding peer connection, attempt {attempt + 1}")
+                await self.__rebuild()
+                logging.info("Peer connection rebuilt")
+                return
+            except Exception as e:
+                delay: float = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+                logging.error(f"Reconnect failed ({e!r}), retrying in {delay}s")
+                attempt += 1
+                await asyncio.sleep(delay)
 
     async def run(self) -> None:
         await self.__setup()
+        await self.__negotiate()
+
+
+def mark(timer: ConnectionTimer, event: str) -> None:
+    if timer is not None:
+        timer.mark(event)
+
+
+def candidate_to_message(candidate: RTCIceCandidate) -> dict:
+    # Same layout as the browser RTCIceCandidateInit, None ends the candidates
+    if candidate is None:
+        return {"ice": None}
+    return {"ice": {
+        "candidate": "candidate:" + candidate_to_sdp(candidate),
+        "sdpMid": candidate.sdpMid,
+        "sdpMLineIndex": candidate.sdpMLineIndex
+    }}
+
 
+def message_to_candidate(message: dict) -> RTCIceCandidate:
+    if message["ice"] is None:
+        return None
+    candidate: RTCIceCandidate = candidate_from_sdp(message["ice"]["candidate"].split(":", 1)[1])
+    candidate.sdpMid = message["ice"]["sdpMid"]
+    candidate.sdpMLineIndex = message["ice"]["sdpMLineIndex"]
+    return candidate
 
-async def initiate_signaling(pc: RTCPeerConnection, signaling: WebSocketSignaling) -> None:
+
+def get_local_candidates(pc: RTCPeerConnection) -> List[RTCIceCandidate]:
+    candidates: List[RTCIceCandidate] = []
+    mline_index, mid = -1, None
+    for line in pc.localDescription.sdp.splitlines():
+        if line.startswith("m="):
+            mline_index, mid = mline_index + 1, None
+        elif line.startswith("a=mid:"):
+            mid = line[len("a=mid:"):]
+        elif line.startswith("a=candidate:"):
+            candidate: RTCIceCandidate = candidate_from_sdp(line[len("a=candidate:"):])
+            candidate.sdpMid, candidate.sdpMLineIndex = mid, mline_index
+            candidates.append(candidate)
+    return candidates
+
+
+async def send_local_candidates(pc: RTCPeerConnection, signaling: WebSocketSignaling) -> None:
+    # aiortc gathers in setLocalDescription, trickle what it found and
+    # signal the end of candidates so the remote checks can complete
+    for candidate in get_local_candidates(pc):
+        await signaling.send(candidate_to_message(candidate))
+    await signaling.send(candidate_to_message(None))
+
+
+async def handle_message(pc: RTCPeerConnection, message: dict) -> None:
+    if "sdp" in message:
+        description = RTCSessionDescription(message["sdp"], message["type"])
+        await pc.setRemoteDescription(description)
+    elif "ice" in message:
+        await pc.addIceCandidate(message_to_candidate(message))
+    else:
+        logging.warning(f"Unknown signaling message: {message}")
+
+
+async def receive_description(pc: RTCPeerConnection, signaling: WebSocketSignaling, type: str) -> None:
+    # The remote peer always sends its description before its candidates, so
+    # anything received before it belongs to a previous session
+    while True:
+        message: dict = await signaling.receive()
+        if message.get("type") == type:
+            await handle_message(pc, message)
+            return
+        logging.info(f"Dropping stale signaling message: {message}")
+
+
+async def signaling_loop(pc: RTCPeerConnection, signaling: WebSocketSignaling) -> bool:
+    # Keep applying the messages that follow the description exchange, e.g.
+    # the candidates trickled by the remote peer. Returns True when the remote
+    # peer starts a new session, the offer is left for the next negotiation.
+    try:
+        while pc.connectionState != "closed":
+            message: dict = await signaling.receive()
+            if message.get("type") == "offer" and pc.remoteDescription is not None:
+                signaling.requeue(message)
+                return True
+            try:
+                await handle_message(pc, message)
+            except Exception as e:
+                logging.error(f"Failed to handle signaling message: {e!r}")
+    except websockets.exceptions.ConnectionClosed:
+        logging.info("Signaling connection closed")
+    return False
+
+
+async def initiate_signaling(
+    pc: RTCPeerConnection,
+    signaling: WebSocketSignaling,
+    trickle: bool = True,
+    timer: ConnectionTimer = None
+) -> asyncio.Task:
     if not isinstance(signaling, WebSocketSignaling):
         raise ValueError("signaling must be a WebSocketSignaling object!")
 
     # create sdp offer
     logging.info("Creating SDP offer...")
     offer = await pc.createOffer()
-    await pc.setLocalDescription(offer)
+    mark(timer, "offer_created")
+    if trickle:
+        # The offer goes out before gathering, so the remote peer can
+        # prepare its answer while our candidates are being gathered
+        logging.info("Sending SDP offer to signaling server...")
+        await signaling.send({"sdp": offer.sdp, "type": offer.type})
+        await pc.setLocalDescription(offer)
+        mark(timer, "local_description_set")
+        await send_local_candidates(pc, signaling)
+    else:
+        await pc.setLocalDescription(offer)
+        mark(timer, "local_description_set")
 
-    # send sdp offer to signaling server
-    logging.info("Sending SDP offer to signaling server...")
-    # await signaling.send(pc.localDescription)
-    await signaling.send({
-        "sdp": pc.localDescription.sdp,
-        "type": pc.localDescription.type
-    })
+        # send sdp offer to signaling server
+        logging.info("Sending SDP offer to signaling server...")
+        # await signaling.send(pc.localDescription)
+        await signaling.send({
+            "sdp": pc.localDescription.sdp,
+            "type": pc.localDescription.type
+        })
 
     # wait for sdp answer from signaling server
     logging.info("Waiting for SDP answer from signaling server...")
-    res = await signaling.receive()
-    answer = RTCSessionDescription(res["sdp"], res['type'])
-    await pc.setRemoteDescription(answer)
+    await receive_description(pc, signaling, "answer")
+    mark(timer, "answer_received")
+    return asyncio.ensure_future(signaling_loop(pc, signaling))
 
 
-async def receive_signaling(pc: RTCPeerConnection, signaling: WebSocketSignaling) -> None:
+async def receive_signaling(
+    pc: RTCPeerConnection,
+    signaling: WebSocketSignaling,
+    trickle: bool = True,
+    timer: ConnectionTimer = None
+) -> asyncio.Task:
     if not isinstance(signaling, WebSocketSignaling):
         raise ValueError("signaling must be a WebSocketSignaling object!")
 
     # receive sdp offer from signaling server
     logging.info("Waiting for SDP offer from signaling server...")
-    res = await signaling.receive()
-    offer = RTCSessionDescription(res["sdp"], res['type'])
-    await pc.setRemoteDescription(offer)
+    await receive_description(pc, signaling, "offer")
+    mark(timer, "offer_received")
 
     # create sdp answer
     logging.info("Creating SDP answer...")
     answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
-
-    # send sdp answer to signaling server
-    print("Sending SDP answer to signaling server...")
-    await signaling.send({
-        "sdp": pc.localDescription.sdp,
-        "type": pc.localDescription.type
-    })
-    # await signaling.send(pc.localDescription)
+    mark(timer, "answer_created")
+    if trickle:
+        print("Sending SDP answer to signaling server...")
+        await signaling.send({"sdp": answer.sdp, "type": answer.type})
+        await pc.setLocalDescription(answer)
+        mark(timer, "local_description_set")
+        await send_local_candidates(pc, signaling)
+    else:
+        await pc.setLocalDescription(answer)
+        mark(timer, "local_description_set")
+
+        # send sdp answer to signaling server
+        print("Sending SDP answer to signaling server...")
+        await signaling.send({
+            "sdp": pc.localDescription.sdp,
+            "type": pc.localDescription.type
+        })
+        # await signaling.send(pc.localDescription)
+    return asyncio.ensure_future(signaling_loop(pc, signaling))
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+from typing import Any
+
+
+class StateBridge:
+    """
+    Hands state from a producer thread to the event loop. The slot only holds
+    the latest value, publish() never blocks and wakes the loop through
+    call_soon_threadsafe once per fresh value, get() waits without tying up
+    an executor thread. Values overwritten before being taken are counted as
+    dropped.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.__lock: threading.Lock = threading.Lock()
+        self.__event: asyncio.Event = asyncio.Event()
+        self.__value: Any = None
+        self.__fresh: bool = False
+        self.published: int = 0
+        self.dropped: int = 0
+
+    def publish(self, value: Any) -> None:
+        # Called from the producer thread
+        with self.__lock:
+            wake: bool = not self.__fresh
+            if self.__fresh:
+                self.dropped += 1
+            self.__value, self.__fresh = value, True
+            self.published += 1
+        if wake:
+            try:
+                self.loop.call_soon_threadsafe(self.__event.set)
+            except RuntimeError:
+                pass # The loop is closed, nobody is waiting any more
+
+    async def get(self) -> Any:
+        # Called on the event loop, waits for a value not taken yet
+        while True:
+            with self.__lock:
+                if self.__fresh:
+                    self.__fresh = False
+                    return self.__value
+                # A later publish sees the slot empty and sets the event again
+                self.__event.clear()
+            await self.__event.wait()
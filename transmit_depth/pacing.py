@@ -0,0 +1,109 @@
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Dict
+
+DEFAULT_WINDOW: int = 300 # Ticks the jitter statistics cover
+
+
+class Pacer:
+    """
+    Paces one stream at rate ticks per second on the monotonic clock, for
+    tracks and senders alike, each with its own Pacer and rate. Every tick is
+    due at a fixed offset from the start, so waking up late never makes the
+    stream drift, and wall-clock jumps do not affect it. When whole ticks
+    were missed, because the loop stalled or the producer was slow, skip
+    drops them and carries on from the latest one due. Without skip they are
+    made up in a burst, as aiortc's next_timestamp does.
+    """
+    def __init__(self, rate: float, skip: bool = True, window: int = DEFAULT_WINDOW) -> None:
+        if rate <= 0:
+            raise ValueError("The rate must be positive!")
+
+        self.rate: float = rate
+        self.skip: bool = skip
+        self.ticks: int = 0
+        self.skipped: int = 0
+        self.__origin: float = None # Monotonic time of tick 0 at the current rate
+        self.__base: float = 0.0 # Stream time at the origin
+        self.__index: int = 0
+        self.__lateness: Deque[float] = deque(maxlen=window)
+        self.__times: Deque[float] = deque(maxlen=window)
+
+    @property
+    def period(self) -> float:
+        return 1.0 / self.rate
+
+    @property
+    def stream_time(self) -> float:
+        # Stream time of the last tick in seconds, the first one is at 0
+        return self.__base + self.__index / self.rate
+
+    def set_rate(self, rate: float) -> None:
+        if rate <= 0:
+            raise ValueError("The rate must be positive!")
+        if self.__origin is not None:
+            # The new schedule starts at the last tick
+            self.__origin += self.__index / self.rate
+            self.__base += self.__index / self.rate
+            self.__index = 0
+        self.rate = rate
+
+    def reset(self) -> None:
+        # The next tick starts a new schedule at stream time 0
+        self.__origin, self.__base, self.__index = None, 0.0, 0
+
+    def __next_due(self) -> float:
+        now: float = time.monotonic()
+        if self.__origin is None:
+            self.__origin = now
+            return now
+
+        self.__index += 1
+        due: float = self.__origin + self.__index / self.rate
+        if self.skip and now - due >= self.period:
+            missed: int = int((now - due) * self.rate)
+            self.__index += missed
+            self.skipped += missed
+            due = self.__origin + self.__index / self.rate
+        return due
+
+    def __record(self, due: float) -> float:
+        now: float = time.monotonic()
+        self.__lateness.append(now - due)
+        self.__times.append(now)
+        self.ticks += 1
+        return self.stream_time
+
+    async def tick(self) -> float:
+        # Waits for the next tick, returns its stream time
+        due: float = self.__next_due()
+        delay: float = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.__record(due)
+
+    def tick_sync(self, sleep: Callable[[float], object] = time.sleep) -> float:
+        # For threads and processes, sleep may be an Event's wait to stop early
+        due: float = self.__next_due()
+        delay: float = due - time.monotonic()
+        if delay > 0:
+            sleep(delay)
+        return self.__record(due)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        # Over the last window ticks, lateness is how long after its due time
+        # a tick was released
+        lateness = sorted(self.__lateness)
+        if len(lateness) == 0:
+            return {"ticks": self.ticks, "skipped": self.skipped}
+        span: float = self.__times[-1] - self.__times[0]
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "rate": (len(self.__times) - 1) / span if span > 0 else 0.0,
+            "jitter_mean": sum(lateness) / len(lateness),
+            "jitter_p95": lateness[int(0.95 * (len(lateness) - 1))],
+            "jitter_max": lateness[-1],
+        }
@@ -1,13 +1,14 @@
-import cv2
+import os
+import argparse
 import fractions
+import itertools
+from typing import Callable, Dict, Iterator, List, Tuple
+
 import numpy as np
 from av import VideoFrame
-from aiortc.jitterbuffer import JitterFrame
-from aiortc.codecs.vpx import Vp8Decoder, Vp8Encoder, vp8_depayload
-from aiortc.codecs.h264 import H264Decoder, H264Encoder, h264_depayload
-
 
-VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+from codec_benchmark import CODECS, CodecBenchmark, print_result, write_results
+from recording import Recording, open_recording
 
 
 def encode_to_rgba(image: np.ndarray) -> np.ndarray:
@@ -21,43 +22,83 @@ def decode_to_depth(image: np.ndarray) -> np.ndarray: # a -> high 1, b -> high 2
     return decoded_rgba.view(np.float32).reshape(image.shape[0], image.shape[1], 1)
 
 
-def create_video_frames(time_base=VIDEO_TIME_BASE):
-    data = np.load("transmit_depth/test_data.npz", allow_pickle=True)
-
-    frames = []
-    for i in range(100):
-        depth: np.ndarray = data["depth"][i % len(data["depth"])]
+class GrayDepth:
+    # Depth in [0, 1] scaled to uint8 and sent as a grey RGB image
+    def frame(self, depth: np.ndarray, pts: int, time_base: fractions.Fraction) -> VideoFrame:
         uint_depth: np.ndarray = (depth * 255).astype(np.uint8)
-        uint_depth = np.repeat(uint_depth, 3, axis=-1)
+        frame: VideoFrame = VideoFrame.from_ndarray(np.repeat(uint_depth, 3, axis=-1), format="rgb24")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: VideoFrame) -> np.ndarray:
+        decoded_rgb: np.ndarray = frame.to_ndarray(format="bgr24")
+        return np.mean(decoded_rgb, axis=2, keepdims=True, dtype=np.float32) / 255.0
+
+
+class FloatBytesDepth:
+    # The three high bytes of the float32 depth sent as RGB
+    def frame(self, depth: np.ndarray, pts: int, time_base: fractions.Fraction) -> VideoFrame:
+        rgb: np.ndarray = np.ascontiguousarray(encode_to_rgba(depth.astype(np.float32))[:, :, 1:])
+        frame: VideoFrame = VideoFrame.from_ndarray(rgb, format="rgb24")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: VideoFrame) -> np.ndarray:
+        return decode_to_depth(frame.to_ndarray(format="rgb24"))
 
-        uint_depth = cv2.cvtColor(uint_depth, cv2.COLOR_RGB2BGR)
-        frame: VideoFrame = VideoFrame.from_ndarray(uint_depth, format="rgb24")
-        frame.pts, frame.time_base = int(i / time_base / 30), time_base
-        frame.reformat(format="yuv420p")
-        frames.append(frame)
-    return frames
+
+def depth_error(decoded: np.ndarray, depth: np.ndarray) -> Dict[str, float]:
+    # Lossy bytes of a float can decode to NaN or inf
+    with np.errstate(invalid="ignore", over="ignore"):
+        error: np.ndarray = np.abs(decoded.astype(np.float64) - depth)
+    valid: np.ndarray = np.isfinite(error)
+    return {
+        "mae": float(error[valid].mean()) if valid.any() else float("nan"),
+        "rmse": float(np.sqrt(np.mean(error[valid] ** 2))) if valid.any() else float("nan"),
+        "invalid": 1.0 - float(valid.mean()),
+    }
+
+
+def synthetic_depth(count: int, width: int, height: int) -> Iterator[np.ndarray]:
+    # Depth in [0, 1]: a ramp towards the top with a disc moving across
+    rows, columns = np.mgrid[0:height, 0:width].astype(np.float32)
+    ramp: np.ndarray = 0.9 - 0.6 * rows / height
+    for i in range(count):
+        x: float = width / 2 + width / 3 * np.sin(i / 15)
+        disc: np.ndarray = (columns - x) ** 2 + (rows - height / 2) ** 2 < (height / 5) ** 2
+        yield np.where(disc, 0.2, ramp)[:, :, None].astype(np.float32)
+
+
+def load_inputs(path: str, count: int, width: int, height: int) -> Tuple[Callable[[], Iterator[np.ndarray]], str]:
+    # Inputs are produced lazily, one frame at a time, on every call
+    if os.path.exists(path):
+        recording: Recording = open_recording(path)
+        shape: tuple = recording["depth"].shape[1:3] + (1,)
+        def recorded() -> Iterator[np.ndarray]:
+            for frame in itertools.islice(recording.frames(["depth"], loop=True), count):
+                yield frame["depth"].reshape(shape)
+        return recorded, path
+    return lambda: synthetic_depth(count, width, height), f"synthetic {width}x{height} ({path} not found)"
 
 
 if __name__ == "__main__":
-    frames = create_video_frames()
-    # encoder, decoder = Vp8Encoder(), Vp8Decoder()
-    encoder, decoder = H264Encoder(), H264Decoder()
-
-    decoded_frames = []
-    for i, frame in enumerate(frames):
-        packages, timestamp = encoder.encode(frame)
-
-        data = b""
-        for package in packages:
-            # data += vp8_depayload(package)
-            data += h264_depayload(package)
-
-        frames = decoder.decode(JitterFrame(data=data, timestamp=timestamp))
-        decoded_frames.append(frames[0])
-
-    for i, frame in enumerate(decoded_frames):
-        decoded_rgb: np.ndarray = frame.to_ndarray(format='bgr24')
-        decoded_rgb = np.mean(decoded_rgb, axis=2).astype(np.uint8)
-        decoded_float_arr: np.ndarray = decoded_rgb.astype(np.float32) / 255.0
-        cv2.imshow("Decoded", decoded_float_arr)
-        cv2.waitKey(100)
+    parser = argparse.ArgumentParser(description="Headless encode/decode benchmark of depth sent over VP8 and H264")
+    parser.add_argument("--data", default=os.path.join("transmit_depth", "test_data.npz"))
+    parser.add_argument("--codec", nargs="+", choices=list(CODECS), default=list(CODECS))
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10, help="First frames left out of the results")
+    parser.add_argument("--width", type=int, default=640, help="Of the synthetic input")
+    parser.add_argument("--height", type=int, default=480, help="Of the synthetic input")
+    parser.add_argument("--bitrate", type=int, default=None, help="Target bitrate, aiortc's default if not set")
+    parser.add_argument("--output", default=None, help="JSON file of the results, printed if not set")
+    args = parser.parse_args()
+
+    depths, source = load_inputs(args.data, args.frames, args.width, args.height)
+    print(f"{args.frames} frames from {source}")
+    results: List[Dict[str, object]] = []
+    for codec in args.codec:
+        benchmark: CodecBenchmark = CodecBenchmark(codec, args.bitrate, args.warmup)
+        for method in (GrayDepth(), FloatBytesDepth()):
+            results.append(benchmark.run(method, depths(), depth_error))
+            print_result(results[-1])
+    write_results(args.output, "depth", dict(vars(args), source=source), results)
@@ -0,0 +1,81 @@
+import os
+import time
+import itertools
+import argparse
+import fractions
+from typing import Callable, Dict, List, Tuple
+
+import av
+import cv2
+import numpy as np
+
+from codec_benchmark import CODECS, CodecBenchmark
+from semantic_utils import SemanticCodec, synthetic_semantic
+from recording import Recording, open_recording
+
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {"480p": (640, 480), "1080p": (1920, 1080)}
+
+
+class DigitCodec:
+    # The base-10 digits of test_encode.py, 20 apart in each RGB channel
+    def frame(self, semantic: np.ndarray, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        semantic = semantic.reshape(semantic.shape[0], semantic.shape[1], 1)
+        rgb: np.ndarray = np.repeat(semantic, 3, axis=-1)
+        rgb[:, :, 2] = rgb[:, :, 2] % 10
+        rgb[:, :, 1] = (rgb[:, :, 1] // 10) % 10
+        rgb[:, :, 0] = rgb[:, :, 0] // 100
+        rgb = (rgb * 20).astype(np.uint8)
+        frame: av.VideoFrame = av.VideoFrame.from_ndarray(rgb, format="rgb24")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: av.VideoFrame, out: np.ndarray = None) -> np.ndarray:
+        decoded_rgb: np.ndarray = frame.to_ndarray(format="rgb24").astype(np.float32) / 20
+        decoded_rgb = np.round(decoded_rgb)
+        return np.dot(decoded_rgb, np.array([100, 10, 1])).astype(np.int32)
+
+
+def load_semantic(path: str, count: int, labels: int, width: int, height: int) -> Tuple[List[np.ndarray], np.ndarray, str]:
+    if os.path.exists(path):
+        recording: Recording = open_recording(path)
+        shape: tuple = recording["semantic"].shape[1:3]
+        semantics: List[np.ndarray] = []
+        for frame in itertools.islice(recording.frames(["semantic"], loop=True), count):
+            semantic: np.ndarray = np.asarray(frame["semantic"], dtype=np.int32).reshape(shape)
+            semantics.append(cv2.resize(semantic, (width, height), interpolation=cv2.INTER_NEAREST))
+        return semantics, np.unique(np.concatenate([np.unique(s) for s in semantics])), path
+    # Label IDs spread over the 0-999 the digit codec covers
+    ids: np.ndarray = np.sort(np.random.RandomState(1).choice(1000, labels, replace=False))
+    semantic_frame: Callable[[int], np.ndarray] = synthetic_semantic(ids, width, height)
+    return [semantic_frame(i) for i in range(count)], ids, f"synthetic scene ({path} not found)"
+
+
+def accuracy(labels: np.ndarray, semantic: np.ndarray) -> Dict[str, float]:
+    return {"accuracy": float(np.mean(labels == semantic))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label accuracy and time of semantic maps sent as base-10 digits vs a palette")
+    parser.add_argument("--data", default=os.path.join("..", "transmit_depth", "test_data.npz"))
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--warmup", type=int, default=20, help="First frames left out of the results")
+    parser.add_argument("--labels", type=int, default=50, help="Label count of the synthetic scene")
+    parser.add_argument("--bitrate", type=int, default=None, help="Target bitrate, aiortc's default if not set")
+    args = parser.parse_args()
+
+    for resolution, (width, height) in RESOLUTIONS.items():
+        semantics, labels, source = load_semantic(args.data, args.frames, args.labels, width, height)
+        start: float = time.perf_counter()
+        palette: SemanticCodec = SemanticCodec(labels)
+        print(
+            f"{resolution}: {len(semantics)} frames of {width}x{height} with {len(labels)} labels from {source}, "
+            f"palette built in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        for codec in CODECS:
+            benchmark: CodecBenchmark = CodecBenchmark(codec, args.bitrate, args.warmup)
+            for name, method in {"digits": DigitCodec(), "palette": palette}.items():
+                result: Dict[str, object] = benchmark.run(method, semantics, accuracy)
+                print(
+                    f"  {codec:<4} {name:<8} {result['kbps']:6.0f}kbps, encode {result['encode_ms']['mean']:5.1f}ms, "
+                    f"decode {result['decode_ms']['mean']:5.1f}ms, accuracy {result['error']['accuracy'] * 100:6.2f}%"
+                )
@@ -0,0 +1,230 @@
+import os
+import json
+import mmap
+import time
+import struct
+import argparse
+from typing import BinaryIO, Callable, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from pacing import Pacer
+
+METADATA_FILE: str = "recording.json"
+HEADER_SIZE: int = 128 # Fixed, so the frame count can be filled in when the writer closes
+RELEASE_FRAMES: int = 16 # Frames read before the pages behind them are dropped
+LABEL_MODALITIES: Tuple[str, ...] = ("semantic",) # Their label IDs go in the metadata
+
+
+class RecordingWriter:
+    """
+    Writes a recording as one uncompressed .npy file per modality (depth,
+    semantic, rgb, ...) in a directory, plus recording.json with the frame
+    rate and the label IDs of the semantic maps. Frames are appended to the files as they come, so a long session
+    never has to fit in memory; the .npy headers get their frame counts when
+    the writer closes.
+    """
+    def __init__(self, path: str, fps: float = 30.0) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path: str = path
+        self.fps: float = fps
+        self.files: Dict[str, BinaryIO] = {}
+        self.specs: Dict[str, Tuple[np.dtype, tuple]] = {}
+        self.counts: Dict[str, int] = {}
+        self.labels: Dict[str, np.ndarray] = {}
+
+    def append(self, name: str, frame: np.ndarray) -> None:
+        frame = np.asarray(frame) # Scalars too, e.g. a "timestamps" modality
+        if name not in self.files:
+            self.specs[name] = (frame.dtype, frame.shape)
+            self.counts[name] = 0
+            self.files[name] = open(os.path.join(self.path, f"{name}.npy"), "wb")
+            self.files[name].write(npy_header(frame.dtype, (0,) + frame.shape))
+        dtype, shape = self.specs[name]
+        if frame.shape != shape:
+            raise ValueError(f"Frame of shape {frame.shape} does not match the {shape} of {name}!")
+        self.files[name].write(np.ascontiguousarray(frame, dtype=dtype).data)
+        self.counts[name] += 1
+        if name in LABEL_MODALITIES:
+            # Collected as they come, so a replay need not scan the recording
+            ids: np.ndarray = np.unique(frame)
+            self.labels[name] = np.union1d(self.labels[name], ids) if name in self.labels else ids
+
+    def write(self, frames: Dict[str, np.ndarray]) -> None:
+        # One frame of each modality
+        for name, frame in frames.items():
+            self.append(name, frame)
+
+    def close(self) -> None:
+        for name, file in self.files.items():
+            dtype, shape = self.specs[name]
+            file.seek(0)
+            file.write(npy_header(dtype, (self.counts[name],) + shape))
+            file.close()
+        with open(os.path.join(self.path, METADATA_FILE), "w") as file:
+            labels: Dict[str, list] = {name: ids.tolist() for name, ids in self.labels.items()}
+            json.dump({"fps": self.fps, "modalities": self.counts, "labels": labels}, file, indent=2)
+        self.files = {}
+
+    def __enter__(self) -> "RecordingWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Recording:
+    """
+    Reads a recording written by RecordingWriter. Each modality is memory-
+    mapped, so opening it reads nothing and a frame is paged in only when it
+    is used. The generators hand out frames lazily as views of the mapping.
+    As they move on, the pages behind them are released, so even a long
+    session replays with constant memory.
+    """
+    def __init__(self, path: str) -> None:
+        with open(os.path.join(path, METADATA_FILE)) as file:
+            metadata: dict = json.load(file)
+
+        self.path: str = path
+        self.fps: float = metadata["fps"]
+        # Recordings written before the labels were stored have none
+        self.labels: Dict[str, np.ndarray] = {name: np.array(ids) for name, ids in metadata.get("labels", {}).items()}
+        self.mappings: Dict[str, mmap.mmap] = {}
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.offsets: Dict[str, int] = {}
+        for name in metadata["modalities"]:
+            self.mappings[name], self.arrays[name], self.offsets[name] = map_npy(os.path.join(path, f"{name}.npy"))
+
+    @property
+    def modalities(self) -> List[str]:
+        return list(self.arrays)
+
+    def __len__(self) -> int:
+        # Frames every modality has
+        return min(len(array) for array in self.arrays.values())
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def frame(self, index: int, modalities: Sequence[str] = None) -> Dict[str, np.ndarray]:
+        return {name: self.arrays[name][index] for name in modalities or self.modalities}
+
+    def release(self, stop: int) -> None:
+        # Drops the mapped pages of the frames before stop, they are read
+        # from the file again if needed
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        for name, array in self.arrays.items():
+            end: int = self.offsets[name] + min(stop, len(array)) * array.strides[0]
+            length: int = end // mmap.PAGESIZE * mmap.PAGESIZE
+            if length > 0:
+                self.mappings[name].madvise(mmap.MADV_DONTNEED, 0, length)
+
+    def frames(
+        self,
+        modalities: Sequence[str] = None,
+        start: int = 0,
+        stop: int = None,
+        loop: bool = False
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        # As fast as the consumer takes them, from start to stop, or over and
+        # over with loop
+        stop = len(self) if stop is None else min(stop, len(self))
+        if stop <= start:
+            return
+        while True:
+            for index in range(start, stop):
+                if index % RELEASE_FRAMES == 0:
+                    self.release(index)
+                yield self.frame(index, modalities)
+            if not loop:
+                return
+
+    def replay(
+        self,
+        modalities: Sequence[str] = None,
+        speed: float = 1.0,
+        loop: bool = False,
+        sleep: Callable[[float], object] = time.sleep
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        # At the recorded frame rate times speed, a consumer that falls behind
+        # skips frames rather than drifting from real time
+        pacer: Pacer = Pacer(self.fps * speed)
+        count: int = len(self)
+        released: int = 0
+        while count > 0:
+            index: int = round(pacer.tick_sync(sleep) * self.fps * speed)
+            if index >= count:
+                if not loop:
+                    return
+                index %= count
+            if abs(index - released) >= RELEASE_FRAMES:
+                self.release(index)
+                released = index
+            yield self.frame(index, modalities)
+
+    def close(self) -> None:
+        # Mappings with views still in use are closed once those are gone
+        self.arrays, self.mappings = {}, {}
+
+
+def npy_header(dtype: np.dtype, shape: tuple) -> bytes:
+    # A version 1.0 header padded to HEADER_SIZE
+    header: str = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(np.dtype(dtype)), shape)
+    if len(header) > HEADER_SIZE - 11:
+        raise ValueError(f"The .npy header of shape {shape} does not fit in {HEADER_SIZE} bytes!")
+    header = header.ljust(HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def map_npy(path: str) -> Tuple[mmap.mmap, np.ndarray, int]:
+    # Like np.load(mmap_mode="r"), but keeps the mapping so pages can be released
+    with open(path, "rb") as file:
+        version: Tuple[int, int] = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset: int = file.tell()
+        mapping: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    array: np.ndarray = np.ndarray(shape, dtype=dtype, buffer=mapping, offset=offset, order="F" if fortran_order else "C")
+    return mapping, array, offset
+
+
+def convert_npz(source: str, path: str, fps: float = 30.0) -> Recording:
+    # Each member is decompressed once and written out, one at a time
+    data = np.load(source, allow_pickle=True)
+    with RecordingWriter(path, fps) as writer:
+        for name in data.files:
+            member: np.ndarray = data[name]
+            if member.ndim == 0:
+                continue # Not per frame
+            for frame in member:
+                writer.append(name, np.asarray(frame))
+            del member
+    return Recording(path)
+
+
+def open_recording(path: str, fps: float = 30.0) -> Recording:
+    # An .npz is converted on first use to a recording next to it
+    if path.endswith(".npz"):
+        directory: str = path[:-len(".npz")]
+        if not os.path.exists(os.path.join(directory, METADATA_FILE)):
+            print(f"Converting {path} to {directory}")
+            return convert_npz(path, directory, fps)
+        path = directory
+    return Recording(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert an .npz of per-frame arrays to a memory-mapped recording")
+    parser.add_argument("source", help="The .npz, e.g. transmit_depth/test_data.npz")
+    parser.add_argument("path", help="Directory of the recording")
+    parser.add_argument("--fps", type=float, default=30.0)
+    args = parser.parse_args()
+
+    recording: Recording = convert_npz(args.source, args.path, args.fps)
+    for name in recording.modalities:
+        print(f"{name}: {recording[name].shape} {recording[name].dtype}")
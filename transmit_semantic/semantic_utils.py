@@ -0,0 +1,192 @@
+import fractions
+from typing import Callable, List, Sequence
+
+import av
+import cv2
+import numpy as np
+
+LUT_BITS: int = 6 # Per channel of the decoding 3D LUT, 64^3 cells
+LUMA_WEIGHT: float = 1.0
+CHROMA_WEIGHT: float = 0.5 # Chroma is subsampled and quantized harder than luma
+CANDIDATE_LEVELS: int = 32 # Per channel of the grid palette colours are picked from
+
+
+class SemanticCodec:
+    """
+    Carries semantic label maps over a video codec. Each label ID gets a
+    palette colour, picked greedily as far as possible from the others
+    (farthest point sampling) in a YUV space where luma counts more than
+    chroma. Encoding writes the palette colours straight into a yuv420p
+    buffer through per-plane lookup tables, with the chroma of each 2x2
+    block taken from its top-left label. Decoding quantizes every decoded
+    pixel to a cell of a 3D LUT that holds the label of the nearest palette
+    colour, so codec noise and chroma bleeding at edges still land on the
+    right label as long as they stay under half the palette spacing.
+    """
+    def __init__(self, labels: Sequence[int], buffers: int = 2) -> None:
+        self.labels: np.ndarray = np.unique(np.asarray(labels, dtype=np.int64))
+        if len(self.labels) == 0 or self.labels[0] < 0:
+            raise ValueError("Labels must be non-negative integers!")
+        if len(self.labels) > CANDIDATE_LEVELS ** 3:
+            raise ValueError("Too many labels for the palette!")
+
+        self.palette: np.ndarray = create_palette(len(self.labels))
+        # Label ID to plane value, unknown IDs get the colour of the first
+        # label. Lookups clip, so one entry past the last label catches the
+        # IDs above it.
+        size: int = int(self.labels[-1]) + 2
+        self.luma_lut: np.ndarray = np.full(size, self.palette[0, 0], dtype=np.uint8)
+        self.u_lut: np.ndarray = np.full(size, self.palette[0, 1], dtype=np.uint8)
+        self.v_lut: np.ndarray = np.full(size, self.palette[0, 2], dtype=np.uint8)
+        self.luma_lut[self.labels] = self.palette[:, 0]
+        self.u_lut[self.labels] = self.palette[:, 1]
+        self.v_lut[self.labels] = self.palette[:, 2]
+
+        self.decode_lut: np.ndarray = self.labels[nearest_palette(self.palette)].astype(np.int32)
+
+        self.buffer_count: int = buffers
+        self.buffers: List[np.ndarray] = []
+        self.index: int = 0
+        self.__scratch: List[np.ndarray] = []
+
+    def pack(self, semantic: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        # (H, W) labels to a (3H/2, W) yuv420p buffer
+        semantic = semantic.reshape(semantic.shape[:2])
+        height, width = semantic.shape
+        if height % 4 or width % 2:
+            raise ValueError("Semantic maps need a height divisible by 4 and an even width!")
+        if out is None:
+            out = np.empty((height * 3 // 2, width), dtype=np.uint8)
+        quarter: int = height // 4
+        block_labels: np.ndarray = semantic[::2, ::2]
+        np.take(self.luma_lut, semantic, out=out[:height], mode="clip")
+        np.take(self.u_lut, block_labels, out=out[height:height + quarter].reshape(block_labels.shape), mode="clip")
+        np.take(self.v_lut, block_labels, out=out[height + quarter:].reshape(block_labels.shape), mode="clip")
+        return out
+
+    def unpack(self, luma: np.ndarray, u: np.ndarray, v: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        # Decoded planes to (H, W) labels
+        height, width = luma.shape
+        if out is None:
+            out = np.empty((height, width), dtype=np.int32)
+        # The 3D LUT index is (Y >> shift, U >> shift, V >> shift) as bit fields
+        shift: int = 8 - LUT_BITS
+        index, chroma, luma_levels, chroma_levels = self.__scratch_buffers(height, width)
+        np.right_shift(u, shift, out=chroma_levels)
+        np.left_shift(chroma_levels, LUT_BITS, out=chroma, dtype=np.uint32)
+        np.right_shift(v, shift, out=chroma_levels)
+        np.bitwise_or(chroma, chroma_levels, out=chroma, dtype=np.uint32)
+        np.right_shift(luma, shift, out=luma_levels)
+        np.left_shift(luma_levels, 2 * LUT_BITS, out=index, dtype=np.uint32)
+        for row in range(2):
+            for column in range(2):
+                # Every pixel of a 2x2 block shares its chroma
+                block: np.ndarray = index[row::2, column::2]
+                np.bitwise_or(block, chroma, out=block)
+        np.take(self.decode_lut, index, out=out, mode="clip")
+        return out
+
+    def __scratch_buffers(self, height: int, width: int) -> List[np.ndarray]:
+        if len(self.__scratch) == 0 or self.__scratch[0].shape != (height, width):
+            self.__scratch = [
+                np.empty((height, width), dtype=np.uint32),
+                np.empty((height // 2, width // 2), dtype=np.uint32),
+                np.empty((height, width), dtype=np.uint8),
+                np.empty((height // 2, width // 2), dtype=np.uint8),
+            ]
+        return self.__scratch
+
+    def __next_buffer(self, height: int, width: int) -> np.ndarray:
+        shape: tuple = (height * 3 // 2, width)
+        if len(self.buffers) == 0 or self.buffers[0].shape != shape:
+            self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.buffer_count)]
+        buffer: np.ndarray = self.buffers[self.index]
+        self.index = (self.index + 1) % self.buffer_count
+        return buffer
+
+    def frame(self, semantic: np.ndarray, pts: int, time_base: fractions.Fraction) -> av.VideoFrame:
+        height, width = semantic.shape[:2]
+        buffer: np.ndarray = self.__next_buffer(height, width)
+        self.pack(semantic, buffer)
+        frame: av.VideoFrame = wrap_ndarray(buffer, "yuv420p")
+        frame.pts, frame.time_base = pts, time_base
+        return frame
+
+    def decode(self, frame: av.VideoFrame, out: np.ndarray = None) -> np.ndarray:
+        # Straight from the yuv420p planes, no conversion to RGB
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        planes: List[np.ndarray] = []
+        for plane in frame.planes:
+            data: np.ndarray = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)
+            planes.append(data[:, :plane.width])
+        return self.unpack(*planes, out=out)
+
+
+def create_palette(count: int) -> np.ndarray:
+    # Farthest point sampling over a grid of limited range YUV colours,
+    # starting from black
+    luma: np.ndarray = np.linspace(16, 235, CANDIDATE_LEVELS)
+    chroma: np.ndarray = np.linspace(16, 240, CANDIDATE_LEVELS)
+    candidates: np.ndarray = np.stack(np.meshgrid(luma, chroma, chroma, indexing="ij"), axis=-1).reshape(-1, 3)
+    scaled: np.ndarray = candidates * [LUMA_WEIGHT, CHROMA_WEIGHT, CHROMA_WEIGHT]
+
+    chosen: List[int] = [int(np.argmin(np.abs(candidates - [16, 128, 128]).sum(axis=1)))]
+    distance: np.ndarray = ((scaled - scaled[chosen[0]]) ** 2).sum(axis=1)
+    for _ in range(count - 1):
+        chosen.append(int(np.argmax(distance)))
+        np.minimum(distance, ((scaled - scaled[chosen[-1]]) ** 2).sum(axis=1), out=distance)
+    return np.rint(candidates[chosen]).astype(np.uint8)
+
+
+def nearest_palette(palette: np.ndarray, chunk: int = 1 << 16) -> np.ndarray:
+    # Index of the nearest palette colour for the centre of every 3D LUT cell,
+    # |c - p|^2 = |c|^2 - 2 c.p + |p|^2 and |c|^2 does not change the argmin
+    weights: np.ndarray = np.array([LUMA_WEIGHT, CHROMA_WEIGHT, CHROMA_WEIGHT], dtype=np.float32)
+    scaled: np.ndarray = palette.astype(np.float32) * weights
+    norms: np.ndarray = (scaled ** 2).sum(axis=1)
+    step: int = 1 << (8 - LUT_BITS)
+    centres: np.ndarray = np.arange(1 << LUT_BITS, dtype=np.float32) * step + (step - 1) / 2
+    cells: np.ndarray = np.stack(np.meshgrid(centres, centres, centres, indexing="ij"), axis=-1).reshape(-1, 3)
+    cells *= weights
+
+    nearest: np.ndarray = np.empty(len(cells), dtype=np.int64)
+    for start in range(0, len(cells), chunk):
+        scores: np.ndarray = norms - 2 * cells[start:start + chunk] @ scaled.T
+        nearest[start:start + chunk] = np.argmin(scores, axis=1)
+    return nearest
+
+
+def wrap_ndarray(array: np.ndarray, format: str) -> av.VideoFrame:
+    # from_numpy_buffer shares the memory of the array, older PyAV copies it
+    if hasattr(av.VideoFrame, "from_numpy_buffer"):
+        return av.VideoFrame.from_numpy_buffer(array, format=format)
+    return av.VideoFrame.from_ndarray(array, format=format)
+
+
+def synthetic_semantic(labels: Sequence[int], width: int = 640, height: int = 480, objects: int = 40) -> Callable[[int], np.ndarray]:
+    # Stand-in for a segmentation camera: sky, road and ground with boxes and
+    # discs of random labels drifting across, returns the map of a given frame
+    random: np.random.RandomState = np.random.RandomState(0)
+    labels = np.asarray(labels)
+    background: np.ndarray = np.empty((height, width), dtype=np.int32)
+    background[:height // 3] = labels[0]
+    background[height // 3:] = labels[1 % len(labels)]
+    road: np.ndarray = np.array([[width * 0.4, height / 3], [width * 0.6, height / 3], [width, height], [0, height]], dtype=np.int32)
+    cv2.fillPoly(background, [road], int(labels[2 % len(labels)]))
+
+    shapes: np.ndarray = random.rand(objects, 5) # x, y, size, speed, kind
+    shape_labels: np.ndarray = random.choice(labels, objects)
+
+    def semantic_frame(index: int) -> np.ndarray:
+        semantic: np.ndarray = background.copy()
+        for (x, y, size, speed, kind), label in zip(shapes, shape_labels):
+            center_x: int = int((x + (speed - 0.5) * index / 100) % 1.0 * width)
+            center_y: int = int((0.2 + 0.8 * y) * height)
+            radius: int = max(int(size * height / 8), 2)
+            if kind < 0.5:
+                cv2.rectangle(semantic, (center_x - radius, center_y - 2 * radius), (center_x + radius, center_y), int(label), -1)
+            else:
+                cv2.circle(semantic, (center_x, center_y), radius, int(label), -1)
+        return semantic
+    return semantic_frame
@@ -1,85 +1,65 @@
-import cv2
-import fractions
-import numpy as np
-from av import VideoFrame
-import matplotlib.pyplot as plt
-from aiortc.jitterbuffer import JitterFrame
-from aiortc.codecs.h264 import H264Decoder, H264Encoder, h264_depayload
-
-WEIGHTS: np.ndarray = np.array([100, 10, 1])
-VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
-
-
-def semantic_to_rgb(semantic: np.ndarray) -> np.ndarray:
-    rgb: np.ndarray = np.repeat(semantic, 3, axis=-1)
-    rgb[:, :, 2] = rgb[:, :, 2] % 10
-    rgb[:, :, 1] = (rgb[:, :, 1] // 10) % 10
-    rgb[:, :, 0] = rgb[:, :, 0] // 100
-    rgb = (rgb * 20).astype(np.uint8)
-    return rgb
+import os
+import argparse
+import itertools
+from typing import Callable, Dict, Iterator, List, Tuple
 
+import numpy as np
 
-def decode_to_semantic(rgb: np.ndarray) -> np.ndarray:
-    decoded_rgb: np.ndarray = rgb.astype(np.float32) / 20
-    decoded_rgb = np.round(decoded_rgb)
-    decoded_rgb = np.dot(decoded_rgb, WEIGHTS).reshape(decoded_rgb.shape[0], decoded_rgb.shape[1], 1)
-    return decoded_rgb.astype(np.int32)
-
-
-def create_video_frames(data, time_base=VIDEO_TIME_BASE):
-    frames = []
-    for i in range(100):
-        semantic: np.ndarray = data["semantic"][i % len(data["semantic"])]
-        rgb: np.ndarray = semantic_to_rgb(semantic)
-        rgb = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
-
-        frame: VideoFrame = VideoFrame.from_ndarray(rgb, format="rgb24")
-        frame.pts, frame.time_base = int(i / time_base / 30), time_base
-        frame.reformat(format="yuv420p")
-        frames.append(frame)
-    return frames
+from codec_benchmark import CODECS, CodecBenchmark, print_result, write_results
+from semantic_utils import SemanticCodec, synthetic_semantic
+from recording import Recording, open_recording
+
+
+def semantic_error(decoded: np.ndarray, semantic: np.ndarray, labels: np.ndarray) -> Dict[str, float]:
+    # Pixel accuracy and the mean intersection over union of the labels present
+    semantic = semantic.reshape(decoded.shape)
+    truth: np.ndarray = np.searchsorted(labels, semantic).ravel()
+    predicted: np.ndarray = np.searchsorted(labels, decoded).ravel()
+    confusion: np.ndarray = np.bincount(truth * len(labels) + predicted, minlength=len(labels) ** 2).reshape(len(labels), len(labels))
+    intersection: np.ndarray = np.diag(confusion)
+    union: np.ndarray = confusion.sum(axis=0) + confusion.sum(axis=1) - intersection
+    present: np.ndarray = confusion.sum(axis=1) > 0
+    return {
+        "accuracy": float(intersection.sum() / truth.size),
+        "mean_iou": float(np.mean(intersection[present] / union[present])),
+    }
+
+
+def load_inputs(path: str, count: int, labels: int, width: int, height: int) -> Tuple[Callable[[], Iterator[np.ndarray]], np.ndarray, str]:
+    # Inputs are produced lazily, one frame at a time, on every call
+    if os.path.exists(path):
+        recording: Recording = open_recording(path)
+        shape: tuple = recording["semantic"].shape[1:3]
+        def recorded() -> Iterator[np.ndarray]:
+            for frame in itertools.islice(recording.frames(["semantic"], loop=True), count):
+                yield frame["semantic"].reshape(shape)
+        # One pass over the frames for the labels they use
+        ids: np.ndarray = np.unique(np.concatenate([np.unique(semantic) for semantic in recorded()]))
+        return recorded, ids, path
+    ids = np.sort(np.random.RandomState(1).choice(1000, labels, replace=False))
+    semantic_frame = synthetic_semantic(ids, width, height)
+    return lambda: (semantic_frame(i) for i in range(count)), ids, f"synthetic {width}x{height} ({path} not found)"
 
 
 if __name__ == '__main__':
-    npz_data = np.load("transmit_depth/test_data.npz", allow_pickle=True)
-    frames = create_video_frames(npz_data)
-    encoder, decoder = H264Encoder(), H264Decoder()
-
-    decoded_frames = []
-    for i, frame in enumerate(frames):
-        packages, timestamp = encoder.encode(frame)
-
-        data = b""
-        for package in packages:
-            # data += vp8_depayload(package)
-            data += h264_depayload(package)
-
-        frames = decoder.decode(JitterFrame(data=data, timestamp=timestamp))
-        decoded_frames.append(frames[0])
-
-    fig, axs = plt.subplots(1, 2, figsize=(10, 5))
-    semantic0 = np.zeros((480, 640, 1), dtype=np.int32) # data['semantic'][0]
-    im0 = axs[0].imshow(semantic0, cmap='jet', vmin=0, vmax=800)
-    axs[0].set_title('Semantic Original')
-    fig.colorbar(im0, ax=axs[0])
-
-    semantic1 = np.zeros((480, 640, 1), dtype=np.int32) # data['semantic'][0]
-    im1 = axs[1].imshow(semantic1, cmap='jet', vmin=0, vmax=800)
-    axs[1].set_title('Semantic Decoded')
-    fig.colorbar(im1, ax=axs[1])
-
-    # for i, frame in enumerate(decoded_frames):
-    for i in range(len(npz_data['semantic'])):
-        semantic0: np.ndarray = npz_data["semantic"][i % len(npz_data["semantic"])]
-        frame = decoded_frames[i]
-        decoded_rgb: np.ndarray = frame.to_ndarray(format='bgr24')
-        print("RGB Shape", decoded_rgb.shape)
-        semantic1 = decode_to_semantic(decoded_rgb)
-        print("Original", semantic0, semantic0.shape)
-        print("Decoded", semantic1, semantic1.shape)
-        im0.set_data(semantic0)
-        im1.set_data(semantic1)
-        plt.pause(0.1)
-
-    plt.ioff()
-    plt.show()
+    parser = argparse.ArgumentParser(description="Headless encode/decode benchmark of semantic maps sent over VP8 and H264")
+    parser.add_argument("--data", default=os.path.join("transmit_depth", "test_data.npz"))
+    parser.add_argument("--codec", nargs="+", choices=list(CODECS), default=list(CODECS))
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10, help="First frames left out of the results")
+    parser.add_argument("--labels", type=int, default=50, help="Label count of the synthetic input")
+    parser.add_argument("--width", type=int, default=640, help="Of the synthetic input")
+    parser.add_argument("--height", type=int, default=480, help="Of the synthetic input")
+    parser.add_argument("--bitrate", type=int, default=None, help="Target bitrate, aiortc's default if not set")
+    parser.add_argument("--output", default=None, help="JSON file of the results, printed if not set")
+    args = parser.parse_args()
+
+    semantics, labels, source = load_inputs(args.data, args.frames, args.labels, args.width, args.height)
+    print(f"{args.frames} frames with {len(labels)} labels from {source}")
+    results: List[Dict[str, object]] = []
+    for codec in args.codec:
+        benchmark: CodecBenchmark = CodecBenchmark(codec, args.bitrate, args.warmup)
+        method: SemanticCodec = SemanticCodec(labels)
+        results.append(benchmark.run(method, semantics(), lambda decoded, semantic: semantic_error(decoded, semantic, method.labels)))
+        print_result(results[-1])
+    write_results(args.output, "semantic", dict(vars(args), source=source), results)